@@ -1,19 +1,35 @@
+import argparse
 import logging
+import math
+import os
 import platform
 import signal
 import sys
+import threading
 from typing import Any
 from typing import Callable
+from typing import List
 from typing import NoReturn
+from typing import Optional
 
 from flowd.integrations import Event
 from flowd.integrations import MicrosoftGraph
+from flowd.integrations.outbox import GraphOutbox
+from flowd.shipper import Shipper
 from flowd.supervisor import Supervisor
+from flowd.utils.profiler import PROFILE_DIR
+from flowd.utils.telemetry import MetricsServer
 
 EXIT_SIGNALS = [signal.SIGTERM, signal.SIGINT]
 if platform.system() == "Windows":
     EXIT_SIGNALS.append(signal.SIGBREAK)
 
+# toggles profiling; there's no such signal on Windows, use POST /profile on
+# the metrics endpoint there
+PROFILE_SIGNAL = getattr(signal, "SIGUSR1", None)
+PROFILE_SEC = 30.0
+MAX_PROFILE_SEC = 300.0  # for POST /profile, anyone on localhost can send it
+
 
 def on_quit(s: Supervisor) -> Callable:
     def quit(signo: int, _: Any) -> NoReturn:
@@ -24,16 +40,95 @@ def on_quit(s: Supervisor) -> Callable:
     return quit
 
 
+def start_outlook() -> None:
+    """Signs in to Outlook and blocks the focus time. Runs next to the collectors:
+    with a persisted token it's done in a moment, otherwise it waits for the user
+    to sign in through the browser without holding up collection. The event goes
+    through the outbox, which sends it once signed in and retries it as needed."""
+    try:
+        graph = MicrosoftGraph.from_env()
+        outbox = GraphOutbox(graph.session, ready=lambda: bool(graph.token))
+        outbox.schedule_focus_block(Event())
+        outbox.start()
+        if not graph.ensure_authenticated():
+            logging.error("could not sign in to Outlook")
+    except Exception as e:
+        logging.error(f"Outlook integration failed: {e}", exc_info=True)
+
+
+def toggle_profiler(s: Supervisor, duration: float = PROFILE_SEC) -> str:
+    if s.profiler.running:
+        s.profiler.stop()
+        return "profiler stopped\n"
+    s.profiler.start(duration)
+    return f"profiling for {duration:.0f}s, the profile goes to {s.profiler.output_dir}\n"
+
+
+def on_profile_signal(s: Supervisor) -> Callable:
+    def toggle(signo: int, _: Any) -> None:
+        toggle_profiler(s)
+
+    return toggle
+
+
+def on_profile_request(s: Supervisor) -> Callable:
+    def toggle(query: dict) -> str:
+        seconds = float(query.get("seconds", PROFILE_SEC))
+        if not math.isfinite(seconds) or seconds <= 0:
+            raise ValueError(f"seconds must be a positive number, got {seconds}")
+        return toggle_profiler(s, min(seconds, MAX_PROFILE_SEC))
+
+    return toggle
+
+
+def profile(argv: List[str]) -> None:
+    """`flowd profile`: runs the daemon for a bounded window under the sampling
+    profiler, then writes the profile and exits."""
+    parser = argparse.ArgumentParser(prog="flowd profile")
+    parser.add_argument("--seconds", type=float, default=PROFILE_SEC)
+    parser.add_argument("--interval", type=float, default=0.01, help="sampling interval")
+    parser.add_argument("--output-dir", default=PROFILE_DIR)
+    args = parser.parse_args(argv)
+
+    s = Supervisor()
+    s.profiler.interval = args.interval
+    s.profiler.output_dir = args.output_dir
+    s.configure()
+    threading.Thread(target=s.run, name="Supervisor", daemon=True).start()
+    s.profiler.start(args.seconds)
+    s.profiler.join()
+    s.stop(0.05)
+
+
+def _option(name: str) -> Optional[str]:
+    """The value of `--name value` on the command line, None if it's not there."""
+    if name in sys.argv[:-1]:
+        return sys.argv[sys.argv.index(name) + 1]
+    return None
+
+
 def main() -> None:
     logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
+    if sys.argv[1:2] == ["profile"]:
+        profile(sys.argv[2:])
+        return
+
     if "--with-outlook" in sys.argv:
-        graph = MicrosoftGraph.from_env()
-        graph.authenticate()
-        graph.schedule_meeting(Event())
+        threading.Thread(target=start_outlook, name="Outlook", daemon=True).start()
 
     s = Supervisor()
+    ship_to = _option("--ship-to") or os.environ.get("FLOWD_SHIP_URL")
+    if ship_to:
+        s.shipper = Shipper(ship_to)
+    if "--metrics" in sys.argv or "FLOWD_METRICS_PORT" in os.environ:
+        server = MetricsServer()
+        server.add_action("/profile", on_profile_request(s))
+        server.start()
+
     for sig in EXIT_SIGNALS:
         signal.signal(sig, on_quit(s))
+    if PROFILE_SIGNAL is not None:
+        signal.signal(PROFILE_SIGNAL, on_profile_signal(s))
     s.configure()
     s.run()
 
@@ -0,0 +1,77 @@
+import logging
+import time
+from typing import Callable
+from typing import Optional
+
+from flowd.utils import wnf
+
+FOCUS_OFF = 0
+FOCUS_ON = 2  # the "when I am using an app in full screen mode" rule
+
+
+class FocusController:
+    """Turns flow state predictions into focus assist mode changes.
+
+    Focus assist is turned on once a prediction reaches `enter_threshold` and
+    off once it drops to `exit_threshold`; anything in between keeps the
+    current mode. A mode is kept for at least `min_dwell` seconds, and the
+    WNF state is only written when the mode actually changes.
+    """
+
+    def __init__(
+        self,
+        backend: Optional[wnf.WnfBackend] = None,
+        enter_threshold: float = 75,
+        exit_threshold: float = 65,
+        min_dwell: float = 300,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        assert exit_threshold <= enter_threshold
+        self.backend = backend
+        self.enter_threshold = enter_threshold
+        self.exit_threshold = exit_threshold
+        self.min_dwell = min_dwell
+        self.clock = clock
+
+        # the last mode written, None before the first write
+        self.mode: Optional[int] = None
+        self._changed_at: Optional[float] = None
+        self.writes = 0
+
+    def _target(self, prediction: float) -> int:
+        if prediction >= self.enter_threshold:
+            return FOCUS_ON
+        if prediction <= self.exit_threshold or self.mode is None:
+            return FOCUS_OFF
+        return self.mode
+
+    def update(self, prediction: float, predicted_at: Optional[float] = None) -> bool:
+        """Applies a prediction (in %) started at `predicted_at` (on the
+        controller's clock, taken before inference so that the latency logged
+        covers it), returns whether the focus assist mode was written."""
+        now = self.clock()
+        target = self._target(prediction)
+        if target == self.mode:
+            return False
+
+        if self._changed_at is not None and now - self._changed_at < self.min_dwell:
+            logging.debug(
+                f"keeping focus mode {self.mode} for another "
+                f"{self.min_dwell - (now - self._changed_at):.0f}s"
+            )
+            return False
+
+        if not wnf.set_focus_mode(target, self.backend):
+            return False
+
+        written_at = self.clock()
+        if self.mode is not None:  # the initial sync doesn't hold the mode
+            self._changed_at = written_at
+        self.mode = target
+        self.writes += 1
+        latency = written_at - (predicted_at if predicted_at is not None else now)
+        logging.info(
+            f"focus assist {'on' if target == FOCUS_ON else 'off'} "
+            f"(prediction {prediction:.0f}%, applied {latency * 1000:.1f}ms after it)"
+        )
+        return True
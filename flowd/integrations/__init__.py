@@ -0,0 +1,5 @@
+from flowd.integrations.graph import Event
+from flowd.integrations.graph import MicrosoftGraph
+from flowd.integrations.graph import MicrosoftGraphError
+
+__all__ = ["Event", "MicrosoftGraph", "MicrosoftGraphError"]
@@ -0,0 +1,216 @@
+import bisect
+import datetime
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from flowd.integrations.session import GraphSession
+from flowd.integrations.session import MicrosoftGraphError
+
+DEFAULT_PATH = os.path.expanduser("~/flowd/calendar.sqlite")
+# the synced window, a new full sync starts when it runs out
+WINDOW_PAST = datetime.timedelta(days=1)
+WINDOW_FUTURE = datetime.timedelta(days=14)
+RESYNC_BEFORE_END = datetime.timedelta(days=7)
+PAGE_SIZE = 100
+
+Interval = Tuple[float, float]
+
+
+def parse_graph_time(value: Dict[str, str]) -> float:
+    """Graph date times ({"dateTime": ..., "timeZone": "UTC"}, we ask for UTC)
+    as a POSIX timestamp. Graph sends 7 fractional digits, strptime takes 6."""
+    whole, _, fraction = value["dateTime"].partition(".")
+    parsed = datetime.datetime.strptime(whole, "%Y-%m-%dT%H:%M:%S")
+    seconds = parsed.replace(tzinfo=datetime.timezone.utc).timestamp()
+    return seconds + float(f"0.{fraction}") if fraction else seconds
+
+
+def is_meeting(event: Dict[str, Any]) -> bool:
+    """Meetings are events with somebody else in them (or a call link) that
+    block the time. flowd's own focus blocks have neither."""
+    if event.get("isCancelled") or event.get("isAllDay"):
+        return False
+    if event.get("showAs") in ("free", "workingElsewhere"):
+        return False
+    return bool(event.get("attendees")) or bool(event.get("isOnlineMeeting"))
+
+
+class BusyIndex(object):
+    """Meeting intervals merged into disjoint busy blocks, with prefix sums,
+    so that point and range queries are a binary search each."""
+
+    def __init__(self, intervals: Iterable[Interval] = ()) -> None:
+        self.starts: List[float] = []
+        self.ends: List[float] = []
+        # busy seconds in the blocks before block i
+        self._busy_before: List[float] = [0.0]
+        for start, end in sorted(i for i in intervals if i[1] > i[0]):
+            if self.ends and start <= self.ends[-1]:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+        for start, end in zip(self.starts, self.ends):
+            self._busy_before.append(self._busy_before[-1] + end - start)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def is_busy(self, ts: float) -> bool:
+        i = bisect.bisect_right(self.starts, ts) - 1
+        return i >= 0 and ts < self.ends[i]
+
+    def _busy_until(self, ts: float) -> float:
+        i = bisect.bisect_right(self.starts, ts)
+        if i == 0:
+            return 0.0
+        return self._busy_before[i - 1] + min(ts, self.ends[i - 1]) - self.starts[i - 1]
+
+    def busy_seconds(self, start: float, end: float) -> float:
+        """Seconds of [start, end) spent in meetings."""
+        return max(self._busy_until(end) - self._busy_until(start), 0.0)
+
+
+class CalendarSync(object):
+    """Mirrors the meetings in the user's calendar with Graph delta queries.
+
+    The first sync pulls the events in a window around now, later ones only
+    what changed since, using the delta link kept in a local sqlite cache. So a
+    restart picks up where it left off. Queries go to an in-memory BusyIndex
+    rebuilt from the cache after every sync that changed anything.
+    """
+
+    def __init__(self, session: GraphSession, path: str = DEFAULT_PATH) -> None:
+        self.session = session
+        self.path = path
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self.index = BusyIndex()
+        self.requests = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS events (
+                    id TEXT PRIMARY KEY,
+                    start REAL NOT NULL,
+                    end REAL NOT NULL,
+                    meeting INTEGER NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS events_start ON events (start);
+                CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, value TEXT);
+                """
+            )
+            self._rebuild(db)
+            self._db = db
+        return self._db
+
+    @staticmethod
+    def _state(db: sqlite3.Connection, key: str) -> Optional[str]:
+        query = "SELECT value FROM sync_state WHERE key = ?"
+        row = db.execute(query, (key,)).fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _set_state(db: sqlite3.Connection, key: str, value: Optional[str]) -> None:
+        db.execute("INSERT OR REPLACE INTO sync_state VALUES (?, ?)", (key, value))
+
+    def _rebuild(self, db: sqlite3.Connection) -> None:
+        rows = db.execute("SELECT start, end FROM events WHERE meeting ORDER BY start")
+        self.index = BusyIndex(rows.fetchall())
+
+    def _initial_link(self, db: sqlite3.Connection, now: datetime.datetime) -> str:
+        start = (now - WINDOW_PAST).strftime("%Y-%m-%dT%H:%M:%SZ")
+        end = now + WINDOW_FUTURE
+        self._set_state(db, "window_end", str(end.timestamp()))
+        return (
+            f"/me/calendarView/delta?startDateTime={start}"
+            f"&endDateTime={end.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+        )
+
+    def _apply(self, db: sqlite3.Connection, items: List[Dict[str, Any]]) -> int:
+        removed = [(item["id"],) for item in items if "@removed" in item]
+        changed = []
+        for item in items:
+            if "@removed" in item:
+                continue
+            try:
+                start = parse_graph_time(item["start"])
+                end = parse_graph_time(item["end"])
+                changed.append((item["id"], start, end, is_meeting(item)))
+            except (KeyError, ValueError) as e:
+                logging.debug(f"skipping calendar item {item.get('id')}: {e}")
+        db.executemany("DELETE FROM events WHERE id = ?", removed)
+        db.executemany("INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?)", changed)
+        return len(removed) + len(changed)
+
+    def sync(self, now: Optional[datetime.datetime] = None) -> int:
+        """Pulls the changes since the last sync, returns how many events changed."""
+        now = now or datetime.datetime.now(datetime.timezone.utc)
+        with self._lock:
+            db = self._connect()
+            link = self._state(db, "delta_link")
+            window_end = self._state(db, "window_end")
+            full = (
+                link is None
+                or window_end is None
+                or float(window_end) < (now + RESYNC_BEFORE_END).timestamp()
+            )
+            if full:
+                link = self._initial_link(db, now)
+            changes = 0
+            with db:  # one transaction: a failed sync leaves the cache as it was
+                if full:
+                    db.execute("DELETE FROM events")
+                while link:
+                    self.requests += 1
+                    try:
+                        page = self.session.json(
+                            "GET",
+                            link,
+                            headers={
+                                "Prefer": 'outlook.timezone="UTC", '
+                                f"odata.maxpagesize={PAGE_SIZE}"
+                            },
+                        )
+                    except MicrosoftGraphError as e:
+                        if "syncStateNotFound" in str(e) or "resyncRequired" in str(e):
+                            # the delta token expired, start over next time
+                            db.execute("DELETE FROM sync_state WHERE key = 'delta_link'")
+                            logging.info("calendar delta token expired, resyncing")
+                            return 0
+                        raise
+                    changes += self._apply(db, page.get("value", []))
+                    link = page.get("@odata.nextLink")
+                    if "@odata.deltaLink" in page:
+                        self._set_state(db, "delta_link", page["@odata.deltaLink"])
+            if changes or full:
+                self._rebuild(db)
+            logging.debug(
+                f"calendar sync: {changes} changes, {len(self.index)} busy blocks"
+            )
+            return changes
+
+    def is_busy(self, ts: float) -> bool:
+        return self.index.is_busy(ts)
+
+    def busy_seconds(self, start: float, end: float) -> float:
+        return self.index.busy_seconds(start, end)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
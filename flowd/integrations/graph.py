@@ -4,6 +4,7 @@ import uuid
 import threading
 import webbrowser
 import datetime
+import time
 from typing import Any
 from typing import List
 from typing import Optional
@@ -11,13 +12,19 @@ from typing import Dict
 
 import msal
 import flask
-import requests
 from flask import request
 from werkzeug.serving import make_server
 
+from flowd.integrations.session import GraphSession
+from flowd.integrations.session import MicrosoftGraphError
+from flowd.integrations.token_cache import PersistentTokenCache
+
 app = flask.Flask(__name__)
 state = str(uuid.uuid4())
-cache = msal.SerializableTokenCache()
+cache = PersistentTokenCache()
+
+# refresh access tokens this long before they expire
+TOKEN_REFRESH_MARGIN_SEC = 300
 
 
 @app.route("/msal")
@@ -37,10 +44,6 @@ def endpoint_auth() -> Any:
     return flask.jsonify({"state": "success", "message": "ok"})
 
 
-class MicrosoftGraphError(Exception):
-    pass
-
-
 class Event:
     date_fmt = "%Y-%m-%dT%H:%M:%S.%f"
 
@@ -100,6 +103,11 @@ class MicrosoftGraph:
         self._redirect_url = f"http://{self._host}:{self._port}/msal"
         self._scopes: List[str] = ["User.ReadBasic.All", "Calendars.ReadWrite"]
 
+        self._token_lock = threading.Lock()
+        self._access_token = ""
+        self._token_expires_at = 0.0
+        self._session: Optional[GraphSession] = None
+
     @classmethod
     def from_env(cls) -> "MicrosoftGraph":
         if not cls.__instance:
@@ -127,16 +135,45 @@ class MicrosoftGraph:
 
         return self._client
 
+    @property
+    def session(self) -> GraphSession:
+        if not self._session:
+            self._session = GraphSession(
+                lambda: self.token, on_unauthorized=self.invalidate_token
+            )
+
+        return self._session
+
     @property
     def token(self) -> str:
-        accounts = self.client.get_accounts()
-        if not accounts:
-            return ""
+        """The access token, kept in memory until shortly before it expires
+        so that requests don't go through the MSAL cache every time."""
+        with self._token_lock:
+            if self._access_token and time.monotonic() < self._token_expires_at:
+                return self._access_token
+
+            accounts = self.client.get_accounts()
+            if not accounts:
+                return ""
+
+            token: Optional[Dict[str, Any]] = self.client.acquire_token_silent(
+                self._scopes, accounts[0]
+            )
+            if not token or "access_token" not in token:
+                return ""
+
+            self._access_token = token["access_token"]
+            self._token_expires_at = (
+                time.monotonic()
+                + int(token.get("expires_in", 0))
+                - TOKEN_REFRESH_MARGIN_SEC
+            )
+            return self._access_token
 
-        token: Dict[str, str] = self.client.acquire_token_silent(
-            self._scopes, accounts[0]
-        )
-        return token["access_token"]
+    def invalidate_token(self) -> None:
+        with self._token_lock:
+            self._access_token = ""
+            self._token_expires_at = 0.0
 
     def _acquire_token(self, code: str) -> Dict[str, Any]:
         token_data: Dict[str, Any] = self.client.acquire_token_by_authorization_code(
@@ -144,6 +181,15 @@ class MicrosoftGraph:
         )
         return token_data
 
+    def ensure_authenticated(self) -> bool:
+        """Signs in silently with the persisted token cache, and only goes
+        through the browser when that doesn't work. Blocks until signed in."""
+        if self.token:
+            logging.debug("signed in to Microsoft Graph with the cached token")
+            return True
+        self.authenticate()
+        return bool(self.token)
+
     def authenticate(self) -> None:
         url = self.client.get_authorization_request_url(
             self._scopes, state=state, redirect_uri=self._redirect_url
@@ -156,14 +202,19 @@ class MicrosoftGraph:
         webbrowser.open(url)
         srv.join()
 
-    def schedule_meeting(self, event: Event) -> None:
-        url = "https://graph.microsoft.com/v1.0/me/events"
-        rv = requests.post(
-            url, json=event.json(), headers={"Authorization": f"Bearer {self.token}"}
+    def schedule_meeting(self, event: Event) -> Dict[str, Any]:
+        rv = self.session.json(
+            "POST", "/me/events", expected=(200, 201), json=event.json()
         )
-        logging.debug(str(rv.json()))
-        if rv.status_code not in (200, 201):
-            raise MicrosoftGraphError(rv.json())
+        logging.debug(str(rv))
+        return rv
+
+    async def schedule_meeting_async(self, event: Event) -> Dict[str, Any]:
+        rv = await self.session.json_async(
+            "POST", "/me/events", expected=(200, 201), json=event.json()
+        )
+        logging.debug(str(rv))
+        return rv
 
 
 def _shutdown_after_request() -> None:
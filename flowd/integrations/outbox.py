@@ -0,0 +1,322 @@
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from flowd.integrations.graph import Event
+from flowd.integrations.session import GraphSession
+from flowd.integrations.session import MicrosoftGraphError
+from flowd.integrations.session import RETRY_STATUSES
+from flowd.utils import telemetry
+
+DEFAULT_PATH = os.path.expanduser("~/flowd/outbox.sqlite")
+BATCH_SIZE = 20  # the most Graph takes in one $batch
+POLL_SEC = 30.0
+MAX_ATTEMPTS = 10
+BACKOFF_SEC = 2.0
+MAX_BACKOFF_SEC = 600.0
+RETENTION_SEC = 7 * 86400  # how long sent and failed entries are kept
+PRUNE_SEC = 3600.0
+
+PENDING = "pending"
+SENDING = "sending"
+SENT = "sent"
+FAILED = "failed"
+
+
+class GraphOutbox(object):
+    """Graph writes queued in a local sqlite database and sent by a
+    background thread, so callers never wait for (or fail on) the network.
+
+    Entries are keyed by an idempotency key: enqueueing a key twice is a no-op,
+    and event creations carry it as their transactionId, so Graph doesn't
+    create a second event when a send is repeated after a crash or a lost
+    response. Sent and failed entries are deleted after RETENTION_SEC.
+    Overlapping focus blocks that haven't gone out yet are merged into one,
+    and new ones are trimmed to what's not covered by sent blocks.
+    Due entries go out in $batch requests of up to BATCH_SIZE, throttled and
+    failed ones are retried after Retry-After or an exponential backoff.
+    """
+
+    def __init__(
+        self,
+        session: GraphSession,
+        path: str = DEFAULT_PATH,
+        ready: Callable[[], bool] = lambda: True,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.session = session
+        self.path = path
+        self.ready = ready
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._quit = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pruned = 0.0
+        self.batches = 0
+
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS outbox (
+                    key TEXT PRIMARY KEY,
+                    method TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    body TEXT,
+                    focus_start REAL,  -- focus blocks only
+                    focus_end REAL,
+                    state TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    not_before REAL NOT NULL DEFAULT 0,
+                    created REAL NOT NULL,
+                    result TEXT
+                );
+                CREATE INDEX IF NOT EXISTS outbox_due ON outbox (state, not_before);
+                CREATE INDEX IF NOT EXISTS outbox_focus ON outbox (focus_start);
+                """
+            )
+        self._requeue()
+        telemetry.QUEUE_DEPTH.labels("graph_outbox").set_function(self.pending)
+
+    def _requeue(self) -> None:
+        """Whatever was on the way when sending stopped goes again,
+        transactionId makes it safe."""
+        with self._lock, self._db:
+            self._db.execute(
+                "UPDATE outbox SET state = ? WHERE state = ?", (PENDING, SENDING)
+            )
+
+    def pending(self) -> int:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT COUNT(*) FROM outbox WHERE state IN (?, ?)", (PENDING, SENDING)
+            ).fetchone()
+        return int(row[0])
+
+    def prune(self) -> int:
+        """Deletes sent and failed entries older than RETENTION_SEC, focus
+        blocks once they're over too. Returns how many were deleted."""
+        cutoff = self.clock() - RETENTION_SEC
+        with self._lock, self._db:
+            deleted = self._db.execute(
+                "DELETE FROM outbox WHERE state IN (?, ?) AND created < ?"
+                " AND (focus_end IS NULL OR focus_end < ?)",
+                (SENT, FAILED, cutoff, cutoff),
+            ).rowcount
+        self._pruned = self.clock()
+        return int(deleted)
+
+    def _insert(
+        self,
+        key: str,
+        method: str,
+        path: str,
+        body: Optional[Dict[str, Any]],
+        span: Tuple[Optional[float], Optional[float]] = (None, None),
+    ) -> None:
+        data = json.dumps(body) if body is not None else None
+        self._db.execute(
+            "INSERT OR IGNORE INTO outbox"
+            " (key, method, path, body, focus_start, focus_end, state, created)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, method, path, data, *span, PENDING, self.clock()),
+        )
+
+    def enqueue(
+        self,
+        method: str,
+        path: str,
+        body: Optional[Dict[str, Any]] = None,
+        key: Optional[str] = None,
+    ) -> str:
+        """Queues a Graph request, returns its idempotency key. Events created
+        with a POST to an events collection get the key as their transactionId."""
+        key = key or str(uuid.uuid4())
+        collection = path.split("?")[0].rstrip("/")
+        is_event = method.upper() == "POST" and collection.endswith("/events")
+        if is_event and body is not None and "transactionId" not in body:
+            body = dict(body, transactionId=key)
+        with self._lock, self._db:
+            self._insert(key, method, path, body)
+        self._wake.set()
+        return key
+
+    def schedule_focus_block(self, event: Event) -> Optional[str]:
+        """Queues an event blocking the time, merged with the queued ones it
+        overlaps. Returns its key, None when sent blocks cover it already."""
+        start, end = event.start.timestamp(), event.end.timestamp()
+        with self._lock, self._db:
+            for sent_start, sent_end in self._db.execute(
+                "SELECT focus_start, focus_end FROM outbox WHERE state IN (?, ?)"
+                " AND focus_start < ? AND focus_end > ? ORDER BY focus_start",
+                (SENT, SENDING, end, start),
+            ).fetchall():
+                if sent_start <= start:
+                    start = max(start, sent_end)
+                else:
+                    # a sent block in the middle: keep the part before it, one event
+                    # per block
+                    end = min(end, sent_start)
+            if end <= start:
+                return None
+            for queued_key, queued_start, queued_end in self._db.execute(
+                "SELECT key, focus_start, focus_end FROM outbox WHERE state = ?"
+                " AND focus_start <= ? AND focus_end >= ?",
+                (PENDING, end, start),
+            ).fetchall():
+                start, end = min(start, queued_start), max(end, queued_end)
+                self._db.execute("DELETE FROM outbox WHERE key = ?", (queued_key,))
+            key = f"focus-{uuid.uuid4()}"
+            merged = Event(
+                subject=event.subject,
+                description=event.description,
+                start=datetime.datetime.fromtimestamp(start, datetime.timezone.utc),
+                end=datetime.datetime.fromtimestamp(end, datetime.timezone.utc),
+                with_reminder=event.with_reminder,
+            )
+            body = dict(merged.json(), transactionId=key)
+            self._insert(key, "POST", "/me/events", body, (start, end))
+        self._wake.set()
+        return key
+
+    def _take(self) -> List[Dict[str, Any]]:
+        with self._lock, self._db:
+            rows = self._db.execute(
+                "SELECT key, method, path, body FROM outbox"
+                " WHERE state = ? AND not_before <= ? ORDER BY created LIMIT ?",
+                (PENDING, self.clock(), BATCH_SIZE),
+            ).fetchall()
+            self._db.executemany(
+                "UPDATE outbox SET state = ? WHERE key = ?",
+                [(SENDING, row[0]) for row in rows],
+            )
+        batch = []
+        for key, method, path, body in rows:
+            request: Dict[str, Any] = {"id": key, "method": method, "url": path}
+            if body:
+                request["body"] = json.loads(body)
+                request["headers"] = {"Content-Type": "application/json"}
+            batch.append(request)
+        return batch
+
+    def _next_due(self) -> Optional[float]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT MIN(not_before) FROM outbox WHERE state = ?", (PENDING,)
+            ).fetchone()
+        return None if row[0] is None else float(row[0])
+
+    def _finish(self, key: str, status: int, headers: Dict[str, str], body: Any) -> None:
+        with self._lock, self._db:
+            if 200 <= status < 300:
+                result = body.get("id") if isinstance(body, dict) else None
+                self._db.execute(
+                    "UPDATE outbox SET state = ?, result = ? WHERE key = ?",
+                    (SENT, result, key),
+                )
+                return
+            (attempts,) = self._db.execute(
+                "SELECT attempts FROM outbox WHERE key = ?", (key,)
+            ).fetchone()
+            attempts += 1
+            if status in RETRY_STATUSES and attempts < MAX_ATTEMPTS:
+                delay = min(BACKOFF_SEC * 2 ** attempts, MAX_BACKOFF_SEC)
+                lowered = {k.lower(): v for k, v in (headers or {}).items()}
+                retry_after = lowered.get("retry-after")
+                if retry_after is not None:
+                    try:
+                        delay = float(retry_after)
+                    except ValueError:
+                        pass
+                self._db.execute(
+                    "UPDATE outbox SET state = ?, attempts = ?, not_before = ?"
+                    " WHERE key = ?",
+                    (PENDING, attempts, self.clock() + delay, key),
+                )
+                return
+            logging.error(f"giving up on Graph request {key}: HTTP {status} {body}")
+            self._db.execute(
+                "UPDATE outbox SET state = ?, attempts = ?, result = ? WHERE key = ?",
+                (FAILED, attempts, json.dumps(body), key),
+            )
+
+    def flush(self) -> int:
+        """Sends one batch of due entries, returns how many were sent."""
+        batch = self._take()
+        if not batch:
+            return 0
+        self.batches += 1
+        try:
+            rv = self.session.json("POST", "/$batch", json={"requests": batch})
+        except MicrosoftGraphError as e:
+            logging.warning(f"Graph batch failed, retrying later: {e}")
+            for request in batch:
+                self._finish(request["id"], 503, {}, str(e))
+            return 0
+        responses = {r["id"]: r for r in rv.get("responses", [])}
+        for request in batch:
+            r = responses.get(request["id"], {"status": 503})
+            status = int(r["status"])
+            self._finish(request["id"], status, r.get("headers", {}), r.get("body"))
+        return len(batch)
+
+    def _step(self) -> float:
+        """One round of the worker, returns how long to wait for the next."""
+        if not self.ready():
+            return POLL_SEC
+        if self.clock() - self._pruned > PRUNE_SEC:
+            self.prune()
+        self._wake.clear()
+        if self.flush():
+            return 0.0
+        next_due = self._next_due()
+        if next_due is None:
+            return POLL_SEC
+        return min(max(next_due - self.clock(), 0.0), POLL_SEC)
+
+    def _run(self) -> None:
+        failures = 0
+        while not self._quit.is_set():
+            try:
+                timeout = self._step()
+                failures = 0
+            except Exception:
+                # e.g. the token refresh in ready() or the disk, keep the thread alive
+                failures += 1
+                timeout = min(BACKOFF_SEC * 2 ** failures, MAX_BACKOFF_SEC)
+                logging.exception(f"Graph outbox failed, retrying in {timeout:.0f}s")
+                try:
+                    self._requeue()
+                except sqlite3.Error:
+                    pass
+                self._quit.wait(timeout)
+                continue
+            if timeout:
+                self._wake.wait(timeout)
+
+    def start(self) -> None:
+        self._quit.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="GraphOutbox", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._quit.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
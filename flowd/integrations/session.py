@@ -0,0 +1,188 @@
+import asyncio
+import concurrent.futures
+import datetime
+import email.utils
+import functools
+import logging
+import os
+import random
+import time
+from typing import Any
+from typing import Callable
+from typing import Container
+from typing import Dict
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_BASE_URL = "https://graph.microsoft.com/v1.0"
+# throttling and transient server errors, everything else is final
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+# throttled, the request wasn't processed and can be sent again whatever it does
+THROTTLE_STATUSES = frozenset((429, 503))
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+
+class MicrosoftGraphError(Exception):
+    pass
+
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    """Seconds to wait from a Retry-After header, which holds either
+    seconds or an HTTP date. None when there's no (valid) header."""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    when: datetime.datetime
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return max((when - now).total_seconds(), 0.0)
+
+
+class GraphSession:
+    """Keep-alive connection pool for Microsoft Graph calls.
+
+    Requests that got throttled (429, 503) are retried, after Retry-After when
+    the response has one and with jittered exponential backoff otherwise.
+    Idempotent ones, and POSTs carrying a transactionId Graph deduplicates
+    on, are also retried after other transient server errors and failed
+    connections; for the rest the server may have acted on the request.
+    A 401 drops the cached token and retries once with a fresh one.
+    MS_GRAPH_URL points it to another server, e.g. the stand-in from
+    flowd.integrations.standin.
+    """
+
+    def __init__(
+        self,
+        token: Callable[[], str],
+        on_unauthorized: Optional[Callable[[], None]] = None,
+        base_url: Optional[str] = None,
+        pool_size: int = 8,
+        max_retries: int = 4,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        max_retry_after: float = 120.0,
+        timeout: float = 30.0,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        self.token = token
+        self.on_unauthorized = on_unauthorized
+        base_url = base_url or os.environ.get("MS_GRAPH_URL") or DEFAULT_BASE_URL
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.timeout = timeout
+        self.sleep = sleep
+        self.retries = 0
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+
+    def url(self, path: str) -> str:
+        """Paths are relative to the base URL, links Graph hands out (nextLink
+        etc.) are absolute."""
+        if path.startswith(("http://", "https://")):
+            return path
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def _backoff(self, attempt: int) -> float:
+        delay = min(self.max_backoff, self.backoff * 2.0 ** attempt)
+        return delay * random.uniform(0.5, 1.0)
+
+    @staticmethod
+    def _idempotent(method: str, kwargs: Dict[str, Any]) -> bool:
+        if method.upper() in IDEMPOTENT_METHODS:
+            return True
+        body = kwargs.get("json")
+        return isinstance(body, dict) and bool(body.get("transactionId"))
+
+    def request(self, method: str, path: str, **kwargs: Any) -> requests.Response:
+        """Sends a request, retrying as described above. Returns the last
+        response, whatever its status."""
+        headers = kwargs.pop("headers", {})
+        idempotent = self._idempotent(method, kwargs)
+        retry_statuses = RETRY_STATUSES if idempotent else THROTTLE_STATUSES
+        refreshed = False
+        attempt = 0
+        while True:
+            try:
+                rv = self._session.request(
+                    method,
+                    self.url(path),
+                    headers={"Authorization": f"Bearer {self.token()}", **headers},
+                    timeout=self.timeout,
+                    **kwargs,
+                )
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not idempotent or attempt >= self.max_retries:
+                    raise MicrosoftGraphError(f"{method} {path} failed: {e}") from e
+                delay = self._backoff(attempt)
+                logging.debug(f"{method} {path} failed ({e}), retrying in {delay:.1f}s")
+            else:
+                if rv.status_code == 401 and self.on_unauthorized and not refreshed:
+                    refreshed = True
+                    self.on_unauthorized()
+                    continue
+                if rv.status_code not in retry_statuses or attempt >= self.max_retries:
+                    return rv
+                after = retry_after(rv)
+                if after is None:
+                    after = self._backoff(attempt)
+                delay = min(after, self.max_retry_after)
+                logging.debug(
+                    f"{method} {path} got {rv.status_code}, retrying in {delay:.1f}s"
+                )
+            attempt += 1
+            self.retries += 1
+            self.sleep(delay)
+
+    def json(
+        self,
+        method: str,
+        path: str,
+        expected: Container[int] = (200, 201, 204),
+        **kwargs: Any,
+    ) -> Dict[str, Any]:
+        """`request()`, returning the JSON body. Raises MicrosoftGraphError for
+        unexpected statuses and bodies that aren't JSON (e.g. a proxy's 502 page)."""
+        rv = self.request(method, path, **kwargs)
+        try:
+            body: Dict[str, Any] = rv.json() if rv.content else {}
+        except ValueError as e:
+            raise MicrosoftGraphError(
+                f"{method} {path}: HTTP {rv.status_code}, not JSON: {rv.text[:200]!r}"
+            ) from e
+        if rv.status_code not in expected:
+            raise MicrosoftGraphError(body or f"{method} {path}: HTTP {rv.status_code}")
+        return body
+
+    async def json_async(self, method: str, path: str, **kwargs: Any) -> Dict[str, Any]:
+        """`json()` for asyncio code. Runs on a thread pool as big as the
+        connection pool, so concurrent calls share the pooled connections."""
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.pool_size, thread_name_prefix="graph"
+            )
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(self.json, method, path, **kwargs)
+        )
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._session.close()
@@ -0,0 +1,369 @@
+"""A local stand-in for the parts of Microsoft Graph flowd talks to.
+
+Good enough to exercise the client without an Azure tenant: point
+MS_GRAPH_URL at it. Running the module benchmarks the pooled client
+against one-connection-per-request calls, the 429 retry path and
+concurrent async calls:
+
+    python -m flowd.integrations.standin
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import socketserver
+import statistics
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+import requests
+
+from flowd.integrations.graph import Event
+from flowd.integrations.session import GraphSession
+
+API_PREFIX = "/v1.0"
+
+
+class StandInServer(socketserver.ThreadingMixIn, HTTPServer):
+    """Keeps connections alive (HTTP/1.1) and counts them.
+
+    `connect_delay` is slept once per new connection, standing in for the TCP
+    and TLS handshakes a real Graph connection costs. `throttle(n, after)`
+    answers the next n requests with 429 and Retry-After: after. Tokens in
+    `expired_tokens` get a 401.
+
+    The calendar keeps a change log, which /me/calendarView/delta pages
+    through like Graph does: an initial sync returns the events in the
+    window, delta links the ones changed or removed since.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, address: Tuple[str, int] = ("127.0.0.1", 0), connect_delay: float = 0.0
+    ) -> None:
+        super().__init__(address, _Handler)
+        self.connect_delay = connect_delay
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.requests = 0
+        self.expired_tokens: Set[str] = set()
+        self.events: Dict[str, Dict[str, Any]] = {}
+        self.calendar: Dict[str, Dict[str, Any]] = {}
+        self.calendar_version = 0
+        # event id -> version of its last change
+        self._calendar_changes: Dict[str, int] = {}
+        self._throttled = 0
+        self._retry_after = "0"
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def throttle(self, count: int, retry_after: str = "0") -> None:
+        with self.lock:
+            self._throttled = count
+            self._retry_after = retry_after
+
+    def take_throttle(self) -> Optional[str]:
+        with self.lock:
+            self.requests += 1
+            if self._throttled <= 0:
+                return None
+            self._throttled -= 1
+            return self._retry_after
+
+    def create_event(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """Like Graph, a POST repeating a transactionId returns the event it
+        created before."""
+        with self.lock:
+            transaction = body.get("transactionId")
+            if transaction:
+                for event in self.events.values():
+                    if event.get("transactionId") == transaction:
+                        return 201, event
+            event = dict(body, id=str(uuid.uuid4()))
+            self.events[event["id"]] = event
+            return 201, event
+
+    def _changed(self, event_id: str) -> None:
+        self.calendar_version += 1
+        self._calendar_changes[event_id] = self.calendar_version
+
+    def add_calendar_event(
+        self,
+        start: datetime.datetime,
+        end: datetime.datetime,
+        subject: str = "Sync",
+        attendees: int = 2,
+    ) -> str:
+        event_id = str(uuid.uuid4())
+        with self.lock:
+            self.calendar[event_id] = {
+                "id": event_id,
+                "subject": subject,
+                "start": {"dateTime": _graph_time(start), "timeZone": "UTC"},
+                "end": {"dateTime": _graph_time(end), "timeZone": "UTC"},
+                "showAs": "busy",
+                "isCancelled": False,
+                "attendees": [
+                    {"emailAddress": {"address": f"a{i}@example.com"}}
+                    for i in range(attendees)
+                ],
+            }
+            self._changed(event_id)
+        return event_id
+
+    def update_calendar_event(self, event_id: str, **fields: Any) -> None:
+        with self.lock:
+            self.calendar[event_id].update(fields)
+            self._changed(event_id)
+
+    def remove_calendar_event(self, event_id: str) -> None:
+        with self.lock:
+            del self.calendar[event_id]
+            self._changed(event_id)
+
+    def calendar_delta(
+        self, since: int, upto: int, window: Optional[Tuple[str, str]]
+    ) -> List[Dict[str, Any]]:
+        """Events changed in (since, upto], removed ones as @removed entries."""
+        with self.lock:
+            items = []
+            changes = sorted(self._calendar_changes.items(), key=lambda kv: kv[1])
+            for event_id, version in changes:
+                if not since < version <= upto:
+                    continue
+                event = self.calendar.get(event_id)
+                if event is None:
+                    if since:
+                        items.append({"id": event_id, "@removed": {"reason": "deleted"}})
+                elif window is None or (
+                    event["start"]["dateTime"] < window[1]
+                    and event["end"]["dateTime"] > window[0]
+                ):
+                    items.append(dict(event))
+            return items
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="StandInGraph", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+
+def _graph_time(value: datetime.datetime) -> str:
+    return value.astimezone(datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.0000000")
+
+
+def _query_time(value: str) -> str:
+    """A startDateTime/endDateTime query parameter as _graph_time() formats it."""
+    when = datetime.datetime.strptime(value, "%Y-%m-%dT%H:%M:%SZ")
+    return _graph_time(when.replace(tzinfo=datetime.timezone.utc))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: StandInServer
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, don't let them wait for delayed ACKs
+    disable_nagle_algorithm = True
+
+    def setup(self) -> None:
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+        time.sleep(self.server.connect_delay)
+
+    def _reply(
+        self,
+        status: int,
+        body: Optional[Dict[str, Any]] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> None:
+        data = json.dumps(body).encode("utf8") if body is not None else b""
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self) -> Any:
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def _route(self, method: str) -> None:
+        body = self._body()
+        authorization = self.headers.get("Authorization", "")
+        if (
+            not authorization.startswith("Bearer ")
+            or authorization[len("Bearer "):] in self.server.expired_tokens
+        ):
+            return self._reply(401, {"error": {"code": "InvalidAuthenticationToken"}})
+        path = self.path.split("?")[0]
+        if path.startswith(API_PREFIX):
+            path = path[len(API_PREFIX):]
+        if path == "/$batch":  # throttled per request inside the batch
+            return self.post_batch(body)
+        retry_after = self.server.take_throttle()
+        if retry_after is not None:
+            return self._reply(
+                429, {"error": {"code": "TooManyRequests"}}, {"Retry-After": retry_after}
+            )
+        handler = getattr(self, f"{method}_{path.strip('/').replace('/', '_')}", None)
+        if handler is None:
+            return self._reply(404, {"error": {"code": "ResourceNotFound"}})
+        handler(body)
+
+    def do_GET(self) -> None:
+        self._route("get")
+
+    def do_POST(self) -> None:
+        self._route("post")
+
+    def post_me_events(self, body: Dict[str, Any]) -> None:
+        self._reply(*self.server.create_event(body))
+
+    def post_batch(self, body: Dict[str, Any]) -> None:
+        """JSON $batch, only event creation is supported inside."""
+        responses = []
+        for sub in body.get("requests", []):
+            response: Dict[str, Any] = {"id": sub["id"]}
+            retry_after = self.server.take_throttle()
+            if retry_after is not None:
+                response.update(
+                    status=429,
+                    headers={"Retry-After": retry_after},
+                    body={"error": {"code": "TooManyRequests"}},
+                )
+            elif sub["method"] == "POST" and sub["url"].split("?")[0] == "/me/events":
+                status, created = self.server.create_event(sub.get("body", {}))
+                response.update(status=status, body=created)
+            else:
+                response.update(status=404, body={"error": {"code": "ResourceNotFound"}})
+            responses.append(response)
+        self._reply(200, {"responses": responses})
+
+    def get_me_calendarView_delta(self, body: Any) -> None:
+        query = {k: v[0] for k, v in parse_qs(urlsplit(self.path).query).items()}
+        page_size = 10
+        prefer = self.headers.get("Prefer", "")
+        if "odata.maxpagesize=" in prefer:
+            page_size = int(prefer.split("odata.maxpagesize=")[1].split(",")[0])
+        if "$skiptoken" in query:
+            since, upto, offset = (int(v) for v in query["$skiptoken"].split("."))
+        else:
+            since, upto = int(query.get("$deltatoken", 0)), self.server.calendar_version
+            offset = 0
+        window: Optional[Tuple[str, str]] = None
+        extra = ""
+        if not since and "startDateTime" in query:
+            start, end = query["startDateTime"], query["endDateTime"]
+            extra = f"&startDateTime={start}&endDateTime={end}"
+            window = (_query_time(start), _query_time(end))
+        items = self.server.calendar_delta(since, upto, window)
+        page: Dict[str, Any] = {"value": items[offset:offset + page_size]}
+        base = f"{self.server.url}/me/calendarView/delta"
+        if offset + page_size < len(items):
+            skiptoken = f"{since}.{upto}.{offset + page_size}"
+            page["@odata.nextLink"] = f"{base}?$skiptoken={skiptoken}{extra}"
+        else:
+            page["@odata.deltaLink"] = f"{base}?$deltatoken={upto}"
+        self._reply(200, page)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.debug(f"stand-in graph: {format % args}")
+
+
+def _latencies(call: Callable[[], Any], n: int) -> Tuple[float, float]:
+    samples = []
+    for _ in range(n):
+        started = time.perf_counter()
+        call()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return statistics.median(samples) * 1000, samples[int(len(samples) * 0.95) - 1] * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", type=int, default=200, help="requests per scenario")
+    parser.add_argument(
+        "--connect-delay", type=float, default=0.02,
+        help="simulated handshake cost of a new connection, in seconds",
+    )
+    args = parser.parse_args()
+
+    server = StandInServer(connect_delay=args.connect_delay).start()
+    headers = {"Authorization": "Bearer stand-in"}
+    event = Event().json()
+
+    def unpooled() -> None:
+        rv = requests.post(f"{server.url}/me/events", json=event, headers=headers)
+        rv.raise_for_status()
+
+    median, p95 = _latencies(unpooled, args.n)
+    print(
+        f"one connection per request: median {median:.2f} ms, p95 {p95:.2f} ms, "
+        f"{server.connections} connections"
+    )
+
+    server.connections = 0
+    session = GraphSession(lambda: "stand-in", base_url=server.url)
+    median, p95 = _latencies(
+        lambda: session.json("POST", "/me/events", json=event), args.n
+    )
+    print(
+        f"pooled session:             median {median:.2f} ms, p95 {p95:.2f} ms, "
+        f"{server.connections} connections"
+    )
+
+    server.throttle(2, "1")
+    started = time.perf_counter()
+    session.json("POST", "/me/events", json=event)
+    elapsed = time.perf_counter() - started
+    print(
+        f"2x 429 with Retry-After: 1: succeeded after {elapsed:.2f}s, "
+        f"{session.retries} retries"
+    )
+
+    async def burst(count: int) -> float:
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(session.json_async("POST", "/me/events", json=event) for _ in range(count))
+        )
+        return time.perf_counter() - started
+
+    server.connections = 0
+    elapsed = asyncio.get_event_loop().run_until_complete(burst(args.n))
+    print(
+        f"{args.n} concurrent async calls: {elapsed:.2f}s, "
+        f"{server.connections} connections (pool size {session.pool_size})"
+    )
+    session.close()
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
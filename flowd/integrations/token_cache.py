@@ -0,0 +1,177 @@
+import contextlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import msal
+
+DEFAULT_PATH = os.path.expanduser("~/flowd/msal_token_cache.bin")
+LOCK_TIMEOUT_SEC = 10.0
+LOCK_POLL_SEC = 0.05
+
+
+def _protect(data: bytes) -> bytes:
+    """Encrypts for the current Windows user with DPAPI. Elsewhere the data is
+    stored as is and the file permissions (0600) protect it."""
+    if sys.platform != "win32":
+        return data
+    import win32crypt
+
+    description = "flowd MSAL token cache"
+    protected: bytes = win32crypt.CryptProtectData(data, description, None, None, None, 0)
+    return protected
+
+
+def _unprotect(data: bytes) -> bytes:
+    if sys.platform != "win32":
+        return data
+    import win32crypt
+
+    unprotected: bytes = win32crypt.CryptUnprotectData(data, None, None, None, 0)[1]
+    return unprotected
+
+
+@contextlib.contextmanager
+def file_lock(path: str, timeout: float = LOCK_TIMEOUT_SEC) -> Iterator[None]:
+    """An exclusive lock on `path` shared with other processes, e.g. a second
+    flowd instance or the Outlook auth flow refreshing tokens at the same time."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            try:
+                if sys.platform == "win32":
+                    import msvcrt
+
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                else:
+                    import fcntl
+
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise TimeoutError(f"{path} is locked by another process")
+                time.sleep(LOCK_POLL_SEC)
+        try:
+            yield
+        finally:
+            if sys.platform == "win32":
+                import msvcrt
+
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+
+                fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+
+
+class PersistentTokenCache(msal.SerializableTokenCache):
+    """An MSAL token cache kept in a file, so that a restart can acquire
+    tokens silently instead of sending the user through the browser again.
+
+    The file is read lazily and again whenever another process changed it,
+    and written only when MSAL changed the cache (new or refreshed tokens).
+    Reads and writes hold a lock file, writes replace the file atomically.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH) -> None:
+        super().__init__()
+        self.path = path
+        self._lock_path = f"{path}.lockfile"
+        self._loaded: Optional[Tuple[int, int, int]] = None
+        self._sync_lock = threading.RLock()
+        self._depth = 0
+
+    def _signature(self) -> Optional[Tuple[int, int, int]]:
+        """Changes whenever the file gets replaced, even within one mtime tick."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def _reload(self) -> None:
+        """Must be called with the file lock held."""
+        signature = self._signature()
+        if signature is None or signature == self._loaded:
+            return
+        try:
+            with open(self.path, "rb") as f:
+                self.deserialize(_unprotect(f.read()).decode("utf8"))
+        except Exception as e:  # a corrupt cache only costs a sign-in
+            logging.warning(f"ignoring the token cache at {self.path}: {e}")
+        self._loaded = signature
+
+    def _save(self) -> None:
+        """Must be called with the file lock held."""
+        if not self.has_state_changed:
+            return
+        data = _protect(self.serialize().encode("utf8"))
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path), prefix=".msal-")
+        try:
+            os.chmod(tmp, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self._loaded = self._signature()
+
+    @contextlib.contextmanager
+    def _synced(self) -> Iterator[None]:
+        """Brings the cache up to date with the file, and writes it back if
+        MSAL changed it. Nested calls ride on the outermost one."""
+        with self._sync_lock:
+            if self._depth:
+                yield
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with file_lock(self._lock_path):
+                self._depth += 1
+                try:
+                    self._reload()
+                    yield
+                    self._save()
+                finally:
+                    self._depth -= 1
+
+    def add(self, event: Dict[str, Any], **kwargs: Any) -> None:
+        with self._synced():
+            super().add(event, **kwargs)
+
+    def modify(
+        self,
+        credential_type: str,
+        old_entry: Dict[str, Any],
+        new_key_value_pairs: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        with self._synced():
+            super().modify(credential_type, old_entry, new_key_value_pairs)
+
+    def find(self, *args: Any, **kwargs: Any) -> List[Dict[str, Any]]:
+        # cheap when nothing changed: a stat() under the lock
+        with self._synced():
+            found: List[Dict[str, Any]] = super().find(*args, **kwargs)
+            return found
+
+    def search(self, *args: Any, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+        # MSAL's generator removes expired tokens through modify() while it holds
+        # its own lock. Consume it here, so that _sync_lock is always taken before
+        # MSAL's lock, as in add(), and never the other way around.
+        with self._synced():
+            entries: List[Dict[str, Any]] = list(super().search(*args, **kwargs))
+        return iter(entries)
@@ -0,0 +1,357 @@
+import importlib
+import inspect
+import logging
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from multiprocessing.process import BaseProcess
+from typing import Any
+from typing import Optional
+from typing import Tuple
+from typing import Type
+from typing import cast
+
+import psutil
+
+from flowd.metrics import BaseCollector
+from flowd.metrics import CollectedData
+from flowd.metrics import ProcessLimits
+from flowd.metrics import Reaction
+
+PUBLISH_SEC = 0.5
+WATCHDOG_SEC = 1.0
+HEARTBEAT_TIMEOUT_SEC = 30.0
+STABLE_RUN_SEC = 60.0  # a child that ran this long resets the restart backoff
+MAX_BACKOFF_SEC = 60.0
+CPU_BURST_SEC = 5.0  # how far below its CPU limit a child can save up for bursts
+READ_TIMEOUT_SEC = 0.1  # a slot update never takes this long unless the writer died
+# a child over its CPU limit only gets the CPU nobody else wants
+THROTTLED_PRIORITY = getattr(psutil, "IDLE_PRIORITY_CLASS", 19)
+
+_REACTIONS = list(Reaction)
+
+
+def isolation_enabled() -> bool:
+    """FLOWD_ISOLATION=off keeps every collector in the supervisor process,
+    e.g. for debugging."""
+    return os.environ.get("FLOWD_ISOLATION", "on") != "off"
+
+
+def should_isolate(collector_class: Type[BaseCollector]) -> bool:
+    return (
+        isolation_enabled()
+        and not inspect.isabstract(collector_class)
+        and collector_class.child_process_limits is not None
+    )
+
+
+class CounterSlot(object):
+    """A collector's counters in shared memory: written by the child, read by the
+    supervisor, with the presence reaction going the other way.
+
+    The memory is a multiprocessing.RawArray the child gets when it's spawned,
+    and outlives the children: the next one gets the same array.
+
+    The child publishes its cumulative total, never a per-minute value, so the
+    supervisor needs no way to reset it. The supervisor sets the reaction and
+    the stop flag, which the child polls: unlike multiprocessing events they
+    keep working after a child got killed. A sequence lock keeps readers from
+    seeing half-written updates without a lock shared between processes: the
+    writer makes the sequence odd, writes, and makes it even again, readers
+    retry until they see the same even sequence before and after reading. A
+    writer killed in the middle of an update leaves the sequence odd, see
+    recover().
+    """
+
+    _SEQUENCE = struct.Struct("<Q")
+    # total, heartbeat (time.monotonic(), it's system wide)
+    _VALUES = struct.Struct("<dd")
+    _FLAG = struct.Struct("<q")
+    _REACTION_AT = _SEQUENCE.size + _VALUES.size
+    _STOP_AT = _REACTION_AT + _FLAG.size
+    SIZE = _STOP_AT + _FLAG.size
+
+    def __init__(self, memory: Any) -> None:
+        self.memory = memory
+        self._buf = memoryview(memory)
+
+    @classmethod
+    def create(cls, context: Any = multiprocessing) -> "CounterSlot":
+        """A zeroed slot, shareable with children of `context`."""
+        return cls(context.RawArray("B", cls.SIZE))
+
+    def publish(self, total: float, heartbeat: float) -> None:
+        """Must only be called by one process at a time."""
+        (sequence,) = self._SEQUENCE.unpack_from(self._buf, 0)
+        self._SEQUENCE.pack_into(self._buf, 0, sequence + 1)
+        self._VALUES.pack_into(self._buf, self._SEQUENCE.size, total, heartbeat)
+        self._SEQUENCE.pack_into(self._buf, 0, sequence + 2)
+
+    def _values(self) -> Tuple[float, float]:
+        total, heartbeat = self._VALUES.unpack_from(self._buf, self._SEQUENCE.size)
+        return total, heartbeat
+
+    def read(self) -> Tuple[float, float]:
+        """Returns (total, heartbeat). If the sequence stays odd for
+        READ_TIMEOUT_SEC the writer died in the middle of an update, and the
+        values are returned as they are."""
+        deadline = time.monotonic() + READ_TIMEOUT_SEC
+        while True:
+            (before,) = self._SEQUENCE.unpack_from(self._buf, 0)
+            if before % 2 == 0:
+                values = self._values()
+                (after,) = self._SEQUENCE.unpack_from(self._buf, 0)
+                if before == after:
+                    return values
+            elif time.monotonic() > deadline:
+                return self._values()
+            time.sleep(0)
+
+    def recover(self) -> Tuple[float, float]:
+        """Returns (total, heartbeat) once the writer is gone, and makes the
+        sequence even again if it died in the middle of publish()."""
+        (sequence,) = self._SEQUENCE.unpack_from(self._buf, 0)
+        if sequence % 2:
+            self._SEQUENCE.pack_into(self._buf, 0, sequence + 1)
+        return self._values()
+
+    @property
+    def reaction(self) -> Reaction:
+        (index,) = self._FLAG.unpack_from(self._buf, self._REACTION_AT)
+        reaction: Reaction = _REACTIONS[index]
+        return reaction
+
+    @reaction.setter
+    def reaction(self, reaction: Reaction) -> None:
+        self._FLAG.pack_into(self._buf, self._REACTION_AT, _REACTIONS.index(reaction))
+
+    @property
+    def stopped(self) -> bool:
+        return bool(self._FLAG.unpack_from(self._buf, self._STOP_AT)[0])
+
+    @stopped.setter
+    def stopped(self, stopped: bool) -> None:
+        self._FLAG.pack_into(self._buf, self._STOP_AT, int(stopped))
+
+    def close(self) -> None:
+        self._buf.release()
+
+
+def _child_main(module_name: str, class_name: str, memory: Any) -> None:
+    """Entry point of a collector's child process."""
+    logging.basicConfig(
+        level=logging.INFO, format=f"%(levelname)-8s [{class_name}] %(message)s"
+    )
+    try:
+        import pythoncom
+
+        pythoncom.CoInitialize()
+    except ImportError:
+        pass
+
+    collector = getattr(importlib.import_module(module_name), class_name)()
+    slot = CounterSlot(memory)
+    worker = threading.Thread(
+        target=collector.start_collect, name=f"CollectorThread-{collector.metric_name}"
+    )
+    worker.start()
+    reaction = Reaction.CONTINUE
+    try:
+        while not slot.stopped:
+            time.sleep(PUBLISH_SEC)
+            if slot.reaction is not reaction:
+                reaction = slot.reaction
+                collector.react(reaction)
+            # never cleaned up, so the current state is the total since the child started
+            _, total = collector.get_current_state()
+            slot.publish(float(total), time.monotonic())
+            if not worker.is_alive():
+                logging.error("the collector stopped")
+                break
+    finally:
+        collector.stop_collect()
+        collector.react(Reaction.CONTINUE)
+        worker.join(5)
+        slot.close()
+
+
+def _limit_job_memory(process: BaseProcess, memory_mb: float) -> Any:
+    """Puts the child in a Windows job object capping its committed memory.
+    Returns the job handle, None where job objects aren't available."""
+    try:
+        import win32api
+        import win32con
+        import win32job
+    except ImportError:
+        return None
+    job = win32job.CreateJobObject(None, "")
+    limits = win32job.JobObjectExtendedLimitInformation
+    info = win32job.QueryInformationJobObject(job, limits)
+    info["ProcessMemoryLimit"] = int(memory_mb * 1024 * 1024)
+    basic = info["BasicLimitInformation"]
+    basic["LimitFlags"] |= win32job.JOB_OBJECT_LIMIT_PROCESS_MEMORY
+    win32job.SetInformationJobObject(job, limits, info)
+    access = win32con.PROCESS_SET_QUOTA | win32con.PROCESS_TERMINATE
+    handle = win32api.OpenProcess(access, False, process.pid)
+    win32job.AssignProcessToJobObject(job, handle)
+    win32api.CloseHandle(handle)
+    return job
+
+
+class IsolatedCollector(BaseCollector):
+    """Runs a collector in a child process and stands in for it in the supervisor.
+
+    The child is restarted with an exponential backoff when it exits or stops
+    sending heartbeats, and when its resident memory goes over the limit. While
+    it has used more CPU than its limit it runs at idle priority; it's never
+    suspended, that would stop audio capture along with the inference.
+    """
+
+    def __init__(
+        self, collector_class: Type[BaseCollector], limits: Optional[ProcessLimits] = None
+    ) -> None:
+        super().__init__()
+        self.collector_class = collector_class
+        self.presence_policy = collector_class.presence_policy
+        self.limits = limits or collector_class.child_process_limits or ProcessLimits()
+        self._context = multiprocessing.get_context("spawn")
+        self._slot = CounterSlot.create(self._context)
+        self._quit = threading.Event()
+        self._lock = threading.Lock()
+        self._process: Optional[BaseProcess] = None
+        self._job: Any = None
+        self._offset = 0.0  # totals of the children that are gone
+        self._baseline = 0.0
+        self.restarts = 0
+
+    @property
+    def metric_name(self) -> str:
+        return cast(str, self.collector_class.metric_name)
+
+    def _total(self) -> float:
+        total, _ = self._slot.read()
+        return self._offset + total
+
+    def _spawn(self) -> BaseProcess:
+        with self._lock:
+            # the previous child is gone, so this is the only writer
+            total, _ = self._slot.recover()
+            self._offset += total
+            self._slot.publish(0.0, time.monotonic())
+        self._slot.stopped = False
+        cls = self.collector_class
+        process = self._context.Process(
+            target=_child_main,
+            args=(cls.__module__, cls.__name__, self._slot.memory),
+            name=f"flowd-{cls.__name__}",
+            daemon=True,
+        )
+        process.start()
+        self._process = process
+        logging.info(f"started {self.metric_name} in process {process.pid}")
+        if self.limits.memory_mb:
+            self._job = _limit_job_memory(process, self.limits.memory_mb)
+        return process
+
+    def _kill(self, process: BaseProcess, reason: str) -> None:
+        logging.warning(f"restarting the {self.metric_name} process: {reason}")
+        process.terminate()  # TerminateProcess on Windows, there's no gentler way
+        process.join()
+
+    def close(self) -> None:
+        """Frees the shared memory slot, once the collector is stopped for good."""
+        self._slot.close()
+
+    def _throttle(self, process: psutil.Process, priority: int) -> None:
+        try:
+            process.nice(priority)
+        except psutil.AccessDenied:
+            # POSIX only lets root raise a priority again
+            logging.debug(f"could not set the {self.metric_name} process priority")
+
+    def _watch(self, child: BaseProcess) -> None:
+        """Watches the running child until it exits or gets killed."""
+        try:
+            process = psutil.Process(child.pid)
+            priority = process.nice()
+        except psutil.NoSuchProcess:
+            child.join()
+            logging.error(f"the {self.metric_name} process exited with {child.exitcode}")
+            return
+        last_cpu, last_wall = None, time.monotonic()
+        # wall seconds the child has to stay idle to get back to its CPU share
+        debt = 0.0
+        throttled = False
+        memory_limit = (self.limits.memory_mb or 0) * 1024 * 1024
+        while not self._quit.wait(WATCHDOG_SEC):
+            if not child.is_alive():
+                logging.error(
+                    f"the {self.metric_name} process exited with {child.exitcode}"
+                )
+                return
+            now = time.monotonic()
+            _, heartbeat = self._slot.read()
+            try:
+                if now - heartbeat > HEARTBEAT_TIMEOUT_SEC:
+                    return self._kill(child, f"no heartbeat for {now - heartbeat:.0f}s")
+                if memory_limit and process.memory_info().rss > memory_limit:
+                    return self._kill(
+                        child, f"resident memory over {self.limits.memory_mb:.0f} MB"
+                    )
+                if self.limits.cpu:
+                    times = process.cpu_times()
+                    cpu = times.user + times.system
+                    if last_cpu is not None:
+                        debt += (cpu - last_cpu) / self.limits.cpu - (now - last_wall)
+                        debt = max(debt, -CPU_BURST_SEC)
+                        if (debt > 0) != throttled:
+                            throttled = debt > 0
+                            logging.debug(
+                                f"the {self.metric_name} process is "
+                                f"{'over' if throttled else 'back under'} its CPU limit"
+                            )
+                            self._throttle(
+                                process, THROTTLED_PRIORITY if throttled else priority
+                            )
+                    last_cpu, last_wall = cpu, now
+            except psutil.NoSuchProcess:
+                continue
+
+    def start_collect(self) -> None:
+        self._quit.clear()
+        failures = 0
+        while not self._quit.is_set():
+            child = self._spawn()
+            started = time.monotonic()
+            self._watch(child)
+            if self._quit.is_set():
+                break
+            self.restarts += 1
+            failures = 0 if time.monotonic() - started > STABLE_RUN_SEC else failures + 1
+            backoff = min(2 ** failures, MAX_BACKOFF_SEC)
+            logging.info(f"restarting the {self.metric_name} process in {backoff:.0f}s")
+            self._quit.wait(backoff)
+
+    def stop_collect(self) -> None:
+        self._quit.set()
+        self._slot.stopped = True
+        process = self._process
+        if process is not None and process.is_alive():
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+
+    def react(self, reaction: Reaction) -> None:
+        self._slot.reaction = reaction
+        super().react(reaction)
+
+    def get_current_state(self) -> CollectedData:
+        with self._lock:
+            value = self._total() - self._baseline
+        return self.metric_name, value
+
+    def cleanup(self) -> None:
+        with self._lock:
+            self._baseline = self._total()
@@ -1,12 +1,53 @@
 import abc
+import enum
+import threading
+import time
+from typing import Dict
+from typing import NamedTuple
+from typing import Optional
 from typing import Tuple
 
+from flowd.utils import telemetry
+
 CollectedData = Tuple[str, float]
 
 
+class Presence(enum.Enum):
+    """What the user is up to, as tracked by the supervisor."""
+    ACTIVE = "active"
+    IDLE = "idle"  # no input for a short while
+    AFK = "afk"
+    LOCKED = "locked"
+
+
+class Reaction(enum.Enum):
+    """How a collector reacts to a presence state."""
+    CONTINUE = "continue"
+    DEGRADE = "degrade"  # keep collecting, cheaper
+    PAUSE = "pause"
+
+
+class ProcessLimits(NamedTuple):
+    """Limits for a collector running in its own process, see flowd.isolation."""
+    memory_mb: Optional[float] = None  # resident memory, the process is restarted above it
+    cpu: Optional[float] = None  # cores, the process is throttled above it
+
+
 class BaseCollector(abc.ABC):
     """Base class for metric collectors."""
 
+    # reaction per presence state, continue for the ones not listed
+    presence_policy: Dict[Presence, Reaction] = {}
+    reaction = Reaction.CONTINUE
+    # how many times slower polling collectors sample while degraded
+    DEGRADE_FACTOR = 5
+    # set to run the collector in a child process with these limits
+    child_process_limits: Optional[ProcessLimits] = None
+
+    def __init__(self) -> None:
+        self._changed = threading.Condition()  # guards `reaction`, see react()
+        self._loop_started: Optional[float] = None
+
     @property
     @abc.abstractmethod
     def metric_name(self) -> str:
@@ -27,3 +68,25 @@ class BaseCollector(abc.ABC):
     @abc.abstractmethod
     def cleanup(self) -> None:
         pass
+
+    def react(self, reaction: Reaction) -> None:
+        """Called by the supervisor when the presence state asks for a different
+        reaction. Polling collectors pick it up in `pace()`, others override this."""
+        with self._changed:
+            self.reaction = reaction
+            self._changed.notify_all()
+
+    def pace(self, interval: float) -> None:
+        """Sleeps between two samples of a polling collector: `interval` normally,
+        DEGRADE_FACTOR times that while degraded, and for as long as it's paused.
+        A change of reaction ends the sleep early."""
+        if self._loop_started is not None:
+            elapsed = time.perf_counter() - self._loop_started
+            telemetry.COLLECTOR_LOOP_SECONDS.labels(self.metric_name).observe(elapsed)
+        with self._changed:
+            reaction = self.reaction
+            if reaction is Reaction.DEGRADE:
+                interval *= self.DEGRADE_FACTOR
+            self._changed.wait_for(lambda: self.reaction is not reaction, interval)
+            self._changed.wait_for(lambda: self.reaction is not Reaction.PAUSE)
+        self._loop_started = time.perf_counter()
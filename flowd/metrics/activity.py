@@ -1,7 +1,8 @@
 import logging
-import time
 
 from flowd.metrics import BaseCollector
+from flowd.metrics import Presence
+from flowd.metrics import Reaction
 
 
 class ActivityWindowCollector(BaseCollector):
@@ -11,8 +12,14 @@ class ActivityWindowCollector(BaseCollector):
     Number per minute﻿
     """
     metric_name = "Active Window Changed (times)"
+    presence_policy = {
+        Presence.IDLE: Reaction.DEGRADE,
+        Presence.AFK: Reaction.PAUSE,
+        Presence.LOCKED: Reaction.PAUSE,
+    }
 
     def __init__(self) -> None:
+        super().__init__()
         self.count = 0
         self._prev_window = None
         self.is_run = True
@@ -33,7 +40,7 @@ class ActivityWindowCollector(BaseCollector):
             self._prev_window = current_window
             logging.debug(f'Current state {self.metric_name} {self.count}')
 
-            time.sleep(1)
+            self.pace(1)
 
     def stop_collect(self) -> None:
         self.is_run = False
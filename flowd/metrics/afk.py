@@ -3,6 +3,7 @@ import threading
 import time
 
 from flowd.metrics import BaseCollector
+from flowd.utils import telemetry
 from flowd.utils.windows import seconds_since_last_input
 
 
@@ -11,45 +12,83 @@ class AFKCollector(BaseCollector):
     Time in AFK﻿
     ---
     Seconds per minute﻿, AFK timeout - 30 sec﻿
+
+    AFK starts exactly AFK_TIMEOUT_SEC after the last input, so while the user is
+    active the collector sleeps until the earliest moment that can happen. While
+    AFK it checks every AFK_POLL_SEC, the end of AFK is known to within that.
     """
     metric_name = "Time in AFK (seconds)"
     AFK_TIMEOUT_SEC = 30
-
-    def __init__(self) -> None:
-        self.count = 0
-        self._afk = False
-        self.is_run = True
-
-    def start_collect(self):
-        while self.is_run:
-            seconds_since_input = seconds_since_last_input()
-            logging.debug(f'Seconds since last input: {seconds_since_input}')
-
-            if self._afk and seconds_since_input < self.AFK_TIMEOUT_SEC:
-                logging.info("No longer AFK")
-                self._afk = False
-            # If becomes AFK
-            elif not self._afk and seconds_since_input >= self.AFK_TIMEOUT_SEC:
-                logging.info("Became AFK")
-                self._afk = True
-                self.count += 1
-            else:
-                if self._afk:
-                    self.count += 1
-
-            logging.debug(f'Current state {self.metric_name} {self.count}')
-            logging.debug(f'AFK: {self._afk}')
-            time.sleep(1)
+    AFK_POLL_SEC = 1
+
+    def __init__(self, idle_seconds=seconds_since_last_input, clock=time.monotonic) -> None:
+        super().__init__()
+        self.idle_seconds = idle_seconds
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._quit = threading.Event()
+        self._period_start = clock()
+        self._afk_since = None  # when AFK began, if the user is AFK
+        self._checked_at = self._period_start
+        self.time_in_afk = 0.0
+        self.wakeups = 0
+
+    @property
+    def afk(self) -> bool:
+        return self._afk_since is not None
+
+    def _update(self, now) -> float:
+        """Applies the AFK transitions since the last check, returns the seconds
+        until the next one can happen. Must be called with the lock held."""
+        idle = self.idle_seconds()
+        last_input = now - idle
+
+        if self._afk_since is not None and last_input >= self._afk_since:
+            logging.info("No longer AFK")
+            ended = max(self._checked_at, self._afk_since)
+            self.time_in_afk += max(ended - max(self._afk_since, self._period_start), 0.0)
+            self._afk_since = None
+
+        if self._afk_since is None and idle >= self.AFK_TIMEOUT_SEC:
+            logging.info("Became AFK")
+            self._afk_since = last_input + self.AFK_TIMEOUT_SEC
+
+        self._checked_at = now
+        if self._afk_since is not None:
+            return self.AFK_POLL_SEC
+        return self.AFK_TIMEOUT_SEC - idle
+
+    def start_collect(self) -> None:
+        self._quit.clear()
+        loop_seconds = telemetry.COLLECTOR_LOOP_SECONDS.labels(self.metric_name)
+        while not self._quit.is_set():
+            with loop_seconds.time(), self._lock:
+                delay = self._update(self.clock())
+            self.wakeups += 1
+            logging.debug(f'AFK: {self.afk}, next check in {delay:.1f}s')
+            self._quit.wait(delay)
 
     def stop_collect(self) -> None:
-        self.is_run = False
+        self._quit.set()
+
+    def _seconds(self) -> float:
+        with self._lock:
+            now = self.clock()
+            self._update(now)
+            t = self.time_in_afk
+            if self._afk_since is not None:
+                t += max(now - max(self._afk_since, self._period_start), 0.0)
+        return t
 
     def get_current_state(self) -> tuple:
-        return self.metric_name, self.count
+        t = int(round(self._seconds()))
+        logging.debug(f'Current state {self.metric_name} {t}')
+        return self.metric_name, t
 
     def cleanup(self) -> None:
-        self.count = 0
-        self.is_run = True
+        with self._lock:
+            self._period_start = self.clock()
+            self.time_in_afk = 0.0
 
 
 if __name__ == "__main__":
@@ -66,6 +105,7 @@ if __name__ == "__main__":
     metric_name, value = win_collector.get_current_state()
     logging.info(f'metric_name {metric_name}')
     logging.info(f'value {value}')
+    logging.info(f'wakeups {win_collector.wakeups}')
 
     win_collector.cleanup()
 
@@ -7,6 +7,8 @@ import logging
 import threading
 import time
 from flowd.metrics import BaseCollector
+from flowd.utils import telemetry
+from flowd.utils.telemetry import instrumented_callback
 
 MODIFIERS = keyboard.all_modifiers - {'shift', 'left shift', 'right shift'}
 
@@ -47,9 +49,11 @@ class PopularShortcutsCollector(BaseCollector):
     metric_name = "Popular Shortcuts Used (times)"
 
     def __init__(self) -> None:
+        super().__init__()
         self.count = 0  # for interval
         self.is_run = True
 
+    @instrumented_callback
     def shortcut_pressed(self):
         self.count += 1
         logging.debug(f"Popular shortcut pressed {keyboard.get_hotkey_name()}")
@@ -86,6 +90,7 @@ class ShortcutsCollector(BaseCollector):
     metric_name = "Any Shortcut Used (times)"
 
     def __init__(self) -> None:
+        super().__init__()
         self.count = 0  # for interval
         self.is_run = True
         keyboard.on_press(self.key_pressed)
@@ -107,6 +112,7 @@ class ShortcutsCollector(BaseCollector):
         self.count = 0
         self.is_run = True
 
+    @instrumented_callback
     def key_pressed(self, e) -> None:
         if not self.collecting or keyboard.is_modifier(e.scan_code):
             return
@@ -127,6 +133,7 @@ class CodeAssistCollector(BaseCollector):
     metric_name = "Code Assist Activated (times)"
 
     def __init__(self) -> None:
+        super().__init__()
         self.count = 0  # for interval
         self.is_run = True
         self.collecting = False
@@ -148,6 +155,7 @@ class CodeAssistCollector(BaseCollector):
         self.count = 0
         self.is_run = True
 
+    @instrumented_callback
     def key_pressed(self, e) -> None:
         if not self.collecting:
             return
@@ -165,6 +173,7 @@ class FullLinesCollector(BaseCollector):
     metric_name = "Full Lines Entered (times)"
 
     def __init__(self) -> None:
+        super().__init__()
         self.count = 0  # for interval
         self.is_run = True
 
@@ -203,7 +212,7 @@ class FullLinesCollector(BaseCollector):
                 state.current = ''
             else:
                 state.current += name
-        keyboard.hook(handler)
+        keyboard.hook(telemetry.instrument(handler, self.metric_name, 'key_event'))
         while self.is_run:
             time.sleep(1e6)
 
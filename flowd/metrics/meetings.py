@@ -0,0 +1,72 @@
+import logging
+import time
+
+from flowd.integrations import MicrosoftGraph
+from flowd.integrations import MicrosoftGraphError
+from flowd.integrations.calendar_sync import CalendarSync
+from flowd.metrics import BaseCollector
+
+
+class MeetingCollector(BaseCollector):
+    """
+    In a meeting according to the Outlook calendar
+    ---
+    Seconds in minute
+
+    Needs the Outlook integration (MS_CLIENT_ID etc.) and a signed in user,
+    reports -1 without them. The calendar is synced with delta queries every
+    SYNC_SEC, the minute itself is answered from the local cache.
+    """
+
+    metric_name = "In a Meeting (seconds)"
+
+    SYNC_SEC = 300
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.is_run = True
+        self.calendar = None
+        self._synced = False
+        self._period_start = time.time()
+
+    def stop_collect(self) -> None:
+        self.is_run = False
+
+    def start_collect(self) -> None:
+        try:
+            graph = MicrosoftGraph.from_env()
+        except MicrosoftGraphError as e:
+            logging.info(f"not tracking meetings: {e}")
+            return
+        self.calendar = CalendarSync(graph.session)
+        next_sync = 0.0
+        try:
+            while self.is_run:
+                if time.monotonic() >= next_sync:
+                    next_sync = time.monotonic() + self.SYNC_SEC
+                    try:
+                        if graph.token:  # not signed in yet, try again later
+                            self.calendar.sync()
+                            self._synced = True
+                    except Exception as e:  # token refresh or sync, both retried later
+                        logging.warning(f"calendar sync failed: {e}")
+                self.pace(1)
+        finally:
+            self.calendar.close()
+
+    def get_current_state(self) -> tuple:
+        if self.calendar is None or not self._synced:
+            return self.metric_name, -1
+        busy = self.calendar.busy_seconds(self._period_start, time.time())
+        return self.metric_name, int(round(busy))
+
+    def cleanup(self) -> None:
+        self._period_start = time.time()
+        self.is_run = True
+
+
+if __name__ == '__main__':
+    # Example of usage
+    logging.basicConfig(level=logging.DEBUG, format="%(levelname)-8s %(message)s")
+    collector = MeetingCollector()
+    collector.start_collect()
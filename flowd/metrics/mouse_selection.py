@@ -5,6 +5,7 @@ import mouse
 from mouse import ButtonEvent, MoveEvent
 
 from flowd.metrics import BaseCollector
+from flowd.utils.telemetry import instrumented_callback
 
 
 class MouseUsedSelectionCollector(BaseCollector):
@@ -22,6 +23,7 @@ class MouseUsedSelectionCollector(BaseCollector):
     MOVING_MAX_DURATION_SEC = 10
 
     def __init__(self) -> None:
+        super().__init__()
         self.count = 0
         self.is_run = True
 
@@ -32,6 +34,7 @@ class MouseUsedSelectionCollector(BaseCollector):
         mouse.unhook(self.mouse_selection_callback)
         self.is_run = False
 
+    @instrumented_callback
     def mouse_selection_callback(self, event):
         if isinstance(event, ButtonEvent) and event.button == self.LEFT_BUTTON:
             if event.event_type == self.EVENT_TYPE_PRESSED:
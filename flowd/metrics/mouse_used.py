@@ -3,6 +3,7 @@ import threading
 import time
 import mouse
 from flowd.metrics import BaseCollector
+from flowd.utils.telemetry import instrumented_callback
 
 
 class MouseUsedCollector(BaseCollector):
@@ -17,6 +18,7 @@ class MouseUsedCollector(BaseCollector):
     TIMEOUT_NOT_USED_SEC = 3
 
     def __init__(self) -> None:
+        super().__init__()
         self.second_per_minute = 0
         self.is_run = True
         self._last_event_time = 0
@@ -25,6 +27,7 @@ class MouseUsedCollector(BaseCollector):
         mouse.unhook(self.mouse_used_callback)
         self.is_run = False
 
+    @instrumented_callback
     def mouse_used_callback(self, event):
         duration_sec = event.time - self._last_event_time
         if duration_sec < self.TIMEOUT_NOT_USED_SEC:
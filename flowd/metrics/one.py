@@ -7,6 +7,7 @@ class MetricCollector(BaseCollector):
     metric_name = "Test Metric"
 
     def __init__(self) -> None:
+        super().__init__()
         self.count = 0
         self.should_continue = True
 
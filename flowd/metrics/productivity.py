@@ -4,6 +4,8 @@ import threading
 import time
 
 from flowd.metrics import BaseCollector
+from flowd.metrics import Presence
+from flowd.metrics import Reaction
 
 
 BROWSER_REGEXP = r'(.*GitHub.*)|(.*Stack Overflow.*)|(Python\.org)|' \
@@ -40,7 +42,14 @@ class ProductivityWindowCollector(BaseCollector):
 
     INTERVAL_SEC = 15
 
+    # every loop counts as a second, so no degraded mode
+    presence_policy = {
+        Presence.AFK: Reaction.PAUSE,
+        Presence.LOCKED: Reaction.PAUSE,
+    }
+
     def __init__(self) -> None:
+        super().__init__()
         self.count = 0  # for interval
         self._second_count = 0
         self.is_run = True
@@ -83,7 +92,12 @@ class ProductivityWindowCollector(BaseCollector):
             logging.debug(f'Current state {self.metric_name} {self.count}')
             logging.debug(f'second_count {self._second_count}')
 
-            time.sleep(1)
+            self.pace(1)
+
+    def react(self, reaction) -> None:
+        # being away interrupts a stretch of productive work
+        self._second_count = 0
+        super().react(reaction)
 
     def stop_collect(self) -> None:
         self.is_run = False
@@ -1,7 +1,15 @@
 import logging
-import time
+import os
 from flowd.metrics import BaseCollector
-import psutil
+from flowd.metrics import Presence
+from flowd.metrics import Reaction
+from flowd.utils.connections import ConnectionTracker
+
+
+def configured_ports(default) -> list:
+    """Remote ports to track, FLOWD_SSH_PORTS (e.g. "22,3389,6443") overrides the default."""
+    value = os.environ.get('FLOWD_SSH_PORTS', '')
+    return [int(p) for p in value.split(',') if p.strip()] or default
 
 
 class SSHActivityCollector(BaseCollector):
@@ -9,41 +17,42 @@ class SSHActivityCollector(BaseCollector):
     Active SSH connections
     ---
     Seconds in minute
+
+    Any established TCP connection to one of the PORTS counts, add e.g. 3389 for
+    RDP or the API server port for kubectl port-forward. mosh talks UDP, only
+    its SSH bootstrap is visible.
     """
 
     metric_name = "SSH Session Active (seconds)"
 
     PORTS = [21, 22]
 
+    # sessions stay open while the user is away, they're just checked less often
+    presence_policy = {
+        Presence.AFK: Reaction.DEGRADE,
+        Presence.LOCKED: Reaction.DEGRADE,
+    }
+
     def __init__(self) -> None:
+        super().__init__()
         self.is_run = True
-        self.time_in_mode = 0.0
+        self.tracker = ConnectionTracker(configured_ports(self.PORTS))
+        self._baseline = 0.0
 
     def stop_collect(self) -> None:
         self.is_run = False
 
     def start_collect(self) -> None:
-        start_time = time.time()
-        ssh_active = False
         while self.is_run:
-            ssh_active = False
-            for x in psutil.net_connections(kind="all"):
-                # get remote address
-                if x.raddr:
-                    r_address, r_port = x.raddr
-                    if r_port in self.PORTS and x.status == psutil.CONN_ESTABLISHED:
-                        logging.debug(x)
-                        ssh_active = True
-            if ssh_active:
-                self.time_in_mode += time.time() - start_time
-                start_time = time.time()
-            time.sleep(1)
+            self.tracker.poll()
+            self.pace(1)
 
     def get_current_state(self) -> tuple:
-        return self.metric_name, int(round(self.time_in_mode))
+        logging.debug(f'SSH sessions: {self.tracker.session_seconds()}')
+        return self.metric_name, int(round(self.tracker.active_seconds() - self._baseline))
 
     def cleanup(self) -> None:
-        self.time_in_mode = 0
+        self._baseline = self.tracker.active_seconds()
         self.is_run = True
 
 
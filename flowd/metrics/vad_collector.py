@@ -1,27 +1,40 @@
 import logging
 import collections
 import contextlib
+import sys
 import wave
-import tempfile
 import webrtcvad
-import torch
-from array import array
+import numpy as np
 import time
 import threading
-import psutil
-import pyaudio
-import os
+import queue
 
 from flowd.metrics import BaseCollector
-
-
-def normalize(snd_data) -> array:
+from flowd.metrics import Presence
+from flowd.metrics import ProcessLimits
+from flowd.metrics import Reaction
+from flowd.model.sad_pipeline import SADPipelineLoader
+from flowd.model.speech_music import SpeechMusicClassifier
+from flowd.utils.audio import EnergyGate
+from flowd.utils.audio import FrameRingBuffer
+from flowd.utils.audio import InferenceStats
+from flowd.utils.audio import PyAudioSource
+from flowd.utils import telemetry
+from flowd.utils.governor import ComputeGovernor
+from flowd.utils.governor import Tier
+from flowd.utils.governor import thread_time
+from flowd.utils.profiler import record_native_id
+
+
+def normalize(snd_data) -> np.ndarray:
     """Average the volume out"""
-    times = 32767.0 / max(abs(i) for i in snd_data)
-    r = array('h')
-    for i in snd_data:
-        r.append(int(i * times))
-    return r
+    samples = np.frombuffer(snd_data, dtype=np.int16)
+    # widen before abs() so that -32768 doesn't overflow
+    peak = int(np.abs(samples.astype(np.int32)).max()) if samples.size else 0
+    if peak == 0:
+        return samples.copy()
+    times = 32767.0 / peak
+    return (samples * times).astype(np.int16)
 
 
 class VoiceActivationDetectionCollector(BaseCollector):
@@ -32,80 +45,172 @@ class VoiceActivationDetectionCollector(BaseCollector):
     """
     metric_name = "Voice Activity Detected (seconds)"
 
+    # what to do with a voiced segment when the inference queue is full:
+    # 'degrade' counts its raw webrtcvad duration, 'drop' discards it
+    OVERFLOW_POLICY = 'degrade'
+
+    # keep torch and pyannote away from the input hooks' GIL
+    child_process_limits = ProcessLimits(memory_mb=1500, cpu=0.5)
+
+    # nobody to talk to while away, stop capturing
+    presence_policy = {
+        Presence.AFK: Reaction.PAUSE,
+        Presence.LOCKED: Reaction.PAUSE,
+    }
+
     def __init__(self) -> None:
+        super().__init__()
         self.count = 0  # for interval
+        self._count_lock = threading.Lock()
         self.is_run = True
-        self.stream = None
-        with tempfile.NamedTemporaryFile() as f:
-            self.path = f.name
         self.vad_mode = 3
         self.vad = webrtcvad.Vad(self.vad_mode)
-        self.pipeline = torch.hub.load('pyannote/pyannote-audio', 'sad_ami', pipeline=True)
+        # the pyannote pipeline is only loaded once the first voiced segment shows up
+        self.pipeline = SADPipelineLoader()
         self.rate = 16000
         self.chunk_duration_ms = 30  # supports 10, 20 and 30 (ms)
         self.chunk_size = int(self.rate * self.chunk_duration_ms / 1000)  # chunk to read
         self.voiced_frames_rate = 0.9
         self.unvoiced_frames_rate = 0.9
         self.max_voiced_frames = 100
+        # only frames above the adaptive noise floor get to webrtcvad
+        self.gate = EnergyGate(self.chunk_size * 2)
+        # segments pyannote still gets to see when the governor allows only short ones
+        self.short_segment_sec = 1.5
+        self.governor = ComputeGovernor()
+        # None until trained with `python -m flowd.model.speech_music`
+        self.speech_music = SpeechMusicClassifier.load()
+        # segments less likely to be speech than this are music/noise and don't count
+        self.min_speech_probability = 0.3
+        self.music_segments = 0
         self.leave = False
+        self.padding_duration_ms = 300
+        # ~3 seconds of audio between the capture callback and the VAD, the frames
+        # the gate and the VAD keep around for padding are never overwritten
+        self.ring_buffer = FrameRingBuffer(capacity=100, frame_size=self.chunk_size * 2,
+                                           reserve=self.padding_duration_ms // self.chunk_duration_ms
+                                           + self.gate.block_frames)
+        # anything with start(ring_buffer)/stop(), e.g. WavFileSource in tests
+        self.source = PyAudioSource(self.rate, self.chunk_size)
+        self.segments = queue.Queue(maxsize=8)
+        self.segment_buffers = None  # SegmentBufferPool, sized on first use
+        self.stats = InferenceStats()
+        telemetry.QUEUE_DEPTH.labels('vad_segments').set_function(self.segments.qsize)
+        telemetry.QUEUE_DEPTH.labels('vad_frames').set_function(self.ring_buffer.__len__)
+        self._frames_total = telemetry.EVENTS.labels(self.metric_name, 'frames')
 
     def start_listening(self):
-        pa = pyaudio.PyAudio()
-        self.stream = pa.open(format=pyaudio.paInt16,
-                              channels=1,
-                              rate=self.rate,
-                              input=True,
-                              start=False,
-                              frames_per_buffer=self.chunk_size)
+        self.source.start(self.ring_buffer)
 
     def stop_listening(self):
-        self.stream.close()
+        self.source.stop()
 
     def audio_generator(self):
-        self.stream.start_stream()
-        while not self.leave:
-            time.sleep(0.005)
-            chunk = self.stream.read(self.chunk_size)
-            yield chunk
-
-    def write_wave(self, audio) -> None:
-        """Writes a .wav file.
-        Takes path, PCM audio data, and sample rate.
-        """
-        with contextlib.closing(wave.open(self.path, 'wb')) as wf:
-            wf.setnchannels(1)
-            wf.setsampwidth(2)
-            wf.setframerate(self.rate)
-            wf.writeframes(audio)
+        return iter(self.ring_buffer)
 
-    class Frame(object):
-        """Represents a "frame" of audio data."""
-        def __init__(self, frame_bytes, timestamp, duration):
-            self.bytes = frame_bytes
-            self.timestamp = timestamp
-            self.duration = duration
+    def get_waveform(self, audio) -> dict:
+        """Wraps PCM audio data as precomputed audio for the pyannote pipeline.
+        The waveform is a float (n_samples, n_channels) array scaled to [-1, 1],
+        the pipeline assumes it's sampled at its own rate (16 kHz).
+        """
+        samples = np.frombuffer(audio, dtype=np.int16)
+        waveform = (samples.astype(np.float32) / 32768.0).reshape(-1, 1)
+        return {'uri': 'segment', 'waveform': waveform}
 
     class Segment(object):
         """Represents a "frame" of audio data."""
-        def __init__(self, frame_bytes, duration):
+        def __init__(self, frame_bytes, duration, start=0.0, buffer=None):
             self.frame_bytes = frame_bytes
             self.duration = duration
+            self.start = start  # seconds since the beginning of the stream
+            self.buffer = buffer  # the SegmentBuffer frame_bytes points into
+
+    class SegmentBuffer(object):
+        """Preallocated PCM buffer voiced frames are copied into as they arrive."""
+        def __init__(self, capacity, frame_size):
+            self.data = bytearray(capacity * frame_size)
+            self.length = 0
+            self.frames = 0
+
+        def append(self, frame_bytes):
+            end = self.length + len(frame_bytes)
+            self.data[self.length:end] = frame_bytes
+            self.length = end
+            self.frames += 1
+
+        def reset(self):
+            self.length = 0
+            self.frames = 0
+
+    class SegmentBufferPool(object):
+        """Segment buffers allocated once up front and reused.
+
+        A segment's frame_bytes point into its buffer, so the buffer only goes
+        back to the pool once the segment has been consumed (release()). If
+        nobody releases them (e.g. the benchmark keeping all the segments)
+        new buffers are allocated instead of overwriting ones still in use.
+        """
+        def __init__(self, count, capacity, frame_size):
+            self.capacity = capacity
+            self.frame_size = frame_size
+            self._free = [VoiceActivationDetectionCollector.SegmentBuffer(capacity, frame_size)
+                          for _ in range(count)]
+            self._lock = threading.Lock()
+            self.allocated = count
+
+        def acquire(self):
+            with self._lock:
+                if self._free:
+                    buffer = self._free.pop()
+                    buffer.reset()
+                    return buffer
+                self.allocated += 1
+            return VoiceActivationDetectionCollector.SegmentBuffer(self.capacity, self.frame_size)
+
+        def release(self, buffer):
+            if buffer is not None:
+                with self._lock:
+                    self._free.append(buffer)
 
     def frame_generator(self, audio):
         """Generates audio frames from PCM audio data.
-        Takes the desired frame duration in milliseconds, the PCM data, and
-        the sample rate.
-        Yields Frames of the requested duration.
+        Frames are passed through as they are (memoryview slices of the capture
+        ring buffer), only the CPU time spent on them is accounted.
         """
-        timestamp = 0.0
-        duration = float(self.chunk_duration_ms) / 1000.0
-        for a in audio:
-            yield VoiceActivationDetectionCollector.Frame(a, timestamp, duration)
-            timestamp += duration
-
-    def get_segment(self, voiced_frames):
-        return VoiceActivationDetectionCollector.Segment(b''.join([f.bytes for f in voiced_frames]),
-                                                         self.get_frames_duration(voiced_frames))
+        cpu_time = thread_time()
+        for i, a in enumerate(audio):
+            yield a
+            if i % 100 == 0:
+                self._frames_total.inc(100 if i else 1)
+                now = thread_time()
+                self.governor.charge(now - cpu_time)
+                cpu_time = now
+
+    def new_segment_buffer(self, num_padding_frames):
+        # a segment never grows past max_voiced_frames + 1 frames in the TRIGGERED
+        # state, nor past the ring buffer size when it's just been triggered
+        capacity = max(self.max_voiced_frames + 1, num_padding_frames)
+        if self.segment_buffers is None or self.segment_buffers.capacity < capacity:
+            # at most: the queued segments, the one in inference and the one being filled
+            self.segment_buffers = VoiceActivationDetectionCollector.SegmentBufferPool(
+                self.segments.maxsize + 2, capacity, self.chunk_size * 2)
+        return self.segment_buffers.acquire()
+
+    def release_segment(self, segment):
+        """Hands a consumed segment's buffer back for the next segments."""
+        if self.segment_buffers is not None:
+            self.segment_buffers.release(segment.buffer)
+
+    def get_segment(self, voiced_frames, start_frame=0):
+        return VoiceActivationDetectionCollector.Segment(memoryview(voiced_frames.data)[:voiced_frames.length],
+                                                         voiced_frames.frames * self.chunk_duration_ms / 1000,
+                                                         start_frame * self.chunk_duration_ms / 1000,
+                                                         voiced_frames)
+
+    def classify(self, frames):
+        """Yields (frame, is_speech) for every frame: energy gate first, then webrtcvad."""
+        for frame, loud in self.gate.filter(frames):
+            yield frame, loud and self.is_speech(frame)
 
     def vad_collector(self, frame_duration_ms,
                       padding_duration_ms, frames):
@@ -129,19 +234,36 @@ class VoiceActivationDetectionCollector(BaseCollector):
         Returns: A generator that yields PCM audio data.
         """
         num_padding_frames = int(padding_duration_ms / frame_duration_ms)
-        # We use a deque for our sliding window/ring buffer.
+        return self.segment_decisions(num_padding_frames, self.classify(frames))
+
+    def segment_decisions(self, num_padding_frames, decisions):
+        """The sliding window state machine of vad_collector() over already
+        classified (frame, is_speech) pairs.
+        Frames may be empty when only segment timings are of interest.
+        """
+        # We use a deque for our sliding window/ring buffer, with a parallel
+        # one for the VAD decisions so that no tuple is created per frame.
         ring_buffer = collections.deque(maxlen=num_padding_frames)
+        ring_voiced = collections.deque(maxlen=num_padding_frames)
+        # Number of voiced frames in the ring buffer, kept up to date on every
+        # append and eviction so we don't have to recount the window per frame.
+        num_voiced = 0
         # We have two states: TRIGGERED and NOTTRIGGERED. We start in the
         # NOTTRIGGERED state.
         triggered = False
 
-        voiced_frames = []
-        for frame in frames:
-            is_speech = self.vad.is_speech(frame.bytes, self.rate)
+        voiced_frames = self.new_segment_buffer(num_padding_frames)
+        start = 0
+        for i, (frame, is_speech) in enumerate(decisions):
+            if len(ring_voiced) == ring_voiced.maxlen and ring_voiced[0]:
+                # the oldest frame is about to be evicted
+                num_voiced -= 1
+            ring_buffer.append(frame)
+            ring_voiced.append(is_speech)
+            if is_speech:
+                num_voiced += 1
 
             if not triggered:
-                ring_buffer.append((frame, is_speech))
-                num_voiced = len([f for f, speech in ring_buffer if speech])
                 # If we're NOTTRIGGERED and more than 90% of the frames in
                 # the ring buffer are voiced frames, then enter the
                 # TRIGGERED state.
@@ -150,66 +272,140 @@ class VoiceActivationDetectionCollector(BaseCollector):
                     # We want to yield all the audio we see from now until
                     # we are NOTTRIGGERED, but we have to start with the
                     # audio that's already in the ring buffer.
-                    for f, s in ring_buffer:
+                    for f in ring_buffer:
                         voiced_frames.append(f)
 
-                    yield self.get_segment(voiced_frames)
-                    voiced_frames = []
+                    yield self.get_segment(voiced_frames, i - len(ring_buffer) + 1)
+                    voiced_frames = self.new_segment_buffer(num_padding_frames)
+                    start = i + 1
                     ring_buffer.clear()
+                    ring_voiced.clear()
+                    num_voiced = 0
             else:
                 # We're in the TRIGGERED state, so collect the audio data
                 # and add it to the ring buffer.
                 voiced_frames.append(frame)
-                if len(voiced_frames) > self.max_voiced_frames:
-                    yield self.get_segment(voiced_frames)
-                    voiced_frames = []
-                ring_buffer.append((frame, is_speech))
-                num_unvoiced = len([f for f, speech in ring_buffer if not speech])
+                if voiced_frames.frames > self.max_voiced_frames:
+                    yield self.get_segment(voiced_frames, start)
+                    voiced_frames = self.new_segment_buffer(num_padding_frames)
+                    start = i + 1
+                num_unvoiced = len(ring_buffer) - num_voiced
                 # If more than 90% of the frames in the ring buffer are
                 # unvoiced, then enter NOTTRIGGERED and yield whatever
                 # audio we've collected.
                 if num_unvoiced > self.unvoiced_frames_rate * ring_buffer.maxlen:
                     triggered = False
 
-                    yield self.get_segment(voiced_frames)
+                    yield self.get_segment(voiced_frames, start)
                     ring_buffer.clear()
-                    voiced_frames = []
+                    ring_voiced.clear()
+                    num_voiced = 0
+                    voiced_frames = self.new_segment_buffer(num_padding_frames)
         # If we have any leftover voiced audio when we run out of input,
         # yield it.
-        if voiced_frames:
-            yield self.get_segment(voiced_frames)
+        if voiced_frames.frames:
+            yield self.get_segment(voiced_frames, start)
+        elif self.segment_buffers is not None:
+            self.segment_buffers.release(voiced_frames)
 
     def get_frames_duration(self, frames):
         return len(frames) * self.chunk_duration_ms / 1000
 
-    @staticmethod
-    def is_busy() -> bool:
-        load = psutil.cpu_percent(percpu=True)
-        return min(load) > 60
+    def is_speech(self, frame_bytes) -> bool:
+        """Second VAD stage, only sees frames that passed the energy gate."""
+        if self.governor.tier == Tier.ENERGY:
+            return True
+        return self.vad.is_speech(frame_bytes, self.rate)
 
     def _get_speech_duration(self, segment):
-        if self.is_busy():
+        tier = self.governor.tier
+        if tier >= Tier.WEBRTCVAD and self.speech_music is not None:
+            with telemetry.INFERENCE_SECONDS.labels('speech_music').time():
+                p = self.speech_music.speech_probability(segment.frame_bytes)
+            if p < self.min_speech_probability:
+                self.music_segments += 1
+                return 0.0
+        if tier <= Tier.WEBRTCVAD:
+            return segment.duration
+        if tier == Tier.PYANNOTE_SHORT and segment.duration > self.short_segment_sec:
+            return segment.duration
+        pipeline = self.pipeline.get()
+        if pipeline is None:
+            # the model isn't loaded yet, go with webrtcvad alone
             return segment.duration
-        else:
-            self.write_wave(segment.frame_bytes)
-            return self.pipeline({'audio': self.path}).get_timeline().duration()
+        with telemetry.INFERENCE_SECONDS.labels('pyannote_sad').time():
+            return pipeline(self.get_waveform(segment.frame_bytes)).get_timeline().duration()
+
+    def _add_duration(self, seconds):
+        with self._count_lock:
+            self.count += seconds
+
+    def _enqueue(self, segment):
+        telemetry.EVENTS.labels(self.metric_name, 'segments').inc()
+        try:
+            self.segments.put_nowait(segment)
+        except queue.Full:
+            # inference fell behind, don't let it stall the VAD
+            if self.OVERFLOW_POLICY == 'degrade':
+                self.stats.degraded_segments += 1
+                telemetry.EVENTS.labels(self.metric_name, 'degraded_segments').inc()
+                self._add_duration(segment.duration)
+            else:
+                self.stats.dropped_segments += 1
+                telemetry.EVENTS.labels(self.metric_name, 'dropped_segments').inc()
+            self.release_segment(segment)
+
+    def _inference(self):
+        """Inference stage: turns queued voiced segments into speech durations."""
+        record_native_id()
+        while True:
+            segment = self.segments.get()
+            if segment is None:
+                return
+            started_at = time.perf_counter()
+            cpu_time = thread_time()
+            try:
+                duration = self._get_speech_duration(segment)
+            except Exception as e:
+                logging.error(f'Speech activity detection failed: {e}', exc_info=True)
+                duration = segment.duration
+            finally:
+                self.release_segment(segment)
+            self._add_duration(duration)
+            self.governor.charge(thread_time() - cpu_time)
+            self.stats.observe_latency(started_at)
 
     def _collect_internal(self):
+        self.ring_buffer.reopen()
+        inference = threading.Thread(target=self._inference, name='VAD-inference', daemon=True)
+        inference.start()
+        self.governor.start()
         self.start_listening()
         try:
-            segments = self.vad_collector(30, 300, self.frame_generator(self.audio_generator()))
+            segments = self.vad_collector(self.chunk_duration_ms, self.padding_duration_ms,
+                                          self.frame_generator(self.audio_generator()))
 
-            for i, segment in enumerate(segments):
-                self.count += self._get_speech_duration(segment)
+            for segment in segments:
+                self._enqueue(segment)
         finally:
+            self.leave = True
             self.stop_listening()
+            self.governor.stop()
+            self.segments.put(None)
+            inference.join()
+
+    def react(self, reaction) -> None:
+        if reaction is Reaction.PAUSE:
+            self.source.pause()
+            self.governor.stop()
+        elif self.reaction is Reaction.PAUSE and not self.leave:
+            self.governor.start()
+            self.source.resume()
+        super().react(reaction)
 
     def stop_collect(self) -> None:
         self.leave = True
-        try:
-            os.remove(self.path)
-        except FileNotFoundError:
-            pass
+        self.ring_buffer.close()
 
     def start_collect(self) -> None:
         self.leave = False
@@ -217,13 +413,68 @@ class VoiceActivationDetectionCollector(BaseCollector):
 
     def get_current_state(self) -> tuple:
         logging.debug(f'Voice detected, seconds: {self.count}')
+        logging.debug(f'VAD overruns: {self.ring_buffer.overruns}, '
+                      f'queued segments: {self.segments.qsize()}, '
+                      f'degraded: {self.stats.degraded_segments}, dropped: {self.stats.dropped_segments}, '
+                      f'inference latency: last {self.stats.last_latency:.3f}s, '
+                      f'mean {self.stats.mean_latency:.3f}s, max {self.stats.max_latency:.3f}s')
+        logging.debug(f'VAD governor: {self.governor.report()}, '
+                      f'energy gate pass rate: {self.gate.pass_rate:.1%}, '
+                      f'music/noise segments: {self.music_segments}')
         return self.metric_name, self.count
 
     def cleanup(self) -> None:
-        self.count = 0
+        with self._count_lock:
+            self.count = 0
+
 
+def read_wave_frames(path, chunk_size):
+    """Reads a mono 16-bit .wav file and splits it into chunks of chunk_size samples."""
+    with contextlib.closing(wave.open(path, 'rb')) as wf:
+        assert wf.getnchannels() == 1, 'only mono audio is supported'
+        assert wf.getsampwidth() == 2, 'only 16-bit PCM audio is supported'
+        rate = wf.getframerate()
+        pcm = wf.readframes(wf.getnframes())
+    frame_size = chunk_size * 2
+    return rate, [pcm[i:i + frame_size] for i in range(0, len(pcm) - frame_size + 1, frame_size)]
 
-if __name__ == '__main__':
+
+def benchmark(path):
+    """Measures the per-frame cost of the VAD hot path over a recorded .wav file."""
+    collector = VoiceActivationDetectionCollector()
+    rate, chunks = read_wave_frames(path, collector.chunk_size)
+    assert rate == collector.rate, f'expected {collector.rate} Hz audio, got {rate} Hz'
+
+    start = time.perf_counter()
+    for chunk in chunks:
+        normalize(chunk)
+    normalize_cost = (time.perf_counter() - start) / len(chunks)
+
+    start = time.perf_counter()
+    segments = list(collector.vad_collector(collector.chunk_duration_ms, collector.padding_duration_ms,
+                                            collector.frame_generator(chunks)))
+    vad_cost = (time.perf_counter() - start) / len(chunks)
+
+    logging.info(f'frames: {len(chunks)}, segments: {len(segments)}, '
+                 f'voiced seconds: {sum(s.duration for s in segments):.2f}')
+    logging.info(f'normalize: {normalize_cost * 1e6:.1f} us/frame')
+    logging.info(f'vad_collector: {vad_cost * 1e6:.1f} us/frame '
+                 f'({vad_cost * 1000 / collector.chunk_duration_ms:.3%} of real time)')
+
+    # how many of the frames webrtcvad considers voiced does the energy gate let through
+    gate = EnergyGate(collector.chunk_size * 2)
+    passed = [p for _, p in gate.filter(chunks)]
+    voiced = [collector.vad.is_speech(c, collector.rate) for c in chunks]
+    kept = sum(1 for p, v in zip(passed, voiced) if p and v)
+    logging.info(f'energy gate: {gate.pass_rate:.1%} of frames passed, '
+                 f'{kept / max(sum(voiced), 1):.1%} of webrtcvad voiced frames kept')
+
+
+if __name__ == '__main__' and len(sys.argv) > 2 and sys.argv[1] == '--benchmark':
+    # Example: python -m flowd.metrics.vad_collector --benchmark recording.wav
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
+    benchmark(sys.argv[2])
+elif __name__ == '__main__':
     # Example of usage
     logging.basicConfig(level=logging.DEBUG, format="%(levelname)-8s %(message)s")
     collector = VoiceActivationDetectionCollector()
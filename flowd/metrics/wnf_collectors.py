@@ -3,67 +3,93 @@ import threading
 import time
 from flowd.utils import wnf
 from flowd.metrics import BaseCollector
+from flowd.metrics import Presence
+from flowd.metrics import Reaction
 
 PRIORITY_MODE = 1
 ALERT_MODE = 2
 
 
-class PriorityModeCollector(BaseCollector):
+class FocusModeCollector(BaseCollector):
+    """Time spent in one of the focus assist modes, computed from the mode
+    transitions reported by the shared focus state sampler."""
 
-    metric_name = "Time in Priority Mode (seconds)"
+    MODE = None
+
+    # the mode rarely changes while the user is away, sample it less often
+    presence_policy = {
+        Presence.AFK: Reaction.DEGRADE,
+        Presence.LOCKED: Reaction.DEGRADE,
+    }
 
-    def __init__(self) -> None:
+    def __init__(self, sampler=None) -> None:
+        super().__init__()
+        self.sampler = sampler or wnf.focus_state_sampler()
+        self._interval = self.sampler.interval
+        self._lock = threading.Lock()
+        self._quit = threading.Event()
+        self._period_start = time.time()
+        self._entered = None  # when the mode was entered, if it's on
         self.time_in_mode = 0.0
-        self.is_run = True
+
+    def on_mode_change(self, change) -> None:
+        with self._lock:
+            if change.mode == self.MODE:
+                self._entered = change.timestamp
+            elif self._entered is not None:
+                self.time_in_mode += change.timestamp - max(self._entered, self._period_start)
+                self._entered = None
+
+    def react(self, reaction) -> None:
+        # the sampler is shared, every collector sets the same interval
+        factor = self.DEGRADE_FACTOR if reaction is Reaction.DEGRADE else 1
+        self.sampler.interval = self._interval * factor
+        super().react(reaction)
 
     def stop_collect(self) -> None:
-        self.is_run = False
+        self.sampler.unsubscribe(self.on_mode_change)
+        if not self._quit.is_set():
+            self._quit.set()
+            self.sampler.stop()
 
     def start_collect(self) -> None:
-        start_time = time.time()
-        while self.is_run:
-            if wnf.do_read(wnf.format_state_name("WNF_SHEL_QUIETHOURS_ACTIVE_PROFILE_CHANGED")) == PRIORITY_MODE:
-                self.time_in_mode += time.time() - start_time
-                start_time = time.time()
-            time.sleep(1)
+        self._quit.clear()
+        self.sampler.subscribe(self.on_mode_change)
+        self.sampler.start()
+        with self._lock:
+            if self.sampler.mode == self.MODE:
+                self._entered = self.sampler.since
+        self._quit.wait()
+
+    def _seconds(self) -> float:
+        now = time.time()
+        with self._lock:
+            t = self.time_in_mode
+            if self._entered is not None:
+                t += now - max(self._entered, self._period_start)
+        return t
 
     def get_current_state(self) -> tuple:
-        t = int(round(self.time_in_mode))
-        logging.debug(f'Time in priority mode: {t}')
+        t = int(round(self._seconds()))
+        logging.debug(f'Time in {self.metric_name}: {t}')
         return self.metric_name, t
 
     def cleanup(self) -> None:
-        self.is_run = True
-        self.time_in_mode = 0
+        with self._lock:
+            self._period_start = time.time()
+            self.time_in_mode = 0
 
 
-class AlertModeCollector(BaseCollector):
-
-    metric_name = "Time in Alerts Only Mode (seconds)"
-
-    def __init__(self) -> None:
-        self.time_in_mode = 0.0
-        self.is_run = True
+class PriorityModeCollector(FocusModeCollector):
 
-    def stop_collect(self) -> None:
-        self.is_run = False
+    metric_name = "Time in Priority Mode (seconds)"
+    MODE = PRIORITY_MODE
 
-    def start_collect(self) -> None:
-        start_time = time.time()
-        while self.is_run:
-            if wnf.do_read(wnf.format_state_name("WNF_SHEL_QUIETHOURS_ACTIVE_PROFILE_CHANGED")) == ALERT_MODE:
-                self.time_in_mode += time.time() - start_time
-                start_time = time.time()
-            time.sleep(1)
 
-    def get_current_state(self) -> tuple:
-        t = int(round(self.time_in_mode))
-        logging.debug(f'Time in alert mode: {t}')
-        return self.metric_name, t
+class AlertModeCollector(FocusModeCollector):
 
-    def cleanup(self) -> None:
-        self.time_in_mode = 0
-        self.is_run = True
+    metric_name = "Time in Alerts Only Mode (seconds)"
+    MODE = ALERT_MODE
 
 
 if __name__ == '__main__':
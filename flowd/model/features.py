@@ -0,0 +1,163 @@
+"""Rolling features of the per-minute metrics, for the flow state model.
+
+Besides the raw counts the model gets, per metric, exponentially weighted
+means over a few spans, a rolling mean, a trend (fast minus slow EWMA), and
+overall minutes since the last window switch and the time of day.
+
+RollingFeatures keeps the state (a few numbers per feature, the last rows
+of the rolling window) and carries it from one call to the next, so the
+supervisor feeds it one row a minute and training feeds it all the history
+at once, through the same transform(). Over history the recurrences are
+evaluated a block of rows at a time with numpy, a year of minutes takes
+about a second.
+
+Timestamps are wall-clock seconds (local time, as the date column of
+data_pivot.csv has it) since 1970-01-01, see wall_seconds().
+"""
+import datetime
+import math
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+import numpy as np
+
+SPANS = (5, 30)  # EWMA spans, minutes, the first and the last make the trend
+WINDOW = 15  # rolling mean, minutes
+GAP_SEC = 300  # longer without rows (asleep, not running) starts over
+SWITCH_METRIC = "Active Window Changed (times)"
+SWITCH_CAP_MIN = 60.0
+EPOCH = datetime.datetime(1970, 1, 1)
+DAY_SEC = 86400
+
+
+def wall_seconds(dt: datetime.datetime) -> float:
+    """A naive local datetime as the timestamps RollingFeatures takes."""
+    return (dt - EPOCH).total_seconds()
+
+
+def _decay(x: np.ndarray, a: np.ndarray, y0: np.ndarray) -> np.ndarray:
+    """y[t] = a * y[t-1] + x[t] down the rows, per column, starting from
+    y[-1] = y0 (what scipy.signal.lfilter([1], [1, -a], x) does per column).
+
+    Within a block y[t] = a^t * (a * y_in + sum(x[k] * a^-k)), a cumulative
+    sum; blocks are short enough for a^-k to stay finite and the carry from
+    block to block is a loop over blocks, not rows."""
+    n, f = x.shape
+    log_a = np.log(a)
+    block = max(1, min(n, int(300 / -log_a.min())))
+    k = np.arange(block)[:, None]
+    up, down = np.exp(-k * log_a), np.exp(k * log_a)
+    blocks = -(-n // block)
+    padded = np.zeros((blocks * block, f))
+    padded[:n] = x
+    local = down * np.cumsum(padded.reshape(blocks, block, f) * up, axis=1)
+    carried = down * a  # a^(k+1)
+    carry = np.empty((blocks, f))
+    y = y0
+    for j in range(blocks):
+        carry[j] = y
+        y = local[j, -1] + carried[-1] * y
+    return (local + carried * carry[:, None, :]).reshape(-1, f)[:n]
+
+
+class RollingFeatures(object):
+    """Features of rows of `metrics`, computed incrementally.
+
+    transform() takes the next rows in time order and returns their features,
+    update() does the same for one row. Dead collectors (-1) and missing
+    values count as 0. After more than `gap` seconds without rows the state
+    starts over, as it does for a freshly started supervisor.
+    """
+
+    def __init__(
+        self,
+        metrics: Sequence[str],
+        spans: Sequence[int] = SPANS,
+        window: int = WINDOW,
+        gap: float = GAP_SEC,
+    ) -> None:
+        self.metrics = list(metrics)
+        self.spans = list(spans)
+        self.window = window
+        self.gap = gap
+        f = len(self.metrics)
+        # one column per (span, metric), and a column of ones per span for the
+        # weights, so that the first minutes aren't biased towards 0
+        self._alpha = np.repeat([1 - 2 / (s + 1) for s in self.spans], f + 1)
+        self._switch: Optional[int] = None
+        if SWITCH_METRIC in self.metrics:
+            self._switch = self.metrics.index(SWITCH_METRIC)
+        self._last_ts: Optional[float] = None
+        self.reset()
+
+    @property
+    def names(self) -> List[str]:
+        names = list(self.metrics)
+        for span in self.spans:
+            names += [f"{m} EWMA {span}m" for m in self.metrics]
+        names += [f"{m} Mean {self.window}m" for m in self.metrics]
+        names += [f"{m} Trend" for m in self.metrics]
+        if self._switch is not None:
+            names.append("Minutes Since Window Switch")
+        names += ["Time of Day (sin)", "Time of Day (cos)", "Weekend"]
+        return names
+
+    def reset(self) -> None:
+        self._ewm = np.zeros(len(self._alpha))
+        self._recent = np.zeros((0, len(self.metrics)))
+        self._last_switch = -np.inf
+
+    def update(self, ts: float, row: Sequence[float]) -> np.ndarray:
+        return self.transform([ts], [row])[0]
+
+    def transform(
+        self, timestamps: Sequence[float], rows: Sequence[Sequence[float]]
+    ) -> np.ndarray:
+        ts = np.asarray(timestamps, dtype=float)
+        x = np.asarray(rows, dtype=float).reshape(len(ts), len(self.metrics))
+        x = np.nan_to_num(x)
+        x[x < 0] = 0
+        out = np.empty((len(ts), len(self.names)))
+        if not len(ts):
+            return out
+        last_ts = -np.inf if self._last_ts is None else self._last_ts
+        previous = np.concatenate([[last_ts], ts[:-1]])
+        starts = np.flatnonzero(ts - previous > self.gap)
+        bounds = sorted(set([0, len(ts)]) | set(starts.tolist()))
+        for a, b in zip(bounds[:-1], bounds[1:]):
+            if a in starts:
+                self.reset()
+            out[a:b] = self._segment(ts[a:b], x[a:b])
+        self._last_ts = float(ts[-1])
+        return out
+
+    def _segment(self, ts: np.ndarray, x: np.ndarray) -> np.ndarray:
+        """Features of rows without a gap, continuing from the state."""
+        n, f = x.shape
+        ones = np.ones((n, 1))
+        tiled = np.tile(np.hstack([x, ones]), len(self.spans))
+        filtered = _decay(tiled, self._alpha, self._ewm)
+        self._ewm = filtered[-1]
+        per_span = filtered.reshape(n, len(self.spans), f + 1)
+        ewm = per_span[:, :, :f] / per_span[:, :, f:]
+
+        full = np.vstack([self._recent, x])
+        sums = np.vstack([np.zeros((1, f)), np.cumsum(full, axis=0)])
+        end = np.arange(len(self._recent), len(full)) + 1
+        start = np.maximum(end - self.window, 0)
+        mean = (sums[end] - sums[start]) / (end - start)[:, None]
+        keep = max(0, len(full) - self.window + 1) if self.window > 1 else len(full)
+        self._recent = full[keep:]
+
+        columns = [x, ewm.reshape(n, -1), mean, ewm[:, 0] - ewm[:, -1]]
+        if self._switch is not None:
+            switched = np.where(x[:, self._switch] > 0, ts, -np.inf)
+            since = np.concatenate([[self._last_switch], switched])
+            last = np.maximum.accumulate(since)[1:]
+            self._last_switch = last[-1]
+            columns.append(np.minimum((ts - last) / 60, SWITCH_CAP_MIN)[:, None])
+        angle = 2 * math.pi * (ts % DAY_SEC) / DAY_SEC
+        weekday = (ts // DAY_SEC + 3) % 7  # 1970-01-01 was a Thursday, Monday is 0
+        columns.append(np.column_stack([np.sin(angle), np.cos(angle), weekday >= 5]))
+        return np.hstack(columns)
@@ -12,7 +12,9 @@ import math
 import time
 from sklearn.metrics import roc_auc_score
 
-from flowd.utils import wnf
+from flowd.focus import FocusController
+from flowd.model.features import RollingFeatures
+from flowd.model.features import wall_seconds
 
 
 data_path = os.path.expanduser("~/flowd/")
@@ -22,6 +24,7 @@ metrics = [
     "Code Assist Activated (times)",
     "Distraction Class Window Activated (times)",
     "Full Lines Entered (times)",
+    "In a Meeting (seconds)",
     "Mouse Used (seconds)",
     "Mouse Used for Selection (times)",
     "Popular Shortcuts Used (times)",
@@ -49,17 +52,34 @@ class LogisticRegressionTorch(nn.Module):
         return torch.sigmoid(self.linear(x))
 
 
+def feature_pipeline() -> RollingFeatures:
+    return RollingFeatures(metrics)
+
+
+def frame_features(df, pipeline=None) -> np.ndarray:
+    """Features of a pivot table's rows (a date column and the metrics), in
+    time order. Training and predict() use this; the supervisor feeds the
+    same pipeline a row at a time."""
+    pipeline = pipeline or feature_pipeline()
+    ts = [wall_seconds(d) for d in pd.to_datetime(df['date'])]
+    return pipeline.transform(ts, df.reindex(columns=metrics, fill_value=0).values)
+
+
+def labelled_features(df) -> tuple:
+    # features over all the rows, the unlabelled ones are context for the rest
+    x = frame_features(df)
+    labelled = df.notna().all(axis=1).values
+    return x[labelled], df[fs_col][labelled]
+
+
 def load_train_data() -> tuple:
     df_state = pd.read_csv(f'{data_path}/.data_pivot.csv')
-    df_state.dropna(inplace=True)
-    x = df_state[metrics]
-    y = df_state[fs_col]
-    return x, y
+    return labelled_features(df_state)
 
 
 def train_model() -> LogisticRegressionTorch:
     x, y = load_train_data()
-    x_tensor = torch.from_numpy(x.values).float()
+    x_tensor = torch.from_numpy(x).float()
     y_tensor = torch.from_numpy(y.values.reshape(-1, 1)).float()
 
     model = LogisticRegressionTorch(x_tensor.shape[1], y_tensor.shape[1])
@@ -85,19 +105,34 @@ def measure_model(model, x_tensor, y):
 
 def pivot_stats():
     df_metric = pd.read_csv(f'{data_path}/data.csv')
-    df_pivot = pd.pivot_table(df_metric, values=['Value'], index=['date'], columns=['Metric'], fill_value=0)
+    df_pivot = pd.pivot_table(
+        df_metric, values='Value', index=['date'], columns=['Metric'], fill_value=0
+    )
+    # by name: collectors the model wasn't trained on (e.g. meetings) are left out
+    df_pivot = df_pivot.reindex(columns=metrics, fill_value=0)
     p = f'{data_path}/data_pivot.csv'
-    df_pivot.to_csv(p, header=metrics)
+    df_pivot.to_csv(p)
     return p
 
 
+def warm_up(pipeline, minutes=1440) -> np.ndarray:
+    """Runs the pipeline over the latest collected minutes, so that it goes on
+    from the state training had there. Returns their features."""
+    try:
+        df = pd.read_csv(pivot_stats())
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        return np.empty((0, len(pipeline.names)))
+    return frame_features(df.tail(minutes), pipeline)
+
+
+def predict_features(x, model) -> float:
+    """Mean flow state probability over rows of features."""
+    return model(torch.from_numpy(np.asarray(x)).float()).detach().numpy().mean()
+
+
 def predict(path, model, mins):
     df = pd.read_csv(path, index_col=False, infer_datetime_format=True, keep_date_col=True, parse_dates=[0])
-    x = df[metrics]
-    x_tensor = torch.from_numpy(x.values).float()
-    predictions = model(x_tensor)
-    fs_last_mins = predictions.detach().numpy()[-mins:].mean()
-    return fs_last_mins
+    return predict_features(frame_features(df)[-mins:], model)
 
     # y = df_state2[fs_col]
     # y_tensor = torch.from_numpy(y.values.reshape(-1, 1)).float()
@@ -115,11 +150,10 @@ if __name__ == "__main__":
     # Example of usage
     logging.basicConfig(level=logging.DEBUG, format="%(levelname)-8s %(message)s")
     model = train_model()
+    focus = FocusController()
     while True:
+        predicted_at = time.monotonic()
         p = int(predict(pivot_stats(), model, 15) * 100)
         logging.info(f'Last 15 minutes prediction {p}%')
-        if p > 70:
-            wnf.set_focus_mode(2)
-        else:
-            wnf.set_focus_mode(0)
+        focus.update(p, predicted_at)
         time.sleep(60)
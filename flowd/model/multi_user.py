@@ -0,0 +1,257 @@
+"""Per-user flow state models, fitted together.
+
+Every user gets their own logistic regression over the `metrics` columns.
+Instead of running `train_model()` once per user, all users are stacked into
+padded (users x rows x features) arrays, with a mask for the padding, and
+fitted at once with Newton's method: a handful of batched matrix products
+and one batched linear solve per iteration, ~10 iterations instead of 1000
+epochs of Adam.
+
+With `prior_strength` > 0 every user's weights are pulled towards a shared
+prior, the fit on everyone's data pooled, so users with little data end up
+close to the population model instead of overfitting.
+
+    python -m flowd.model.multi_user --users 1000
+"""
+import argparse
+import concurrent.futures
+import logging
+import os
+import time
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+
+L2 = 1e-4  # keeps separable users (e.g. never in flow) from diverging
+MAX_ITER = 25
+TOL = 1e-6
+MAX_STEP = 10.0
+# padded features of one chunk: small enough to stay in cache, and fewer users
+# waiting for the slowest one to converge
+CHUNK_BYTES = 16 * 1024 * 1024
+PRIOR_ROWS = 200000  # sampled from everyone's rows for the shared prior
+
+Dataset = Tuple[np.ndarray, np.ndarray]  # features (rows x metrics), labels (rows,)
+Job = Tuple[List[Dataset], Optional[np.ndarray], float]
+
+
+def pad(datasets: Sequence[Dataset]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Stacks datasets of different lengths into (users x rows x features + 1)
+    features with a constant bias column, labels and a mask of the real rows."""
+    users, rows = len(datasets), max(len(y) for _, y in datasets)
+    features = datasets[0][0].shape[1]
+    X = np.zeros((users, rows, features + 1))
+    y = np.zeros((users, rows))
+    mask = np.zeros((users, rows))
+    for u, (x_u, y_u) in enumerate(datasets):
+        n = len(y_u)
+        X[u, :n, :features] = x_u
+        X[u, :n, features] = 1.0
+        y[u, :n] = y_u
+        mask[u, :n] = 1.0
+    return X, y, mask
+
+
+def fit_batched(
+    X: np.ndarray,
+    y: np.ndarray,
+    mask: np.ndarray,
+    prior: Optional[np.ndarray] = None,
+    prior_strength: float = 0.0,
+    l2: float = L2,
+    max_iter: int = MAX_ITER,
+    tol: float = TOL,
+) -> np.ndarray:
+    """Fits one logistic regression per user on padded arrays from `pad()`,
+    returns (users x features + 1) weights, the bias last.
+
+    Minimizes each user's mean binary cross-entropy (the loss train_model()
+    uses) plus prior_strength/2 * |w - prior|^2 + l2/2 * |w|^2. The l2 term
+    keeps the Hessian positive definite even for a user without rows."""
+    users, _, d = X.shape
+    center = np.zeros(d) if prior is None else prior
+    reg = np.full(d, l2 + prior_strength)
+    n = np.maximum(mask.sum(axis=1), 1.0)[:, None]
+    W = np.tile(center, (users, 1))
+    Xt = X.transpose(0, 2, 1)
+    for _ in range(max_iter):
+        p = 1.0 / (1.0 + np.exp(-np.einsum("und,ud->un", X, W)))
+        gradient = np.einsum("udn,un->ud", Xt, (p - y) * mask) / n + reg * (W - center)
+        hessian = np.matmul(Xt * (p * (1.0 - p) * mask / n)[:, None, :], X) + np.diag(reg)
+        step = np.linalg.solve(hessian, gradient[..., None])[..., 0]
+        # far from the optimum Newton can overshoot, cap the step size
+        norm = np.linalg.norm(step, axis=1, keepdims=True)
+        step *= np.minimum(1.0, MAX_STEP / np.maximum(norm, 1e-12))
+        W -= step
+        if np.abs(step).max() < tol:
+            break
+    return W
+
+
+def predict(W: np.ndarray, x: np.ndarray) -> np.ndarray:
+    """Flow state probabilities for rows of one user's metrics."""
+    return 1.0 / (1.0 + np.exp(-(x @ W[:-1] + W[-1])))
+
+
+def load_users(paths: Dict[str, str]) -> Dict[str, Dataset]:
+    """Datasets from users' .data_pivot.csv files (user -> path), the same
+    features load_train_data() makes."""
+    import pandas as pd
+    from flowd.model.logistic_regression import labelled_features
+
+    datasets = {}
+    for user, path in paths.items():
+        x, y = labelled_features(pd.read_csv(path))
+        if not len(y):
+            logging.warning(f"no labelled rows for {user} in {path}, skipping")
+            continue
+        datasets[user] = (x, y.values.astype(float))
+    return datasets
+
+
+def to_torch(W: np.ndarray) -> Any:
+    """A LogisticRegressionTorch with these weights, for
+    logistic_regression.predict()."""
+    import torch
+    from flowd.model.logistic_regression import LogisticRegressionTorch
+
+    model = LogisticRegressionTorch(len(W) - 1, 1)
+    with torch.no_grad():
+        model.linear.weight.copy_(torch.from_numpy(W[None, :-1]).float())
+        model.linear.bias.copy_(torch.from_numpy(W[-1:]).float())
+    return model
+
+
+def _fit_chunk(job: Job) -> np.ndarray:
+    datasets, prior, prior_strength = job
+    return fit_batched(*pad(datasets), prior=prior, prior_strength=prior_strength)
+
+
+def _chunks(
+    order: List[int], datasets: Sequence[Dataset], chunk_bytes: int
+) -> List[List[int]]:
+    """Users sorted by row count, cut into chunks whose padded arrays fit in
+    `chunk_bytes`. Similar lengths together keep the padding small."""
+    chunks: List[List[int]] = []
+    current: List[int] = []
+    features = datasets[0][0].shape[1] + 1
+    for u in order:
+        rows = len(datasets[u][1])  # the longest so far, the order is ascending
+        if current and (len(current) + 1) * rows * features * 8 * 2 > chunk_bytes:
+            chunks.append(current)
+            current = []
+        current.append(u)
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def fit_prior(
+    datasets: Sequence[Dataset], rows: int = PRIOR_ROWS, seed: int = 0
+) -> np.ndarray:
+    """One model on everyone's rows pooled, sampled down to `rows`: the prior
+    doesn't need to be exact and all the rows can be a lot."""
+    x = np.concatenate([x for x, _ in datasets])
+    y = np.concatenate([y for _, y in datasets])
+    if len(y) > rows:
+        keep = np.random.RandomState(seed).choice(len(y), rows, replace=False)
+        x, y = x[keep], y[keep]
+    return fit_batched(*pad([(x, y)]))[0]
+
+
+def fit_users(
+    datasets: Dict[str, Dataset],
+    prior_strength: float = 0.0,
+    processes: Optional[int] = None,
+    chunk_bytes: int = CHUNK_BYTES,
+) -> Dict[str, np.ndarray]:
+    """Fits a model per user, returns their weights by user.
+
+    Users are fitted in chunks bounded by `chunk_bytes`; with `processes`
+    the chunks are spread over a process pool (0 means one per CPU). Users
+    without rows are left out, they have nothing to fit."""
+    names = [k for k, (_, y) in datasets.items() if len(y)]
+    if len(names) < len(datasets):
+        logging.warning(f"no rows for {len(datasets) - len(names)} users, skipping them")
+    if not names:
+        return {}
+    data = [datasets[k] for k in names]
+    prior = None
+    if prior_strength > 0:
+        prior = fit_prior(data)
+    order = sorted(range(len(data)), key=lambda u: len(data[u][1]))
+    chunks = _chunks(order, data, chunk_bytes)
+    jobs: List[Job] = [
+        ([data[u] for u in chunk], prior, prior_strength) for chunk in chunks
+    ]
+    if processes is None or len(jobs) == 1:
+        results = [_fit_chunk(job) for job in jobs]
+    else:
+        workers = processes or os.cpu_count()
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            results = list(pool.map(_fit_chunk, jobs))
+    weights = {}
+    for chunk, W in zip(chunks, results):
+        for u, w in zip(chunk, W):
+            weights[names[u]] = w
+    return weights
+
+
+def synthetic_users(users: int, features: int = 15, seed: int = 0) -> Dict[str, Dataset]:
+    """Users with their own true weights around a common one and 1-10 days of
+    working minutes each, count-like features as in the pivot table."""
+    rng = np.random.RandomState(seed)
+    common = rng.normal(0, 0.3, features)
+    datasets = {}
+    for u in range(users):
+        rows = rng.randint(480, 4800)
+        x = rng.poisson(rng.uniform(0.5, 20, features), (rows, features)).astype(float)
+        w = common + rng.normal(0, 0.1, features)
+        logits = (x - x.mean(axis=0)) @ w
+        y = (rng.uniform(size=rows) < 1.0 / (1.0 + np.exp(-logits))).astype(float)
+        datasets[f"user{u:04d}"] = (x, y)
+    return datasets
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
+    parser = argparse.ArgumentParser(description="benchmark batched vs one-by-one fits")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument(
+        "--sequential", type=int, default=5, help="users fitted one by one for comparison"
+    )
+    parser.add_argument("--prior-strength", type=float, default=0.01)
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    datasets = synthetic_users(args.users)
+    rows = sum(len(y) for _, y in datasets.values())
+    logging.info(f"{args.users} users, {rows} rows")
+
+    started = time.perf_counter()
+    weights = fit_users(datasets, args.prior_strength, args.processes)
+    batched = time.perf_counter() - started
+    logging.info(f"batched: {batched:.2f}s for {len(weights)} users")
+
+    names = list(datasets)[: args.sequential]
+    started = time.perf_counter()
+    prior = fit_prior(list(datasets.values()))
+    one_by_one = {
+        k: fit_batched(*pad([datasets[k]]), prior, args.prior_strength)[0]
+        for k in names
+    }
+    sequential = time.perf_counter() - started
+    difference = max(np.abs(one_by_one[k] - weights[k]).max() for k in names)
+    logging.info(
+        f"one by one: {sequential:.2f}s for {len(names)} users (and the pooled prior), "
+        f"largest weight difference to the batched fit {difference:.2e}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Optional
+
+# pinned release of the repo that ships the `sad_ami` torch.hub entry point
+HUB_REPO = "pyannote/pyannote-audio:1.1.1"
+HUB_MODEL = "sad_ami"
+CACHE_DIR = os.path.expanduser("~/flowd/models")
+MANIFEST = "manifest.json"
+RETRY_AFTER_SEC = 600
+
+
+class ModelCacheError(Exception):
+    pass
+
+
+def _sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _cached_files(root: Path) -> Dict[str, Path]:
+    files = {}
+    for p in root.rglob("*"):
+        if not p.is_file() or p.name == MANIFEST:
+            continue
+        # byte code is (re)generated whenever the hub entry point gets imported
+        if "__pycache__" in p.parts or p.suffix == ".pyc":
+            continue
+        files[p.relative_to(root).as_posix()] = p
+    return files
+
+
+class SADPipelineLoader:
+    """Loads the pyannote speech activity detection pipeline in the background
+    from a pinned local torch.hub cache.
+
+    The first download is recorded in a manifest of file hashes and every later
+    load is checked against it. In offline mode (FLOWD_OFFLINE=1) the cache must
+    already be there, the network is never used.
+    """
+
+    def __init__(
+        self, cache_dir: str = CACHE_DIR, offline: Optional[bool] = None
+    ) -> None:
+        self.cache_dir = Path(cache_dir)
+        if offline is None:
+            offline = os.environ.get("FLOWD_OFFLINE", "") not in ("", "0")
+        self.offline = offline
+        self._pipeline: Any = None  # a pyannote.audio Pipeline once loaded
+        self._lock = threading.Lock()
+        self._loading = False
+        self._failed_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._pipeline is not None
+
+    def get(self) -> Any:
+        """Returns the pipeline, or None while it isn't available yet.
+        The first call starts loading it in a background thread."""
+        if self._pipeline is not None:
+            return self._pipeline
+
+        with self._lock:
+            failed_at = self._failed_at
+            retry = failed_at is None or time.time() - failed_at > RETRY_AFTER_SEC
+            if not self._loading and retry:
+                self._loading = True
+                threading.Thread(
+                    target=self._load, name="SAD-loader", daemon=True
+                ).start()
+        return None
+
+    def _load(self) -> None:
+        try:
+            started_at = time.perf_counter()
+            self._pipeline = self.load()
+            logging.info(f"speech activity detection pipeline loaded in "
+                         f"{time.perf_counter() - started_at:.1f}s")
+        except Exception as e:
+            logging.error(f"unable to load the speech activity detection pipeline: {e}")
+            self._failed_at = time.time()
+        finally:
+            self._loading = False
+
+    def load(self) -> Any:
+        import torch
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        torch.hub.set_dir(str(self.cache_dir))
+
+        manifest = self.cache_dir / MANIFEST
+        if manifest.exists():
+            self.verify()
+        elif self.offline:
+            raise ModelCacheError(
+                f"offline mode, but there's no model cache in {self.cache_dir}"
+            )
+
+        pipeline = torch.hub.load(HUB_REPO, HUB_MODEL, pipeline=True)
+
+        if not manifest.exists():
+            self.write_manifest()
+        return pipeline
+
+    def verify(self) -> None:
+        with open(self.cache_dir / MANIFEST) as f:
+            expected = json.load(f)
+
+        for name, digest in expected.items():
+            path = self.cache_dir / name
+            if not path.is_file() or _sha256(path) != digest:
+                raise ModelCacheError(
+                    f"{path} is missing or corrupted, remove {self.cache_dir} "
+                    "to download the model again"
+                )
+
+    def write_manifest(self) -> None:
+        digests = {name: _sha256(p) for name, p in _cached_files(self.cache_dir).items()}
+        tmp = self.cache_dir / f"{MANIFEST}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(digests, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.cache_dir / MANIFEST)
@@ -0,0 +1,167 @@
+import logging
+import threading
+import time
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from flowd.metrics import Presence
+
+PresenceCallback = Callable[[Presence, Presence], None]
+
+
+def battery_percent() -> Optional[float]:
+    """Battery charge, None without a battery or while it's charging."""
+    import psutil
+
+    battery = psutil.sensors_battery()
+    if battery is None or battery.power_plugged:
+        return None
+    return float(battery.percent)
+
+
+class UsageCounter:
+    """Wall time, CPU time of this process and battery drain, per presence state.
+
+    Tells what the daemon itself costs while nobody is using the computer.
+    """
+
+    def __init__(
+        self,
+        clock: Callable[[], float] = time.monotonic,
+        cpu_time: Callable[[], float] = time.process_time,
+        battery: Callable[[], Optional[float]] = battery_percent,
+    ) -> None:
+        self.clock = clock
+        self.cpu_time = cpu_time
+        self.battery = battery
+        self._lock = threading.Lock()
+        self._state: Optional[Presence] = None
+        self._wall = clock()
+        self._cpu = cpu_time()
+        self._charge = battery()
+        self.totals: Dict[Presence, Dict[str, float]] = {
+            p: {
+                "seconds": 0.0,
+                "cpu_seconds": 0.0,
+                "battery_seconds": 0.0,
+                "battery_used": 0.0,
+            }
+            for p in Presence
+        }
+
+    def switch(self, state: Presence) -> None:
+        """Charges everything since the last switch to the previous state."""
+        with self._lock:
+            wall, cpu, charge = self.clock(), self.cpu_time(), self.battery()
+            if self._state is not None:
+                t = self.totals[self._state]
+                t["seconds"] += wall - self._wall
+                t["cpu_seconds"] += cpu - self._cpu
+                if charge is not None and self._charge is not None:
+                    t["battery_seconds"] += wall - self._wall
+                    t["battery_used"] += max(self._charge - charge, 0.0)
+            self._state = state
+            self._wall, self._cpu, self._charge = wall, cpu, charge
+
+    def report(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """CPU use (share of one core) and battery drain (% per hour) per state."""
+        if self._state is not None:
+            self.switch(self._state)
+        report = {}
+        with self._lock:
+            for state, t in self.totals.items():
+                if not t["seconds"]:
+                    continue
+                report[state.value] = {
+                    "seconds": round(t["seconds"], 1),
+                    "cpu": round(t["cpu_seconds"] / t["seconds"], 4),
+                    "battery_per_hour": round(
+                        t["battery_used"] / t["battery_seconds"] * 3600, 2
+                    )
+                    if t["battery_seconds"]
+                    else None,
+                }
+        return report
+
+
+class PresenceMonitor:
+    """Tracks whether the user is active, idle, away or has locked the workstation.
+
+    While the user is active it sleeps until the earliest moment they can
+    become idle, otherwise it checks every POLL_SEC so collection resumes as
+    soon as they're back. Subscribers are called with (previous, state) on
+    every transition.
+    """
+
+    IDLE_AFTER_SEC = 10
+    AFK_AFTER_SEC = 30  # same as the AFK metric
+    POLL_SEC = 1
+
+    def __init__(
+        self,
+        idle_seconds: Optional[Callable[[], float]] = None,
+        is_locked: Optional[Callable[[], bool]] = None,
+        usage: Optional[UsageCounter] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        if idle_seconds is None or is_locked is None:
+            from flowd.utils.windows import is_workstation_locked
+            from flowd.utils.windows import seconds_since_last_input
+
+            idle_seconds = idle_seconds or seconds_since_last_input
+            is_locked = is_locked or is_workstation_locked
+        self.idle_seconds = idle_seconds
+        self.is_locked = is_locked
+        self.clock = clock
+        self.usage = usage or UsageCounter()
+        self.state = Presence.ACTIVE
+        self.since = clock()
+        self._subscribers: List[PresenceCallback] = []
+        self._quit = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.usage.switch(self.state)
+
+    def subscribe(self, callback: PresenceCallback) -> None:
+        self._subscribers.append(callback)
+
+    def _classify(self, idle: float) -> Presence:
+        if self.is_locked():
+            return Presence.LOCKED
+        if idle >= self.AFK_AFTER_SEC:
+            return Presence.AFK
+        if idle >= self.IDLE_AFTER_SEC:
+            return Presence.IDLE
+        return Presence.ACTIVE
+
+    def check(self) -> float:
+        """Updates the state, returns the seconds until the next check."""
+        idle = self.idle_seconds()
+        state = self._classify(idle)
+        if state != self.state:
+            previous, self.state, self.since = self.state, state, self.clock()
+            self.usage.switch(state)
+            logging.info(f"presence: {previous.value} -> {state.value}")
+            for callback in list(self._subscribers):
+                try:
+                    callback(previous, state)
+                except Exception as e:
+                    logging.error(f"presence subscriber failed: {e}", exc_info=True)
+        if state is Presence.ACTIVE:
+            return max(self.IDLE_AFTER_SEC - idle, self.POLL_SEC)
+        return self.POLL_SEC
+
+    def _run(self) -> None:
+        while not self._quit.is_set():
+            self._quit.wait(self.check())
+
+    def start(self) -> None:
+        self._quit.clear()
+        self._thread = threading.Thread(
+            target=self._run, name="PresenceMonitor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._quit.set()
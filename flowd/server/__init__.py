@@ -0,0 +1,81 @@
+"""flowd-server: the central collector flowd agents ship their data to.
+
+    flowd-server serve --data-dir DIR [--port 8765] [--teams teams.json]
+    flowd-server loadgen --url http://host:8765 [--agents 2000] [--batches 5]
+                         [--rows 60]
+
+Agents point FLOWD_SHIP_URL (or --ship-to) at http://host:8765/ingest.
+teams.json maps team names to agent ids, e.g. {"platform": ["alice@DESKTOP-1"]}.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import sys
+
+from flowd.server import loadgen
+from flowd.server.ingest import IngestServer
+from flowd.server.storage import Storage
+
+DEFAULT_PORT = 8765
+DEFAULT_DATA_DIR = os.path.expanduser("~/flowd-server")
+
+
+def serve(args: argparse.Namespace) -> None:
+    teams = {}
+    if args.teams:
+        with open(args.teams) as f:
+            teams = json.load(f)
+    loadgen.raise_open_files_limit()
+    server = IngestServer(Storage(args.data_dir), teams)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(server.start(args.host, args.port))
+    stopped = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stopped.set)
+        except NotImplementedError:
+            pass  # Windows, Ctrl+C still ends up in KeyboardInterrupt
+    try:
+        loop.run_until_complete(stopped.wait())
+    except KeyboardInterrupt:
+        pass
+    loop.run_until_complete(server.stop())
+    logging.info("bye")
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
+    parser = argparse.ArgumentParser(
+        prog="flowd-server", description=__doc__.splitlines()[0]
+    )
+    commands = parser.add_subparsers(dest="command")
+
+    p = commands.add_parser("serve", help="accept uploads and serve queries")
+    p.add_argument("--host", default="0.0.0.0")
+    p.add_argument("--port", type=int, default=DEFAULT_PORT)
+    p.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    p.add_argument("--teams", help="JSON file mapping team names to agent ids")
+
+    p = commands.add_parser(
+        "loadgen", help="replay synthetic agent traffic against a server"
+    )
+    p.add_argument("--url", default=f"http://127.0.0.1:{DEFAULT_PORT}")
+    p.add_argument("--agents", type=int, default=2000)
+    p.add_argument("--batches", type=int, default=5, help="batches per agent")
+    p.add_argument("--rows", type=int, default=60, help="one-minute rows per batch")
+    p.add_argument(
+        "--ramp", type=float, default=1.0, help="seconds over which the agents connect"
+    )
+
+    args = parser.parse_args(sys.argv[1:] or ["serve"])
+    if args.command == "loadgen":
+        loadgen.run(args.url, args.agents, args.batches, args.rows, args.ramp)
+    else:
+        serve(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+import asyncio
+import concurrent.futures
+import datetime
+import json
+import logging
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from urllib.parse import parse_qsl
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from flowd.server.schema import FLOW_STATE
+from flowd.server.schema import MAX_BATCH_BYTES
+from flowd.server.schema import SchemaError
+from flowd.server.schema import validate
+from flowd.server.storage import AgentState
+from flowd.server.storage import Rows
+from flowd.server.storage import Storage
+from flowd.shipper import Batch
+from flowd.shipper import decode_batch
+from flowd.utils import telemetry
+
+FLUSH_SEC = 0.5
+MAX_BODY = 1024 * 1024
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    413: "Payload Too Large",
+    422: "Unprocessable Entity",
+    500: "Internal Server Error",
+}
+
+BATCHES = telemetry.EVENTS.labels("flowd-server", "batch")
+ROWS = telemetry.EVENTS.labels("flowd-server", "row")
+DUPLICATES = telemetry.EVENTS.labels("flowd-server", "duplicate_row")
+REJECTED = telemetry.EVENTS.labels("flowd-server", "rejected_batch")
+FLUSH_SECONDS = telemetry.TASK_SECONDS.labels("flush")
+
+Response = Tuple[int, Any]
+
+
+class IngestServer(object):
+    """Accepts batches from flowd shippers and answers aggregate queries.
+
+    Connections are served by asyncio streams, so thousands of mostly idle
+    keep-alive connections cost little. Accepted batches are buffered and
+    written by a single writer thread every FLUSH_SEC (group commit); an
+    agent gets its acknowledgement once its rows are on disk.
+
+        POST /ingest                          a flowd.shipper batch
+        GET  /query/hourly?day=&team=&column= hourly means over a team
+        GET  /metrics                         the server's own telemetry
+
+    Teams map a name to agent ids, the ones not listed can still be queried
+    with team=* (everyone).
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        teams: Optional[Dict[str, List[str]]] = None,
+        flush_interval: float = FLUSH_SEC,
+    ) -> None:
+        self.storage = storage
+        self.teams = teams or {}
+        self.flush_interval = flush_interval
+        self._writer = concurrent.futures.ThreadPoolExecutor(
+            1, thread_name_prefix="writer"
+        )
+        self._readers = concurrent.futures.ThreadPoolExecutor(
+            4, thread_name_prefix="query"
+        )
+        # decoding and validating a batch takes a while for a week of rows
+        self._decoders = concurrent.futures.ThreadPoolExecutor(
+            4, thread_name_prefix="decode"
+        )
+        self._buffer: List[Rows] = []
+        self._acks: Dict[str, AgentState] = {}
+        self._waiters: List[asyncio.Future] = []
+        # newest rows accepted per agent, including the ones waiting to be written
+        self._accepted: Dict[str, AgentState] = dict(storage.agents)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._flusher: Optional[asyncio.Future] = None
+        self.connections = 0
+
+    async def start(self, host: str = "0.0.0.0", port: int = 8765) -> None:
+        self._server = await asyncio.start_server(
+            self._serve, host, port, backlog=4096
+        )
+        self._flusher = asyncio.ensure_future(self._flush_loop())
+        logging.info(f"flowd-server listening on {host}:{port}")
+
+    @property
+    def port(self) -> int:
+        if self._server is None:
+            raise RuntimeError("the server isn't started")
+        sockets = self._server.sockets or []
+        return int(sockets[0].getsockname()[1])
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self._flush()
+        self._writer.shutdown()
+        self._readers.shutdown()
+        self._decoders.shutdown()
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self._flush()
+
+    async def _flush(self) -> None:
+        if not self._waiters:
+            return
+        buffer, acks, waiters = self._buffer, self._acks, self._waiters
+        self._buffer, self._acks, self._waiters = [], {}, []
+        loop = asyncio.get_event_loop()
+        started = loop.time()
+        try:
+            await loop.run_in_executor(self._writer, self.storage.write, buffer, acks)
+        except Exception as e:
+            logging.error(f"could not write {len(buffer)} batches: {e}", exc_info=True)
+            # what wasn't written can come again; these agents wait for their ack,
+            # so there's nothing newer from them in the buffer
+            for agent in acks:
+                self._accepted[agent] = self.storage.agents.get(agent, AgentState(0, 0.0))
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+        FLUSH_SECONDS.observe(loop.time() - started)
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    @staticmethod
+    def _decode(body: bytes) -> Batch:
+        batch = decode_batch(body, MAX_BATCH_BYTES)
+        validate(batch)
+        return batch
+
+    async def ingest(self, body: bytes) -> Response:
+        loop = asyncio.get_event_loop()
+        try:
+            batch = await loop.run_in_executor(self._decoders, self._decode, body)
+        except ValueError as e:
+            REJECTED.inc()
+            return (422 if isinstance(e, SchemaError) else 400), {"error": str(e)}
+        BATCHES.inc()
+        previous = self._accepted.get(batch.agent, AgentState(0, 0.0))
+        timestamps = np.asarray(batch.timestamps, dtype=np.float64)
+        fresh = timestamps > previous.last_ts
+        state = AgentState(
+            max(previous.acked, batch.end_offset),
+            float(max(previous.last_ts, timestamps[-1])),
+        )
+        self._accepted[batch.agent] = state
+        DUPLICATES.inc(int((~fresh).sum()))
+        if fresh.any():
+            ROWS.inc(int(fresh.sum()))
+            values = np.asarray(batch.rows, dtype=np.float32)[fresh]
+            rows = Rows(batch.agent, batch.columns, timestamps[fresh], values)
+            self._buffer.append(rows)
+        self._acks[batch.agent] = state
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except Exception:
+            return 500, {"error": "storage failure"}
+        return 200, {"acked": state.acked, "rows": int(fresh.sum())}
+
+    async def hourly(self, query: Dict[str, str]) -> Response:
+        day = query.get("day") or datetime.datetime.utcnow().strftime("%Y-%m-%d")
+        column = query.get("column", FLOW_STATE)
+        team = query.get("team", "*")
+        try:
+            datetime.datetime.strptime(day, "%Y-%m-%d")
+        except ValueError:
+            return 400, {"error": f"bad day {day!r}"}
+        if team != "*" and team not in self.teams:
+            return 404, {"error": f"unknown team {team!r}"}
+        agents = None if team == "*" else self.teams[team]
+        hours = await asyncio.get_event_loop().run_in_executor(
+            self._readers, self.storage.hourly, day, column, agents
+        )
+        return 200, {"day": day, "team": team, "column": column, "hours": hours}
+
+    async def _dispatch(self, method: str, target: str, body: bytes) -> Response:
+        url = urlsplit(target)
+        if method == "POST" and url.path == "/ingest":
+            return await self.ingest(body)
+        if method == "GET" and url.path == "/query/hourly":
+            return await self.hourly(dict(parse_qsl(url.query)))
+        if method == "GET" and url.path == "/metrics":
+            return 200, telemetry.registry.render()
+        return 404, {"error": "not found"}
+
+    async def _serve(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """A minimal HTTP/1.1 server loop with keep-alive, one request at a time."""
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, version = request_line.decode("latin1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY:
+                    too_large = {"error": "batch too large"}
+                    await self._respond(writer, 413, too_large, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                try:
+                    status, payload = await self._dispatch(method, target, body)
+                except Exception as e:
+                    logging.error(f"{method} {target} failed: {e}", exc_info=True)
+                    status, payload = 500, {"error": "internal error"}
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    @staticmethod
+    async def _respond(
+        writer: asyncio.StreamWriter, status: int, payload: Any, keep_alive: bool
+    ) -> None:
+        if isinstance(payload, str):
+            data = payload.encode("utf8")
+            content_type = "text/plain; version=0.0.4; charset=utf-8"
+        else:
+            data, content_type = json.dumps(payload).encode("utf8"), "application/json"
+        head = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin1") + data)
+        await writer.drain()
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import logging
+import random
+import statistics
+import sys
+import time
+from typing import List
+from typing import Tuple
+
+from flowd.server.schema import COLUMNS
+from flowd.shipper import Batch
+from flowd.shipper import CONTENT_TYPE
+from flowd.shipper import encode_batch
+
+OPEN_FILES = 65536
+OPEN_MAX = 10240  # macOS caps the soft limit here, whatever the hard limit says
+
+
+def synthetic_batches(agent: str, count: int, rows: int, start: float) -> List[bytes]:
+    """`count` consecutive batches of `rows` one-minute rows, like a shipper
+    that was offline for a while would send them."""
+    rng = random.Random(agent)
+    batches, offset, ts = [], 0, start
+    for _ in range(count):
+        timestamps, values = [], []
+        for _ in range(rows):
+            timestamps.append(ts)
+            row = [
+                float(rng.randint(0, 20 if c.endswith("(times)") else 60))
+                for c in COLUMNS[:-1]  # the flow state is last
+            ]
+            values.append(tuple(row + [float(rng.randint(0, 100))]))
+            ts += 60
+        end = offset + rows * 150  # about what a row takes in the spool
+        batch = Batch(agent, offset, end, list(COLUMNS), timestamps, values)
+        batches.append(encode_batch(batch))
+        offset = end
+    return batches
+
+
+async def _agent(
+    host: str, port: int, batches: List[bytes], latencies: List[float]
+) -> int:
+    reader, writer = await asyncio.open_connection(host, port)
+    failures = 0
+    try:
+        for body in batches:
+            started = time.perf_counter()
+            head = (
+                f"POST /ingest HTTP/1.1\r\nHost: {host}\r\n"
+                f"Content-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\n\r\n"
+            )
+            writer.write(head.encode("latin1") + body)
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+            response = json.loads(await reader.readexactly(length))
+            latencies.append(time.perf_counter() - started)
+            if status != 200:
+                failures += 1
+                print(f"HTTP {status}: {response}")
+    finally:
+        writer.close()
+    return failures
+
+
+def raise_open_files_limit() -> None:
+    """Raises the soft limit on open files (a socket each) towards OPEN_FILES,
+    as far as the hard limit allows."""
+    if sys.platform == "win32":  # the asyncio proactor has no such limit
+        return
+    import resource
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    target = OPEN_FILES if hard == resource.RLIM_INFINITY else min(hard, OPEN_FILES)
+    if soft != resource.RLIM_INFINITY and soft >= target:
+        return
+    for limit in (target, min(target, OPEN_MAX)):
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+            return
+        except (ValueError, OSError):
+            continue
+    logging.warning(f"could not raise the open files limit from {soft}")
+
+
+def run(
+    url: str, agents: int, batches: int, rows: int, ramp: float = 1.0
+) -> Tuple[float, float]:
+    """Replays `agents` agents sending `batches` batches each, all at once
+    (spread over `ramp` seconds). Prints and returns rows/s and p99 latency."""
+    raise_open_files_limit()
+    host, _, port = url.split("//", 1)[-1].split("/")[0].partition(":")
+    start = time.time() - batches * rows * 60  # so that the last rows are about now
+    payloads = [
+        synthetic_batches(f"loadgen {i:05d}@bench", batches, rows, start)
+        for i in range(agents)
+    ]
+    latencies: List[float] = []
+
+    async def agent(i: int) -> int:
+        await asyncio.sleep(ramp * i / agents)
+        return await _agent(host, int(port or 80), payloads[i], latencies)
+
+    async def everyone() -> List[int]:
+        return list(await asyncio.gather(*(agent(i) for i in range(agents))))
+
+    started = time.perf_counter()
+    failures = sum(asyncio.get_event_loop().run_until_complete(everyone()))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    total_rows = agents * batches * rows
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"{agents} agents x {batches} batches x {rows} rows: {elapsed:.2f}s, "
+        f"{len(latencies) / elapsed:.0f} batches/s, {total_rows / elapsed:.0f} rows/s, "
+        f"latency median {statistics.median(latencies) * 1000:.0f} ms "
+        f"p99 {p99 * 1000:.0f} ms, "
+        f"{failures} failed"
+    )
+    return total_rows / elapsed, p99
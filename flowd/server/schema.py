@@ -0,0 +1,87 @@
+import re
+import time
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+from flowd.shipper import Batch
+
+# printable, the storage maps agent ids to directory names (user names can have spaces)
+AGENT_RE = re.compile(r"^[^\x00-\x1f\x7f]{1,128}$")
+FLOW_STATE = "Flow State Prediction (%)"
+# the collectors' metric_names (flowd.metrics), keep in sync when adding one
+METRIC_COLUMNS = (
+    "Active Window Changed (times)",
+    "Any Shortcut Used (times)",
+    "Code Assist Activated (times)",
+    "Distraction Class Window Activated (times)",
+    "Full Lines Entered (times)",
+    "In a Meeting (seconds)",
+    "Mouse Used (seconds)",
+    "Mouse Used for Selection (times)",
+    "Popular Shortcuts Used (times)",
+    "Productivity Class Window Activated (times)",
+    "SSH Session Active (seconds)",
+    "Test Metric",
+    "Time in AFK (seconds)",
+    "Time in Alerts Only Mode (seconds)",
+    "Time in Priority Mode (seconds)",
+    "Voice Activity Detected (seconds)",
+)
+# what the supervisor ships: the collectors' metrics and its prediction
+COLUMNS = METRIC_COLUMNS + (FLOW_STATE,)
+MAX_COLUMNS = 256
+MAX_ROWS = 10080  # a week of minutes
+# decompressed size of the largest batch validate() can accept: timestamps and
+# values, the agent id and the column names
+MAX_BATCH_BYTES = MAX_ROWS * (8 + 4 * MAX_COLUMNS) + (MAX_COLUMNS + 1) * 1024
+EARLIEST_TS = 1577836800.0  # 2020-01-01, flowd didn't exist before
+MAX_FUTURE_SEC = 86400.0
+# collectors report -1 when they died, and per-minute values
+UNIT_RANGES = {
+    "(seconds)": (-1.0, 3600.0),
+    "(times)": (-1.0, 1e6),
+    "(%)": (-1.0, 100.0),
+}
+DEFAULT_RANGE = (-1.0, 1e9)
+
+
+class SchemaError(ValueError):
+    pass
+
+
+def value_range(column: str) -> Tuple[float, float]:
+    for unit, bounds in UNIT_RANGES.items():
+        if column.endswith(unit):
+            return bounds
+    return DEFAULT_RANGE
+
+
+def validate(batch: Batch, now: Optional[float] = None) -> None:
+    """Raises SchemaError unless the batch looks like rows written by the
+    supervisor: known columns, timestamps in order and values in range."""
+    now = time.time() if now is None else now
+    if not AGENT_RE.match(batch.agent) or batch.agent.strip(".") == "":
+        raise SchemaError(f"bad agent id {batch.agent!r}")
+    if batch.end_offset < batch.first_offset:
+        raise SchemaError("offsets out of order")
+    if not batch.columns or len(batch.columns) > MAX_COLUMNS:
+        raise SchemaError(f"{len(batch.columns)} columns")
+    if len(set(batch.columns)) != len(batch.columns):
+        raise SchemaError("duplicate columns")
+    for column in batch.columns:
+        if column not in COLUMNS:
+            raise SchemaError(f"unknown column {column!r}")
+    if not batch.rows or len(batch.rows) > MAX_ROWS:
+        raise SchemaError(f"{len(batch.rows)} rows")
+    ts = np.asarray(batch.timestamps)
+    in_range = EARLIEST_TS <= ts[0] and ts[-1] <= now + MAX_FUTURE_SEC
+    if not in_range or np.any(np.diff(ts) < 0):
+        raise SchemaError("timestamps out of order or range")
+    values = np.asarray(batch.rows, dtype=np.float64)
+    low, high = np.array([value_range(c) for c in batch.columns]).T
+    bad = ~(np.isfinite(values) & (values >= low) & (values <= high))
+    if bad.any():
+        row, col = np.argwhere(bad)[0]
+        raise SchemaError(f"{batch.columns[col]} = {values[row, col]} out of range")
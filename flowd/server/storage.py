@@ -0,0 +1,226 @@
+import datetime
+import json
+import os
+import threading
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from urllib.parse import quote
+from urllib.parse import unquote
+
+import numpy as np
+
+DAY_SEC = 86400
+TS_FILE = "ts.f64"
+COLUMNS_FILE = "columns.json"
+STATE_FILE = "agents.json"
+MAX_CACHED_PARTITIONS = 10000
+
+
+class Rows(NamedTuple):
+    agent: str
+    columns: List[str]
+    timestamps: np.ndarray  # float64
+    values: np.ndarray  # float32, rows x columns
+
+
+class AgentState(NamedTuple):
+    acked: int  # spool offset the agent can resume from
+    last_ts: float  # newest row stored, older ones are duplicates
+
+
+def day_of(ts: float) -> str:
+    return datetime.datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d")
+
+
+def _column_file(index: int) -> str:
+    return f"c{index:03d}.f32"
+
+
+def agent_dir(agent: str) -> str:
+    """The directory name of an agent id, percent-encoded so that any id
+    (spaces, slashes, ...) is one safe path component and maps back."""
+    name = quote(agent, safe="@+-_")
+    if name.strip(".") == "":  # quote() leaves dots alone
+        name = name.replace(".", "%2E")
+    return name
+
+
+def dir_agent(name: str) -> str:
+    return unquote(name)
+
+
+def read_column(path: str, column: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Timestamps and the column of a partition, None if it doesn't have the
+    column. Read-only and safe next to appends: the timestamps are appended
+    last, and anything past the last complete row is ignored."""
+    try:
+        with open(os.path.join(path, COLUMNS_FILE)) as f:
+            columns = json.load(f)
+    except FileNotFoundError:
+        columns = []
+    ts = np.fromfile(os.path.join(path, TS_FILE), dtype="<f8")
+    if column not in columns:
+        return ts, None
+    column_path = os.path.join(path, _column_file(columns.index(column)))
+    values = np.fromfile(column_path, dtype="<f4")
+    n = min(len(ts), len(values))
+    return ts[:n], values[:n]
+
+
+class _Partition(object):
+    """One agent's rows of one day: a float64 timestamp file and a float32
+    file per column, all with one entry per row. Columns that show up later
+    are padded with NaN for the rows before them, missing ones get NaN."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.columns: List[str] = []
+        try:
+            with open(os.path.join(path, COLUMNS_FILE)) as f:
+                self.columns = json.load(f)
+        except FileNotFoundError:
+            pass
+        files = [TS_FILE] + [_column_file(i) for i in range(len(self.columns))]
+        sizes = [self._size(name) // (8 if name == TS_FILE else 4) for name in files]
+        self.rows = min(sizes)
+        # a crash between appends leaves some files longer, cut them back
+        for name, size in zip(files, sizes):
+            if size > self.rows:
+                with open(os.path.join(path, name), "r+b") as data:
+                    data.truncate(self.rows * (8 if name == TS_FILE else 4))
+
+    def _size(self, name: str) -> int:
+        try:
+            return os.path.getsize(os.path.join(self.path, name))
+        except FileNotFoundError:
+            return 0
+
+    def _append(self, name: str, data: np.ndarray) -> None:
+        with open(os.path.join(self.path, name), "ab") as f:
+            data.tofile(f)
+
+    def append(
+        self, columns: Sequence[str], timestamps: np.ndarray, values: np.ndarray
+    ) -> None:
+        new = [c for c in columns if c not in self.columns]
+        if new:
+            for i in range(len(self.columns), len(self.columns) + len(new)):
+                self._append(_column_file(i), np.full(self.rows, np.nan, dtype="<f4"))
+            self.columns.extend(new)
+            tmp = os.path.join(self.path, f"{COLUMNS_FILE}.tmp")
+            with open(tmp, "w") as f:
+                json.dump(self.columns, f)
+            os.replace(tmp, os.path.join(self.path, COLUMNS_FILE))
+        where = {c: i for i, c in enumerate(columns)}
+        for i, column in enumerate(self.columns):
+            if column in where:
+                data = values[:, where[column]].astype("<f4")
+            else:
+                data = np.full(len(timestamps), np.nan, dtype="<f4")
+            self._append(_column_file(i), data)
+        # timestamps last: rows only count once all their columns are there
+        self._append(TS_FILE, timestamps.astype("<f8"))
+        self.rows += len(timestamps)
+
+
+class Storage(object):
+    """Columnar storage partitioned by day and agent:
+
+        <root>/<YYYY-MM-DD>/<agent>/ts.f64, c000.f32, ..., columns.json
+        <root>/agents.json
+
+    with agent ids percent-encoded into directory names, see agent_dir().
+
+    Written by one thread at a time (the ingest server's writer), read by
+    any. Each column is a flat little-endian array, so a query reads only
+    the columns it needs, with numpy.fromfile.
+    """
+
+    def __init__(self, root: str) -> None:
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+        self._partitions: Dict[Tuple[str, str], _Partition] = {}
+        self._lock = threading.Lock()
+        self.agents: Dict[str, AgentState] = {}
+        try:
+            with open(os.path.join(root, STATE_FILE)) as f:
+                self.agents = {k: AgentState(*v) for k, v in json.load(f).items()}
+        except FileNotFoundError:
+            pass
+
+    def _partition(self, day: str, agent: str) -> _Partition:
+        key = (day, agent)
+        with self._lock:
+            partition = self._partitions.get(key)
+            if partition is None:
+                if len(self._partitions) >= MAX_CACHED_PARTITIONS:
+                    # mostly past days, they're reopened if needed
+                    self._partitions.clear()
+                path = os.path.join(self.root, day, agent_dir(agent))
+                partition = self._partitions[key] = _Partition(path)
+            return partition
+
+    def write(self, batches: Iterable[Rows], acks: Dict[str, AgentState]) -> None:
+        """Appends the rows, then records the agents' new state. Only after
+        that are the agents acknowledged, a crash in between can store the rows
+        they resend twice."""
+        for rows in batches:
+            days = (rows.timestamps // DAY_SEC).astype(np.int64)
+            for day in np.unique(days):
+                mask = days == day
+                partition = self._partition(day_of(float(day) * DAY_SEC), rows.agent)
+                partition.append(rows.columns, rows.timestamps[mask], rows.values[mask])
+        if acks:
+            self.agents.update(acks)
+            tmp = os.path.join(self.root, f"{STATE_FILE}.tmp")
+            with open(tmp, "w") as f:
+                json.dump({k: list(v) for k, v in self.agents.items()}, f)
+            os.replace(tmp, os.path.join(self.root, STATE_FILE))
+
+    def day_agents(self, day: str) -> List[str]:
+        try:
+            names = os.listdir(os.path.join(self.root, day))
+        except FileNotFoundError:
+            return []
+        return sorted(dir_agent(name) for name in names)
+
+    def hourly(
+        self, day: str, column: str, agents: Optional[Iterable[str]] = None
+    ) -> List[Dict[str, Optional[float]]]:
+        """Per hour of the (UTC) day: mean of the column over all the agents'
+        minutes, how many minutes and agents went into it. Dead collectors
+        (-1) and missing values don't count."""
+        total = np.zeros(24)
+        count = np.zeros(24, dtype=np.int64)
+        seen = np.zeros(24, dtype=np.int64)
+        midnight = datetime.datetime.strptime(day, "%Y-%m-%d")
+        day_start = midnight.replace(tzinfo=datetime.timezone.utc).timestamp()
+        available = set(self.day_agents(day))
+        for agent in agents if agents is not None else available:
+            if agent not in available:
+                continue
+            path = os.path.join(self.root, day, agent_dir(agent))
+            ts, values = read_column(path, column)
+            if values is None:
+                continue
+            valid = np.isfinite(values) & (values >= 0)
+            hours = np.clip(((ts[valid] - day_start) // 3600).astype(np.int64), 0, 23)
+            total += np.bincount(hours, weights=values[valid], minlength=24)
+            minutes = np.bincount(hours, minlength=24)
+            count += minutes
+            seen += minutes > 0
+        return [
+            {
+                "hour": h,
+                "mean": float(total[h] / count[h]) if count[h] else None,
+                "minutes": int(count[h]),
+                "agents": int(seen[h]),
+            }
+            for h in range(24)
+        ]
@@ -0,0 +1,378 @@
+import getpass
+import glob
+import json
+import logging
+import os
+import socket
+import struct
+import threading
+import time
+import zlib
+from typing import Callable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import requests
+
+SPOOL_DIR = os.path.expanduser("~/flowd/spool")
+SEGMENT_BYTES = 1024 * 1024
+SHIP_SEC = 60.0
+MAX_BATCH_ROWS = 1440  # a day
+MAX_BACKOFF_SEC = 600.0
+DEFAULT_BANDWIDTH = 2048  # bytes per second
+CONTENT_TYPE = "application/x-flowd-batch"
+# what flowd-server answers a bad batch with, it won't get better by resending;
+# any other error (a wrong URL, a proxy asking for credentials) is retried
+REJECTED_STATUSES = frozenset((400, 413, 422))
+
+# spool frames: kind, payload length, payload
+_FRAME = struct.Struct("<BI")
+_SCHEMA, _ROW = 0, 1
+_TS = struct.Struct("<d")
+
+_MAGIC = b"FLB1"
+# magic, first offset, end offset, columns, rows
+_HEADER = struct.Struct("<4sQQHI")
+_SHORT = struct.Struct("<H")
+
+
+class Batch(NamedTuple):
+    agent: str
+    first_offset: int  # spool offsets, end is where the next batch starts
+    end_offset: int
+    columns: List[str]
+    timestamps: List[float]
+    rows: List[Tuple[float, ...]]
+
+
+def encode_batch(batch: Batch) -> bytes:
+    """Column-major and compressed: timestamps as float64 deltas, values as
+    float32. A day of one-minute rows of 16 metrics is a few kB."""
+    n = len(batch.timestamps)
+    header = _HEADER.pack(
+        _MAGIC, batch.first_offset, batch.end_offset, len(batch.columns), n
+    )
+    parts = [header]
+    for name in [batch.agent] + list(batch.columns):
+        encoded = name.encode("utf8")
+        parts.append(_SHORT.pack(len(encoded)) + encoded)
+    previous = [0.0] + list(batch.timestamps[:-1])
+    deltas = [t - p for t, p in zip(batch.timestamps, previous)]
+    parts.append(struct.pack(f"<{n}d", *deltas))
+    for column in zip(*batch.rows) if n else [() for _ in batch.columns]:
+        parts.append(struct.pack(f"<{n}f", *column))
+    return zlib.compress(b"".join(parts), 9)
+
+
+def decode_batch(data: bytes, max_size: int = 0) -> Batch:
+    """Raises ValueError for anything that isn't a well-formed batch, and for
+    batches over `max_size` bytes decompressed (0 for no limit) before it
+    decompresses any more than that."""
+    try:
+        inflater = zlib.decompressobj()
+        raw = inflater.decompress(data, max_size)
+        if inflater.unconsumed_tail:
+            raise ValueError(f"batch over {max_size} bytes")
+        if not inflater.eof:
+            raise ValueError("truncated batch")
+        magic, first, end, ncols, n = _HEADER.unpack_from(raw, 0)
+        if magic != _MAGIC:
+            raise ValueError("not a flowd batch")
+        at = _HEADER.size
+        names = []
+        for _ in range(ncols + 1):
+            (length,) = _SHORT.unpack_from(raw, at)
+            at += _SHORT.size
+            names.append(raw[at:at + length].decode("utf8"))
+            at += length
+        deltas = struct.unpack_from(f"<{n}d", raw, at)
+        at += 8 * n
+        columns = []
+        for _ in range(ncols):
+            columns.append(struct.unpack_from(f"<{n}f", raw, at))
+            at += 4 * n
+        if at != len(raw):
+            raise ValueError("trailing data")
+    except (zlib.error, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f"malformed batch: {e}") from e
+    timestamps, t = [], 0.0
+    for d in deltas:
+        t += d
+        timestamps.append(t)
+    rows = list(zip(*columns)) if ncols else [()] * n
+    return Batch(names[0], first, end, names[1:], timestamps, rows)
+
+
+def default_agent_id() -> str:
+    agent = os.environ.get("FLOWD_AGENT_ID")
+    return agent or f"{getpass.getuser()}@{socket.gethostname()}"
+
+
+class TokenBucket(object):
+    """Bounds the average rate to `rate` units per second with bursts up to
+    `burst`."""
+
+    def __init__(
+        self, rate: float, burst: float, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self._tokens = burst
+        self._updated = clock()
+
+    def take(self, amount: float) -> float:
+        """Takes `amount`, going into debt if needed, and returns how long to
+        wait before using it."""
+        now = self.clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        self._tokens -= amount
+        return max(-self._tokens / self.rate, 0.0)
+
+
+class Spool(object):
+    """Append-only segment files holding rows that haven't been acknowledged.
+
+    Offsets count bytes over all segments ever written, segment files are
+    named after the offset they start at. Fully acknowledged segments are
+    deleted. A schema frame is written before the first row and whenever
+    the columns change, the acknowledged offset and the schema in force
+    there are kept in ack.json. Batches the server refused are kept in
+    rejected/ for a look, and acknowledged.
+    """
+
+    def __init__(self, path: str = SPOOL_DIR, segment_bytes: int = SEGMENT_BYTES) -> None:
+        self.path = path
+        self.segment_bytes = segment_bytes
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.Lock()
+        self._ack_path = os.path.join(path, "ack.json")
+        try:
+            with open(self._ack_path) as f:
+                state = json.load(f)
+            self.acked, self.acked_columns = state["offset"], state["columns"]
+        except (OSError, ValueError, KeyError):
+            self.acked, self.acked_columns = 0, []
+        segments = self._segments()
+        if segments:
+            base = self._segment_base = segments[-1]
+            end = base
+            for frame in self._frames(base):
+                end = frame[3]
+            with open(self._segment_path(base), "r+b") as segment:
+                segment.truncate(end - base)  # drop a frame torn by a crash
+            self._file = open(self._segment_path(base), "ab")
+            self.end = end
+        else:
+            self._segment_base = self.end = self.acked
+            self._file = open(self._segment_path(self.end), "ab")
+        self._columns = self._last_columns()
+
+    def _segment_path(self, base: int) -> str:
+        return os.path.join(self.path, f"{base:016d}.seg")
+
+    def _segments(self) -> List[int]:
+        paths = glob.glob(os.path.join(self.path, "*.seg"))
+        return sorted(int(os.path.basename(p)[:-4]) for p in paths)
+
+    def _frames(self, start: int) -> Iterator[Tuple[int, int, bytes, int]]:
+        """(offset, kind, payload, next offset) from `start` to the end."""
+        segments = self._segments()
+        for i, base in enumerate(segments):
+            limit = segments[i + 1] if i + 1 < len(segments) else None
+            if limit is not None and limit <= start:
+                continue
+            with open(self._segment_path(base), "rb") as f:
+                at = max(start, base)
+                f.seek(at - base)
+                while True:
+                    header = f.read(_FRAME.size)
+                    if len(header) < _FRAME.size:
+                        break
+                    kind, length = _FRAME.unpack(header)
+                    payload = f.read(length)
+                    if len(payload) < length:
+                        # torn by a crash, cut off when the spool is opened again
+                        break
+                    yield at, kind, payload, at + _FRAME.size + length
+                    at += _FRAME.size + length
+
+    def _last_columns(self) -> List[str]:
+        columns = self.acked_columns
+        for _, kind, payload, _ in self._frames(self.acked):
+            if kind == _SCHEMA:
+                columns = json.loads(payload)
+        return list(columns)
+
+    def _write(self, kind: int, payload: bytes) -> None:
+        self._file.write(_FRAME.pack(kind, len(payload)) + payload)
+        self.end += _FRAME.size + len(payload)
+
+    def append(self, ts: float, columns: Sequence[str], values: Sequence[float]) -> None:
+        with self._lock:
+            if self.end - self._segment_base >= self.segment_bytes:
+                self._file.close()
+                self._segment_base = self.end
+                self._file = open(self._segment_path(self.end), "ab")
+            if list(columns) != self._columns:
+                self._columns = list(columns)
+                self._write(_SCHEMA, json.dumps(self._columns).encode("utf8"))
+            self._write(_ROW, _TS.pack(ts) + struct.pack(f"<{len(values)}d", *values))
+            self._file.flush()
+
+    def read(self, agent: str, max_rows: int = MAX_BATCH_ROWS) -> Optional[Batch]:
+        """The unacknowledged rows from the acked offset on, up to a schema
+        change or `max_rows`. None if there are none."""
+        with self._lock:
+            self._file.flush()
+            columns = self.acked_columns
+            timestamps: List[float] = []
+            rows: List[Tuple[float, ...]] = []
+            end = self.acked
+            for _, kind, payload, next_offset in self._frames(self.acked):
+                if kind == _SCHEMA:
+                    if rows:
+                        break
+                    columns = json.loads(payload)
+                else:
+                    (ts,) = _TS.unpack_from(payload)
+                    n = (len(payload) - _TS.size) // 8
+                    timestamps.append(ts)
+                    rows.append(struct.unpack_from(f"<{n}d", payload, _TS.size))
+                end = next_offset
+                if len(rows) >= max_rows:
+                    break
+            if not rows:
+                return None
+            return Batch(agent, self.acked, end, columns, timestamps, rows)
+
+    def ack(self, offset: int, columns: List[str]) -> None:
+        with self._lock:
+            self.acked, self.acked_columns = offset, columns
+            tmp = f"{self._ack_path}.tmp"
+            with open(tmp, "w") as f:
+                json.dump({"offset": offset, "columns": columns}, f)
+            os.replace(tmp, self._ack_path)
+            segments = self._segments()
+            for base, next_base in zip(segments, segments[1:]):
+                if next_base <= offset:
+                    os.remove(self._segment_path(base))
+
+    def reject(self, batch: Batch, data: bytes) -> str:
+        """Moves a batch the server refused aside, into rejected/, and
+        acknowledges it. Returns where it went."""
+        rejected = os.path.join(self.path, "rejected")
+        os.makedirs(rejected, exist_ok=True)
+        path = os.path.join(
+            rejected, f"{batch.first_offset:016d}-{batch.end_offset:016d}.batch"
+        )
+        with open(path, "wb") as f:
+            f.write(data)
+        self.ack(batch.end_offset, batch.columns)
+        return path
+
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+class Shipper(object):
+    """Ships the per-minute rows to a central collector (flowd-server).
+
+    `append()` only writes the row to the spool, a background thread sends
+    what's unacknowledged every SHIP_SEC as compressed batches, and moves the
+    acknowledged offset once the server confirmed them. Offline periods just
+    leave more in the spool, and a restart resumes at the acknowledged offset.
+    The server drops rows it has seen, so resending after a lost ack is safe.
+    Errors are retried with a backoff, except a batch the server refuses as
+    bad (REJECTED_STATUSES), which is set aside, see Spool.reject().
+    Uploads stay under `bandwidth` bytes per second on average.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        agent: Optional[str] = None,
+        spool: Optional[Spool] = None,
+        bandwidth: Optional[float] = None,
+        interval: float = SHIP_SEC,
+    ) -> None:
+        self.url = url
+        self.agent = agent or default_agent_id()
+        self.spool = spool or Spool()
+        if bandwidth is None:
+            bandwidth = float(os.environ.get("FLOWD_SHIP_BANDWIDTH", DEFAULT_BANDWIDTH))
+        self.bucket = TokenBucket(bandwidth, burst=bandwidth * interval)
+        self.interval = interval
+        self._session = requests.Session()
+        self._quit = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.sent_bytes = 0
+
+    def append(self, ts: float, columns: Sequence[str], values: Sequence[float]) -> None:
+        self.spool.append(ts, columns, values)
+
+    def ship(self) -> bool:
+        """Sends one batch, True if there may be more to send."""
+        batch = self.spool.read(self.agent)
+        if batch is None:
+            return False
+        body = encode_batch(batch)
+        wait = self.bucket.take(len(body))
+        if wait and self._quit.wait(wait):
+            return False
+        rv = self._session.post(
+            self.url, data=body, headers={"Content-Type": CONTENT_TYPE}, timeout=30
+        )
+        if rv.status_code in REJECTED_STATUSES:
+            path = self.spool.reject(batch, body)
+            logging.error(
+                f"{self.url} refused {len(batch.rows)} rows with HTTP {rv.status_code}"
+                f" ({rv.text[:200]}), moved them to {path}"
+            )
+            return True
+        rv.raise_for_status()
+        acked = int(rv.json()["acked"])
+        if acked < batch.end_offset:
+            raise ValueError(
+                f"the server acknowledged up to {acked}, sent up to {batch.end_offset}"
+            )
+        self.sent_bytes += len(body)
+        self.spool.ack(batch.end_offset, batch.columns)
+        logging.debug(f"shipped {len(batch.rows)} rows in {len(body)} bytes")
+        return True
+
+    def _run(self) -> None:
+        failures = 0
+        while not self._quit.wait(self._delay(failures)):
+            try:
+                while self.ship() and not self._quit.is_set():
+                    pass
+                failures = 0
+            except (requests.RequestException, ValueError, KeyError) as e:
+                failures += 1
+                delay = self._delay(failures)
+                logging.warning(
+                    f"shipping to {self.url} failed, retrying in {delay:.0f}s: {e}"
+                )
+
+    def _delay(self, failures: int) -> float:
+        if not failures:
+            return self.interval
+        return min(self.interval * 2.0 ** (failures - 1), MAX_BACKOFF_SEC)
+
+    def start(self) -> None:
+        self._quit.clear()
+        self._thread = threading.Thread(target=self._run, name="Shipper", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._quit.set()
+        if self._thread is not None:
+            self._thread.join(5)
+        self.spool.close()
@@ -1,3 +1,4 @@
+import collections
 import datetime
 import importlib
 import logging
@@ -6,14 +7,23 @@ import os
 import threading
 from pathlib import Path
 from types import ModuleType
+from typing import Deque
 from typing import List
 from typing import Optional
+import numpy as np
 from flowd.model import logistic_regression
-from flowd.utils import wnf
+from flowd.model.features import wall_seconds
+from flowd.focus import FocusController
+from flowd import isolation
+from flowd.presence import PresenceMonitor
+from flowd.shipper import Shipper
 
 import pythoncom
 
 from flowd import metrics
+from flowd.utils import telemetry
+from flowd.utils.profiler import SamplingProfiler
+from flowd.utils.profiler import record_native_id
 
 MetricModules = List[ModuleType]
 Collectors = List[metrics.BaseCollector]
@@ -34,8 +44,20 @@ class Supervisor:
         self._data_pivot: Optional[str] = None
         self.model = logistic_regression.train_model()
         self.flow_threshold = 70
+        self.focus = FocusController(
+            enter_threshold=self.flow_threshold + 5,
+            exit_threshold=self.flow_threshold - 5,
+        )
         self._fs_data: Optional[str] = None
-        self._flow_state = 0
+        self._flow_state: float = 0
+        # the model's features, updated a minute at a time
+        self.features = logistic_regression.feature_pipeline()
+        self._recent_features: Deque[np.ndarray] = collections.deque(maxlen=15)
+        self._features_lock = threading.Lock()
+        self.presence = PresenceMonitor()
+        self.profiler = SamplingProfiler()
+        # set to ship the per-minute rows to a flowd-server
+        self.shipper: Optional[Shipper] = None
 
     @staticmethod
     def _sort_collectors(element):
@@ -52,6 +74,7 @@ class Supervisor:
         self._collectors = lookup_handlers(collect_metric_modules())
         self._collectors.sort(key=self._sort_collectors)
         self.write_headers()
+        self._recent_features.extend(logistic_regression.warm_up(self.features))
 
     def write_headers(self) -> None:
         if not os.path.exists(self._data_pivot) or os.path.getsize(self._data_pivot) == 0:
@@ -77,25 +100,59 @@ class Supervisor:
         self._active = [CollectorThread(c) for c in self._collectors]
         for t in self._active:
             t.start()
+        self.presence.subscribe(self._on_presence)
+        self.presence.start()
+        if self.shipper:
+            self.shipper.start()
 
         while not self._quit.is_set():
             time.sleep(self.collect_interval)
-            threading.Thread(target=self.output_collected_metrics).start()
-            self._flow_state = self.check_flow_state()
-            wnf.set_focus_mode(2 if self._flow_state > self.flow_threshold else 0)
+            # a bad minute (a full disk, a broken spool) mustn't stop the daemon
+            try:
+                # the prediction needs this minute's features
+                self.output_collected_metrics()
+            except Exception as e:
+                logging.error(f"could not output the metrics: {e}", exc_info=True)
+            try:
+                predicted_at = time.monotonic()
+                with telemetry.TASK_SECONDS.labels('check_flow_state').time():
+                    self._flow_state = self.check_flow_state()
+                self.focus.update(self._flow_state, predicted_at)
+            except Exception as e:
+                logging.error(f"could not check the flow state: {e}", exc_info=True)
+
+    def _on_presence(self, previous: metrics.Presence, state: metrics.Presence) -> None:
+        for t in self._active:
+            t.react(state)
 
     def check_flow_state(self) -> float:
-        p = logistic_regression.predict(logistic_regression.pivot_stats(), self.model, 15) * 100
+        with self._features_lock:
+            recent = list(self._recent_features)
+        if not recent:
+            return 0
+        with telemetry.INFERENCE_SECONDS.labels('flow_state').time():
+            p = float(logistic_regression.predict_features(recent, self.model)) * 100
         logging.info(f'Last 15 minutes prediction {p}%')
         return p
 
     def stop(self, timeout: float = None) -> None:
         self._quit.set()
+        self.presence.stop()
+        if self.shipper:
+            self.shipper.stop()
         for c in self._active:
             c._collector.stop_collect()
+            # let paused collectors see they're stopped
+            c._collector.react(metrics.Reaction.CONTINUE)
             c.join(timeout)
+            if isinstance(c._collector, isolation.IsolatedCollector) and not c.is_alive():
+                c._collector.close()
 
     def output_collected_metrics(self) -> None:
+        with telemetry.TASK_SECONDS.labels('output_collected_metrics').time():
+            self._output_collected_metrics()
+
+    def _output_collected_metrics(self) -> None:
         if not self._data:
             logging.warning("unknown data file path; did you call configure()?")
             return
@@ -104,15 +161,30 @@ class Supervisor:
         with open(self._data, "a") as f:
             with open(self._data_pivot, "a") as f1:
                 row = ""
+                names, values = [], []
                 for ct in self._active:
                     name, current = ct.pop()
                     if not ct.is_alive():
                         current = -1
                     f.write(f"{name},{current},{ts}\n")
                     row = f"{row},{current}"
+                    names.append(name)
+                    values.append(current)
                 f1.write(f"{ts}{row}\n")
+        latest = dict(zip(names, values))
+        row_values = [latest.get(m, 0) for m in self.features.metrics]
+        features = self.features.update(wall_seconds(ts), row_values)
+        with self._features_lock:
+            self._recent_features.append(features)
+        if self.shipper:
+            self.shipper.append(
+                ts.timestamp(),
+                names + ["Flow State Prediction (%)"],
+                values + [self._flow_state],
+            )
         with open(self._fs_data, "a") as fs:
             fs.write(f"{ts},{self._flow_state}\n")
+        logging.debug(f"usage per presence state: {self.presence.usage.report()}")
 
 
 class CollectorThread(threading.Thread):
@@ -125,6 +197,7 @@ class CollectorThread(threading.Thread):
         )
 
     def run(self) -> None:
+        record_native_id()
         pythoncom.CoInitialize()
         try:
             self._collector.start_collect()
@@ -135,6 +208,17 @@ class CollectorThread(threading.Thread):
             pythoncom.CoUninitialize()
             self._collector.stop_collect()
 
+    def react(self, presence: metrics.Presence) -> None:
+        policy = self._collector.presence_policy
+        reaction = policy.get(presence, metrics.Reaction.CONTINUE)
+        if reaction is self._collector.reaction:
+            return
+        logging.debug(f"{self.name}: {reaction.value} while {presence.value}")
+        try:
+            self._collector.react(reaction)
+        except Exception as e:
+            logging.error(f"{self.name} failed to {reaction.value}: {e}", exc_info=True)
+
     def pop(self) -> metrics.CollectedData:
         v = self._collector.get_current_state()
         self._collector.cleanup()
@@ -170,13 +254,16 @@ def collect_metric_modules() -> MetricModules:
 
 def lookup_handlers(mods: MetricModules) -> Collectors:
     """Gets a list of handlers from list of metric modules."""
-    collectors = []
+    collectors: Collectors = []
 
     for m in mods:
         for v in m.__dict__.values():
             try:
                 if v and issubclass(v, metrics.BaseCollector):
-                    collectors.append(v())
+                    if isolation.should_isolate(v):
+                        collectors.append(isolation.IsolatedCollector(v))
+                    else:
+                        collectors.append(v())
                     logging.info(
                         f"found a metric collector {m.__name__}:{v.metric_name}"
                     )
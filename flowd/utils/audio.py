@@ -0,0 +1,295 @@
+import contextlib
+import threading
+import time
+import wave
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+
+
+class FrameRingBuffer(object):
+    """Preallocated ring of fixed-size audio frames shared by the capture
+    callback and the VAD.
+
+    Frames are copied into one bytearray as they are captured, readers get
+    `memoryview` slices of it that are created once up front, so the capture
+    path doesn't allocate. The writer never blocks and never touches the
+    `reserve` frames the reader has handed out most recently, so those stay
+    valid while the VAD keeps them around for padding. When the reader falls
+    behind, new frames are dropped and counted as overruns.
+    """
+
+    def __init__(self, capacity: int, frame_size: int, reserve: int = 0) -> None:
+        assert reserve < capacity
+        self.capacity = capacity
+        self.frame_size = frame_size
+        self.reserve = reserve
+        self._data = bytearray(capacity * frame_size)
+        view = memoryview(self._data)
+        self._slots = [view[i * frame_size:(i + 1) * frame_size] for i in range(capacity)]
+        self._read = 0
+        self._write = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self.overruns = 0
+
+    def put(self, chunk: bytes) -> None:
+        with self._cond:
+            if self._write - self._read + self.reserve >= self.capacity:
+                self.overruns += 1
+                return
+            self._slots[self._write % self.capacity][:] = chunk
+            self._write += 1
+            self._cond.notify()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[memoryview]:
+        """Returns the oldest frame, or None once the buffer is closed and drained."""
+        with self._cond:
+            while self._read == self._write and not self._closed:
+                self._cond.wait(timeout)
+            if self._read == self._write:
+                return None
+            frame = self._slots[self._read % self.capacity]
+            self._read += 1
+            return frame
+
+    def close(self) -> None:
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def reopen(self) -> None:
+        with self._cond:
+            self._read = self._write = 0
+            self._closed = False
+
+    def __len__(self) -> int:
+        return self._write - self._read
+
+    def __iter__(self) -> Iterator[memoryview]:
+        while True:
+            frame = self.get()
+            if frame is None:
+                return
+            yield frame
+
+
+class PyAudioSource(object):
+    """Microphone input, captured in PyAudio callback mode into a FrameRingBuffer."""
+
+    def __init__(self, rate, chunk_size):
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self._pa = None
+        self._stream = None
+        self._ring_buffer = None
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        import pyaudio
+
+        if status & pyaudio.paInputOverflow:
+            # PortAudio lost input before we got to see it
+            self._ring_buffer.overruns += 1
+        self._ring_buffer.put(in_data)
+        return None, pyaudio.paContinue
+
+    def start(self, ring_buffer) -> None:
+        import pyaudio
+
+        self._ring_buffer = ring_buffer
+        self._pa = pyaudio.PyAudio()
+        self._stream = self._pa.open(format=pyaudio.paInt16,
+                                     channels=1,
+                                     rate=self.rate,
+                                     input=True,
+                                     frames_per_buffer=self.chunk_size,
+                                     stream_callback=self._callback)
+
+    def pause(self) -> None:
+        if self._stream is not None:
+            self._stream.stop_stream()
+
+    def resume(self) -> None:
+        if self._stream is not None and self._stream.is_stopped():
+            self._stream.start_stream()
+
+    def stop(self) -> None:
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        if self._pa is not None:
+            self._pa.terminate()
+            self._pa = None
+        if self._ring_buffer is not None:
+            self._ring_buffer.close()
+
+
+class WavFileSource(object):
+    """Plays a mono 16-bit .wav file into a FrameRingBuffer, a drop-in
+    replacement for PyAudioSource where there's no microphone (e.g. tests).
+    With realtime=False frames are delivered as fast as the reader takes them.
+    """
+
+    def __init__(self, path: str, chunk_size: int, realtime: bool = True) -> None:
+        self.path = path
+        self.chunk_size = chunk_size
+        self.realtime = realtime
+        self._quit = threading.Event()
+        self._playing = threading.Event()
+        self._playing.set()
+        self._thread = None
+
+    def _play(self, ring_buffer) -> None:
+        with contextlib.closing(wave.open(self.path, 'rb')) as wf:
+            assert wf.getnchannels() == 1, 'only mono audio is supported'
+            assert wf.getsampwidth() == 2, 'only 16-bit PCM audio is supported'
+            chunk_duration = self.chunk_size / wf.getframerate()
+            next_at = time.monotonic()
+            while not self._quit.is_set():
+                if not self._playing.is_set():
+                    self._playing.wait()
+                    next_at = time.monotonic()
+                chunk = wf.readframes(self.chunk_size)
+                if len(chunk) < self.chunk_size * 2:
+                    break
+                if self.realtime:
+                    next_at += chunk_duration
+                    self._quit.wait(max(0.0, next_at - time.monotonic()))
+                else:
+                    while len(ring_buffer) + ring_buffer.reserve >= ring_buffer.capacity \
+                            and not self._quit.is_set():
+                        time.sleep(0.001)
+                ring_buffer.put(chunk)
+        ring_buffer.close()
+
+    def start(self, ring_buffer) -> None:
+        self._quit.clear()
+        self._thread = threading.Thread(target=self._play, args=(ring_buffer,),
+                                        name='VAD-wav-source', daemon=True)
+        self._thread.start()
+
+    def pause(self) -> None:
+        self._playing.clear()
+
+    def resume(self) -> None:
+        self._playing.set()
+
+    def stop(self) -> None:
+        self._quit.set()
+        self._playing.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+class InferenceStats(object):
+    """Counters describing how well the inference stage keeps up with capture."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.segments = 0
+        self.degraded_segments = 0
+        self.dropped_segments = 0
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self.total_latency = 0.0
+
+    def observe_latency(self, started_at) -> None:
+        latency = time.perf_counter() - started_at
+        with self._lock:
+            self.segments += 1
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self.total_latency += latency
+
+    @property
+    def mean_latency(self) -> float:
+        return self.total_latency / self.segments if self.segments else 0.0
+
+
+class EnergyGate(object):
+    """Cheap first VAD stage that lets through only frames louder than the noise floor.
+
+    Frames are processed in blocks: RMS energy and zero-crossing rate are
+    computed for the whole block at once. The noise floor follows the quietest
+    frame of each block, dropping fast and rising slowly (even slower while the
+    whole block is above the gate threshold). A frame passes when
+    it is `ratio` times above the floor, or somewhat above it with a high
+    zero-crossing rate (fricatives). The gate stays open for `hangover` frames
+    after the last passing frame, and opens `preroll` frames early within a
+    block, so speech onsets and tails aren't clipped.
+    """
+
+    def __init__(self, frame_size: int, block_frames: int = 10, ratio: float = 3.0,
+                 zcr_threshold: float = 0.25, min_rms: float = 100.0, hangover: int = 8,
+                 preroll: int = 3, rise: float = 0.02, fall: float = 0.5) -> None:
+        self.frame_samples = frame_size // 2
+        self.block_frames = block_frames
+        self.ratio = ratio
+        self.zcr_threshold = zcr_threshold
+        self.min_rms = min_rms
+        self.hangover = hangover
+        self.preroll = preroll
+        self.rise = rise
+        self.fall = fall
+
+        self.floor = None
+        self.frames = 0
+        self.passed = 0
+        self._block = np.zeros((block_frames, self.frame_samples), dtype=np.int16)
+        self._index = np.arange(block_frames)
+        self._since_active = hangover + 1
+
+    def _decide(self, block):
+        x = block.astype(np.float32)
+        rms = np.sqrt(np.mean(x * x, axis=1))
+        zcr = np.count_nonzero(np.diff(np.signbit(block), axis=1), axis=1) / self.frame_samples
+
+        if self.floor is None:
+            self.floor = max(float(rms.min()), 1.0)
+        floor = max(self.floor, self.min_rms / self.ratio)
+        active = (rms > floor * self.ratio) | ((rms > floor * np.sqrt(self.ratio)) & (zcr > self.zcr_threshold))
+
+        # distance to the closest active frame before (including the previous
+        # blocks) and after (within this block) each frame
+        n = len(block)
+        index = self._index[:n]
+        last = np.maximum.accumulate(np.where(active, index, -self._since_active - 1))
+        following = np.minimum.accumulate(np.where(active, index, n + self.preroll + 1)[::-1])[::-1]
+        passed = (index - last <= self.hangover) | (following - index <= self.preroll)
+        self._since_active = n - 1 - last[-1]
+
+        quietest = float(rms.min())
+        if quietest < self.floor:
+            rate = self.fall
+        elif quietest < floor * self.ratio:
+            rate = self.rise
+        else:
+            # the whole block is loud, most likely speech: creep up much slower so
+            # that long talks don't close the gate, but a new noise source still does
+            rate = self.rise / 10
+        self.floor = max(self.floor + rate * (quietest - self.floor), 1.0)
+
+        self.frames += n
+        self.passed += int(np.count_nonzero(passed))
+        return passed
+
+    def filter(self, frames: Iterable[bytes]) -> Iterator[Tuple[bytes, bool]]:
+        """Yields (frame, passed) for every frame, a block at a time."""
+        pending = []
+        for frame in frames:
+            self._block[len(pending)] = np.frombuffer(frame, dtype=np.int16)
+            pending.append(frame)
+            if len(pending) == self.block_frames:
+                yield from zip(pending, self._decide(self._block).tolist())
+                pending = []
+        if pending:
+            yield from zip(pending, self._decide(self._block[:len(pending)]).tolist())
+
+    @property
+    def pass_rate(self) -> float:
+        return self.passed / self.frames if self.frames else 0.0
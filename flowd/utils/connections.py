@@ -0,0 +1,132 @@
+import logging
+import os
+import socket
+import struct
+import time
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Set
+from typing import Tuple
+
+Address = Tuple[str, int]
+
+PROC_NET_TCP = ('/proc/net/tcp', '/proc/net/tcp6')
+TCP_ESTABLISHED = '01'
+
+
+class Connection(NamedTuple):
+    local: Address
+    remote: Address
+
+
+class ConnectionEvent(NamedTuple):
+    opened: bool  # False when the connection was closed
+    connection: Connection
+    timestamp: float
+
+
+def _parse_address(value) -> Address:
+    """Parses "0100007F:0016" style addresses: the IP is a sequence of host
+    byte order 32-bit words, the port is plain hex."""
+    host, port = value.split(':')
+    words = bytes.fromhex(host)
+    raw = b''.join(struct.pack('>I', w) for w in struct.unpack('<%dI' % (len(words) // 4), words))
+    family = socket.AF_INET if len(raw) == 4 else socket.AF_INET6
+    return socket.inet_ntop(family, raw), int(port, 16)
+
+
+def read_proc_net_tcp(paths=PROC_NET_TCP) -> Set[Connection]:
+    """Established TCP connections, straight from the kernel tables on Linux."""
+    connections = set()
+    for path in paths:
+        try:
+            with open(path) as f:
+                next(f)  # header
+                for line in f:
+                    fields = line.split()
+                    if fields[3] != TCP_ESTABLISHED:
+                        continue
+                    connections.add(Connection(_parse_address(fields[1]), _parse_address(fields[2])))
+        except FileNotFoundError:
+            continue
+    return connections
+
+
+def read_psutil() -> Set[Connection]:
+    """Established TCP connections, for platforms without /proc."""
+    import psutil
+
+    return {Connection(tuple(c.laddr), tuple(c.raddr))
+            for c in psutil.net_connections(kind='tcp')
+            if c.raddr and c.status == psutil.CONN_ESTABLISHED}
+
+
+def default_source() -> Callable[[], Set[Connection]]:
+    return read_proc_net_tcp if os.path.exists(PROC_NET_TCP[0]) else read_psutil
+
+
+class ConnectionTracker(object):
+    """Tracks TCP connections to a set of remote ports between snapshots.
+
+    Every poll() diffs the new snapshot against the previous one and turns
+    the difference into open/close events. Per remote host it keeps how long
+    at least one connection to it was open, and the same for any host at all.
+    """
+
+    def __init__(self, ports: Iterable[int], source=None, clock=time.time) -> None:
+        self.ports = frozenset(ports)
+        self.source = source or default_source()
+        self.clock = clock
+        self._open: Set[Connection] = set()
+        self._per_host: Dict[str, int] = {}  # open connections per remote host
+        self._host_since: Dict[str, float] = {}
+        self._host_total: Dict[str, float] = {}
+        self._active_since = None
+        self._active_total = 0.0
+
+    def poll(self) -> List[ConnectionEvent]:
+        now = self.clock()
+        snapshot = {c for c in self.source() if c.remote[1] in self.ports}
+        events = [ConnectionEvent(False, c, now) for c in self._open - snapshot]
+        events += [ConnectionEvent(True, c, now) for c in snapshot - self._open]
+        self._open = snapshot
+
+        for e in events:
+            host = e.connection.remote[0]
+            logging.debug(f'{"opened" if e.opened else "closed"} connection to {host}:{e.connection.remote[1]}')
+            count = self._per_host.get(host, 0) + (1 if e.opened else -1)
+            if count == 0:
+                del self._per_host[host]
+                self._host_total[host] = self._host_total.get(host, 0.0) + now - self._host_since.pop(host)
+            else:
+                self._per_host[host] = count
+                self._host_since.setdefault(host, now)
+
+        if self._open and self._active_since is None:
+            self._active_since = now
+        elif not self._open and self._active_since is not None:
+            self._active_total += now - self._active_since
+            self._active_since = None
+        return events
+
+    @property
+    def active(self) -> bool:
+        return bool(self._open)
+
+    def active_seconds(self) -> float:
+        """Seconds during which at least one tracked connection was open."""
+        total = self._active_total
+        if self._active_since is not None:
+            total += self.clock() - self._active_since
+        return total
+
+    def session_seconds(self) -> Dict[str, float]:
+        """Seconds during which at least one connection was open, per remote host."""
+        now = self.clock()
+        sessions = dict(self._host_total)
+        for host, since in self._host_since.items():
+            sessions[host] = sessions.get(host, 0.0) + now - since
+        return sessions
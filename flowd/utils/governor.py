@@ -0,0 +1,140 @@
+import enum
+import logging
+import sys
+import threading
+import time
+
+import psutil
+
+
+def _windows_thread_time():
+    """CPU time of the calling thread, what time.thread_time() does on Windows."""
+    import ctypes
+    from ctypes import wintypes
+
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.GetCurrentThread.restype = wintypes.HANDLE
+    kernel32.GetThreadTimes.argtypes = [wintypes.HANDLE] + [ctypes.POINTER(wintypes.FILETIME)] * 4
+    kernel32.GetThreadTimes.restype = wintypes.BOOL
+
+    def thread_time():
+        creation, exit_, kernel, user = (wintypes.FILETIME() for _ in range(4))
+        if not kernel32.GetThreadTimes(kernel32.GetCurrentThread(), ctypes.byref(creation),
+                                       ctypes.byref(exit_), ctypes.byref(kernel), ctypes.byref(user)):
+            raise ctypes.WinError(ctypes.get_last_error())
+        ticks = sum(t.dwHighDateTime << 32 | t.dwLowDateTime for t in (kernel, user))
+        return ticks * 1e-7  # 100 ns units
+    return thread_time
+
+
+# time.thread_time() is 3.7+, on 3.6 Windows is asked for the thread's times directly
+# and anywhere else the whole process gets charged
+if hasattr(time, 'thread_time'):
+    thread_time = time.thread_time
+elif sys.platform == 'win32':
+    thread_time = _windows_thread_time()
+else:
+    thread_time = time.process_time
+
+
+class Tier(enum.IntEnum):
+    """How much compute the VAD collector may spend, cheapest first."""
+    ENERGY = 0  # frame energy gate only
+    WEBRTCVAD = 1  # webrtcvad segment durations
+    PYANNOTE_SHORT = 2  # pyannote on short segments, webrtcvad on the rest
+    PYANNOTE_ALL = 3  # pyannote on every segment
+
+
+class ComputeGovernor(object):
+    """Picks a compute tier from smoothed system load and the collector's own CPU use.
+
+    System load is sampled on its own cadence and smoothed with an EWMA.
+    A tier is left as soon as the load goes above its limit, but is only
+    re-entered once the load drops `hysteresis` points below it, and the
+    governor moves at most one tier per sample. On top of that the collector
+    reports the CPU time it spends through `charge()`; while it is over
+    `cpu_budget` (fraction of one core) the governor keeps stepping down.
+    """
+
+    # highest smoothed system load (%) at which a tier may run
+    LOAD_LIMITS = {
+        Tier.PYANNOTE_ALL: 40.0,
+        Tier.PYANNOTE_SHORT: 60.0,
+        Tier.WEBRTCVAD: 85.0,
+        Tier.ENERGY: 100.0,
+    }
+
+    def __init__(self, cpu_budget=0.25, interval=2.0, alpha=0.3, hysteresis=10.0):
+        self.cpu_budget = cpu_budget
+        self.interval = interval
+        self.alpha = alpha
+        self.hysteresis = hysteresis
+
+        self.tier = Tier.PYANNOTE_ALL
+        self.load = 0.0  # smoothed system load, %
+        self.usage = 0.0  # smoothed own CPU use, fraction of a core
+        self.time_in_tier = {t: 0.0 for t in Tier}
+
+        self._lock = threading.Lock()
+        self._charged = 0.0
+        self._last_sample = time.monotonic()
+        self._quit = threading.Event()
+        self._thread = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            if not self._quit.is_set():
+                return
+            self._thread.join()  # stopped, but didn't notice yet
+        self._quit.clear()
+        self._last_sample = time.monotonic()
+        # the first call only sets psutil's reference point
+        psutil.cpu_percent(interval=None)
+        self._thread = threading.Thread(target=self._run, name='VAD-governor', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._quit.set()
+
+    def charge(self, cpu_seconds) -> None:
+        """Accounts CPU time spent by the collector."""
+        with self._lock:
+            self._charged += cpu_seconds
+
+    def _run(self) -> None:
+        while not self._quit.wait(self.interval):
+            self.sample(psutil.cpu_percent(interval=None))
+
+    def sample(self, system_load) -> Tier:
+        now = time.monotonic()
+        elapsed = max(now - self._last_sample, 1e-6)
+        self._last_sample = now
+        with self._lock:
+            charged, self._charged = self._charged, 0.0
+
+        self.time_in_tier[self.tier] += elapsed
+        self.load += self.alpha * (system_load - self.load)
+        self.usage += self.alpha * (charged / elapsed - self.usage)
+
+        tier = self._next_tier()
+        if tier != self.tier:
+            logging.info(f'VAD compute tier {self.tier.name} -> {tier.name} '
+                         f'(load {self.load:.0f}%, own CPU {self.usage:.0%} of a core)')
+            self.tier = tier
+        return self.tier
+
+    def _next_tier(self) -> Tier:
+        over_budget = self.usage > self.cpu_budget
+        if self.tier > Tier.ENERGY and (over_budget or self.load > self.LOAD_LIMITS[self.tier]):
+            return Tier(self.tier - 1)
+
+        if self.tier < Tier.PYANNOTE_ALL:
+            upper = Tier(self.tier + 1)
+            within_budget = self.usage < self.cpu_budget * (1 - self.hysteresis / 100)
+            if within_budget and self.load < self.LOAD_LIMITS[upper] - self.hysteresis:
+                return upper
+        return self.tier
+
+    def report(self) -> str:
+        spent = ', '.join(f'{t.name} {s:.0f}s' for t, s in self.time_in_tier.items())
+        return f'tier {self.tier.name}, time in tiers: {spent}'
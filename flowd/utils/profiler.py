@@ -0,0 +1,239 @@
+import collections
+import ctypes
+import datetime
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Callable
+from typing import Dict
+from typing import Optional
+
+from flowd.utils.governor import thread_time
+
+PROFILE_DIR = os.path.expanduser("~/flowd/profiles")
+COLLECTOR_THREAD_PREFIX = "CollectorThread-"
+
+ThreadClock = Callable[[], float]
+
+# OS thread ids by thread ident, see record_native_id()
+_native_ids: Dict[int, int] = {}
+
+
+def current_native_id() -> Optional[int]:
+    """The OS id of the calling thread, None where there's no way to tell."""
+    get_native_id = getattr(threading, "get_native_id", None)
+    if get_native_id is not None:
+        return int(get_native_id())
+    if sys.platform == "win32":
+        return int(ctypes.windll.kernel32.GetCurrentThreadId())
+    return None
+
+
+def record_native_id() -> None:
+    """Remembers the OS id of the calling thread, so that the profiler finds its
+    CPU clock where Thread.native_id doesn't exist yet (before Python 3.8).
+    Threads doing the work of collectors call this first thing."""
+    native_id = current_native_id()
+    if native_id is not None:
+        _native_ids[threading.get_ident()] = native_id
+
+
+def _windows_thread_clock(native_id: int) -> Optional[ThreadClock]:
+    """User + kernel time of a thread from GetThreadTimes."""
+    from ctypes import wintypes
+
+    kernel32 = ctypes.windll.kernel32  # type: ignore
+    THREAD_QUERY_LIMITED_INFORMATION = 0x0800
+    handle = kernel32.OpenThread(THREAD_QUERY_LIMITED_INFORMATION, False, native_id)
+    if not handle:
+        return None
+    times = [wintypes.FILETIME() for _ in range(4)]
+
+    def clock() -> float:
+        if not kernel32.GetThreadTimes(handle, *(ctypes.byref(t) for t in times)):
+            raise OSError("GetThreadTimes failed")
+        # FILETIMEs count 100 ns intervals
+        return sum((t.dwHighDateTime << 32 | t.dwLowDateTime) for t in times[2:]) / 1e7
+
+    clock.close = lambda: kernel32.CloseHandle(handle)  # type: ignore
+    return clock
+
+
+def thread_cpu_clock(thread: threading.Thread) -> Optional[ThreadClock]:
+    """A function returning the CPU time the thread has used so far, None where
+    the platform doesn't tell."""
+    ident = thread.ident
+    if ident is None:
+        return None
+    try:
+        if hasattr(time, "pthread_getcpuclockid"):
+            clock_id = time.pthread_getcpuclockid(ident)
+            return lambda: time.clock_gettime(clock_id)
+        if sys.platform == "win32":
+            # for threads that didn't record their id: CPython's thread ident is
+            # GetCurrentThreadId() on Windows
+            native_id = getattr(thread, "native_id", None) or _native_ids.get(ident, ident)
+            return _windows_thread_clock(native_id)
+    except OSError:
+        pass
+    return None
+
+
+class SamplingProfiler(object):
+    """Samples the stacks of all threads for a bounded window.
+
+    Every sample is weighted by the CPU time its thread used since the previous
+    sample, so sleeping collectors cost nothing in the profile. Without per-thread
+    CPU clocks samples are weighted by wall time instead. Time is attributed to
+    collectors by CollectorThread name, and to the collector whose method is on
+    the stack for hook callbacks and helper threads (VAD inference etc.).
+
+    The result is a collapsed stack file (weights in microseconds), which
+    flamegraph.pl and speedscope read, and a per-collector CPU summary.
+    """
+
+    def __init__(self, interval: float = 0.01, output_dir: str = PROFILE_DIR) -> None:
+        self.interval = interval
+        self.output_dir = output_dir
+        self._lock = threading.Lock()
+        self._quit = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.stacks: Dict[str, float] = collections.Counter()
+        self.collectors: Dict[str, float] = collections.Counter()
+        self.cpu_weighted = True
+        self.duration = 0.0
+        self.last_output: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: float = 30.0) -> bool:
+        """Profiles for `duration` seconds in the background, False if already running."""
+        with self._lock:
+            if self.running:
+                return False
+            self._quit.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(duration,), name="Profiler", daemon=True
+            )
+            self._thread.start()
+        logging.info(f"profiling for {duration:.0f}s")
+        return True
+
+    def stop(self) -> None:
+        """Ends the profile early, it's written out as usual."""
+        self._quit.set()
+
+    def join(self, timeout: Optional[float] = None) -> Optional[str]:
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.last_output
+
+    @staticmethod
+    def _collector_of(frame, thread_name) -> str:
+        if thread_name.startswith(COLLECTOR_THREAD_PREFIX):
+            return thread_name[len(COLLECTOR_THREAD_PREFIX):]
+        from flowd.metrics import BaseCollector
+
+        outermost = None
+        while frame is not None:
+            code = frame.f_code
+            if code.co_argcount and code.co_varnames[0] == "self":
+                owner = frame.f_locals.get("self")
+                if isinstance(owner, BaseCollector):
+                    outermost = owner
+            frame = frame.f_back
+        if outermost is None:
+            return thread_name
+        return f"{outermost.metric_name} ({thread_name})"
+
+    @staticmethod
+    def _collapse(frame, thread_name) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            names.append(f"{module}.{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        names.append(thread_name.replace(";", ":"))
+        return ";".join(reversed(names)).replace(" ", "_")
+
+    def _run(self, duration: float) -> None:
+        me = threading.get_ident()
+        clocks: Dict[int, Optional[ThreadClock]] = {}
+        last_cpu: Dict[int, float] = {}
+        self.stacks = collections.Counter()
+        self.collectors = collections.Counter()
+        self.cpu_weighted = True
+        started = time.monotonic()
+        last = started
+        overhead = thread_time()
+        try:
+            while not self._quit.wait(self.interval):
+                now = time.monotonic()
+                threads = {t.ident: t for t in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    thread = threads.get(ident)
+                    if ident == me or thread is None:
+                        continue
+                    if ident not in clocks:
+                        clocks[ident] = thread_cpu_clock(thread)
+                    weight = now - last
+                    clock = clocks[ident]
+                    if clock is not None:
+                        try:
+                            cpu = clock()
+                        except OSError:
+                            continue
+                        weight = cpu - last_cpu.get(ident, cpu)
+                        last_cpu[ident] = cpu
+                    else:
+                        self.cpu_weighted = False
+                    if weight <= 0:
+                        continue
+                    self.stacks[self._collapse(frame, thread.name)] += weight
+                    self.collectors[self._collector_of(frame, thread.name)] += weight
+                last = now
+                if now - started >= duration:
+                    break
+        finally:
+            for clock in clocks.values():
+                if clock is not None and hasattr(clock, "close"):
+                    clock.close()  # type: ignore
+            self.duration = time.monotonic() - started
+            overhead = thread_time() - overhead
+            self.collectors["profiler (sampling overhead)"] += overhead
+            try:
+                self.last_output = self.write()
+            except OSError as e:
+                logging.error(f"Could not write the profile: {e}")
+
+    def summary(self) -> str:
+        kind = "CPU" if self.cpu_weighted else "wall time (no per-thread CPU clocks)"
+        total = sum(self.collectors.values())
+        lines = [f"{kind} over {self.duration:.1f}s, {total:.3f}s total"]
+        for name, seconds in sorted(self.collectors.items(), key=lambda kv: -kv[1]):
+            share = seconds / max(self.duration, 1e-9)
+            lines.append(f"{seconds:10.3f}s {share:8.2%} of a core  {name}")
+        return "\n".join(lines)
+
+    def write(self) -> str:
+        """Writes <output_dir>/flowd-<timestamp>.collapsed and .summary.txt,
+        returns the path of the former."""
+        os.makedirs(self.output_dir, exist_ok=True)
+        stem = os.path.join(
+            self.output_dir, datetime.datetime.now().strftime("flowd-%Y%m%d-%H%M%S")
+        )
+        with open(f"{stem}.collapsed", "w") as f:
+            for stack, seconds in sorted(self.stacks.items()):
+                weight = int(round(seconds * 1e6))
+                if weight:
+                    f.write(f"{stack} {weight}\n")
+        summary = self.summary()
+        with open(f"{stem}.summary.txt", "w") as f:
+            f.write(summary + "\n")
+        logging.info(f"profile written to {stem}.collapsed\n{summary}")
+        return f"{stem}.collapsed"
@@ -0,0 +1,358 @@
+import abc
+import bisect
+import functools
+import logging
+import os
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from urllib.parse import parse_qsl
+from urllib.parse import urlsplit
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+from typing import TypeVar
+from typing import cast
+
+# seconds, from a hook callback up to a slow WMI query or model run
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+DEFAULT_PORT = 9464
+
+Sample = Tuple[str, Dict[str, str], float]
+Action = Callable[[Dict[str, str]], str]
+M = TypeVar('M', bound='_Metric')
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(str(v))}"' for k, v in labels.items()) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric(abc.ABC):
+    """A metric family, its label combinations are created on first use."""
+
+    kind = ''
+
+    def __init__(self, name: str, documentation: str,
+                 labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+
+    @abc.abstractmethod
+    def _new_child(self) -> Any:
+        pass
+
+    def labels(self, *values: str) -> Any:
+        child = self._children.get(values)
+        if child is None:
+            assert len(values) == len(self.labelnames), \
+                f'{self.name} takes {self.labelnames}'
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def samples(self) -> Iterator[Sample]:
+        for values, child in list(self._children.items()):
+            yield from child.samples(self.name, dict(zip(self.labelnames, values)))
+
+
+class _Value(object):
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Computes the value at scrape time instead."""
+        self.function = function
+
+    def samples(self, name: str, labels: Dict[str, str]) -> Iterator[Sample]:
+        if self.function is None:
+            yield name, labels, self.value
+            return
+        try:
+            yield name, labels, self.function()
+        except Exception as e:
+            logging.debug(f'Could not read {name}{_format_labels(labels)}: {e}')
+
+
+class _CounterValue(_Value):
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeValue(_Value):
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _new_child(self) -> _CounterValue:
+        return _CounterValue()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.labels().set_function(function)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self) -> _GaugeValue:
+        return _GaugeValue()
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.labels().set_function(function)
+
+
+class _Timer(object):
+    __slots__ = ('_histogram', '_started')
+
+    def __init__(self, histogram: '_HistogramValue') -> None:
+        self._histogram = histogram
+
+    def __enter__(self) -> '_Timer':
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._histogram.observe(time.perf_counter() - self._started)
+
+
+class _HistogramValue(object):
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self) -> _Timer:
+        return _Timer(self)
+
+    def samples(self, name: str, labels: Dict[str, str]) -> Iterator[Sample]:
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + [float('inf')], counts):
+            cumulative += count
+            yield f'{name}_bucket', dict(labels, le=_format_value(bound)), cumulative
+        yield f'{name}_sum', labels, total
+        yield f'{name}_count', labels, cumulative
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        timer: _Timer = self.labels().time()
+        return timer
+
+
+class Registry(object):
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: M) -> M:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+COLLECTOR_LOOP_SECONDS = registry.register(Histogram(
+    'flowd_collector_loop_seconds',
+    'Time a polling collector spends in one loop iteration, sleep excluded.',
+    ['collector']))
+CALLBACK_SECONDS = registry.register(Histogram(
+    'flowd_callback_seconds',
+    'Time spent in input hook callbacks, the count is the event rate.',
+    ['collector', 'callback']))
+EVENTS = registry.register(Counter(
+    'flowd_events_total', 'Events processed by the collectors.',
+    ['collector', 'event']))
+QUEUE_DEPTH = registry.register(Gauge(
+    'flowd_queue_depth', 'Items waiting in the internal queues.', ['queue']))
+INFERENCE_SECONDS = registry.register(Histogram(
+    'flowd_inference_seconds', 'Model inference time.', ['model']))
+TASK_SECONDS = registry.register(Histogram(
+    'flowd_supervisor_task_seconds', 'Duration of the periodic supervisor tasks.',
+    ['task']))
+RESIDENT_MEMORY = registry.register(Gauge(
+    'process_resident_memory_bytes', 'Resident memory size in bytes.'))
+CPU_SECONDS = registry.register(Counter(
+    'process_cpu_seconds_total', 'User and system CPU time spent in seconds.'))
+THREADS = registry.register(Gauge('flowd_threads', 'Live Python threads.'))
+
+
+def _rss() -> float:
+    import psutil
+
+    return float(psutil.Process().memory_info().rss)
+
+
+RESIDENT_MEMORY.set_function(_rss)
+CPU_SECONDS.set_function(time.process_time)
+THREADS.set_function(threading.active_count)
+
+
+def instrument(function: Callable, collector: str,
+               callback: Optional[str] = None) -> Callable:
+    """Wraps a hook callback so that its duration ends up in CALLBACK_SECONDS."""
+    histogram = CALLBACK_SECONDS.labels(collector, callback or function.__name__)
+
+    @functools.wraps(function)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started)
+
+    return wrapper
+
+
+def instrumented_callback(method: Callable) -> Callable:
+    """Same as `instrument()`, for collector methods, labelled with the
+    collector's metric name."""
+    name = method.__name__
+
+    @functools.wraps(method)
+    def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            CALLBACK_SECONDS.labels(self.metric_name, name).observe(elapsed)
+
+    return wrapper
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    actions: Dict[str, Action]
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry = registry
+
+    def do_GET(self) -> None:
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        """Runs an action registered with `MetricsServer.add_action()`."""
+        url = urlsplit(self.path)
+        action = cast(_ThreadingHTTPServer, self.server).actions.get(url.path)
+        if action is None:
+            self.send_error(404)
+            return
+        try:
+            body = action(dict(parse_qsl(url.query))).encode('utf8')
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logging.debug(f'metrics endpoint: {format % args}')
+
+
+class MetricsServer(object):
+    """Serves the registry at http://127.0.0.1:<port>/metrics for Prometheus to scrape.
+    Only listens on the loopback interface, FLOWD_METRICS_PORT overrides the port."""
+
+    def __init__(self, port: Optional[int] = None, host: str = '127.0.0.1') -> None:
+        if port is None:
+            port = int(os.environ.get('FLOWD_METRICS_PORT', DEFAULT_PORT))
+        self._server = _ThreadingHTTPServer((host, port), _MetricsHandler)
+        self._server.actions = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def add_action(self, path: str, action: Action) -> None:
+        """Makes `POST <path>?<query>` call action(query), e.g. to toggle the profiler."""
+        self._server.actions[path] = action
+
+    @property
+    def address(self) -> Tuple[str, int]:
+        return self._server.server_address[:2]
+
+    def start(self) -> None:
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name='MetricsServer', daemon=True)
+        self._thread.start()
+        logging.info('serving metrics at http://{}:{}/metrics'.format(*self.address))
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
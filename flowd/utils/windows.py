@@ -1,6 +1,6 @@
 import ctypes
 from ctypes import Structure, POINTER, WINFUNCTYPE, windll  # type: ignore
-from ctypes.wintypes import BOOL, UINT, DWORD  # type: ignore
+from ctypes.wintypes import BOOL, UINT, DWORD, HANDLE  # type: ignore
 
 import traceback
 import logging
@@ -58,24 +58,43 @@ class LastInputInfo(Structure):
     ]
 
 
-def _getLastInputTick() -> int:
-    prototype = WINFUNCTYPE(BOOL, POINTER(LastInputInfo))
-    paramflags = ((1, "lastinputinfo"), )
-    c_GetLastInputInfo = prototype(("GetLastInputInfo", ctypes.windll.user32), paramflags)  # type: ignore
+_GetLastInputInfo = WINFUNCTYPE(BOOL, POINTER(LastInputInfo))(
+    ("GetLastInputInfo", windll.user32), ((1, "lastinputinfo"), ))
+_GetTickCount = WINFUNCTYPE(DWORD)(("GetTickCount", windll.kernel32), ())
+
+TICK_MASK = 0xFFFFFFFF  # both ticks are 32-bit and wrap around every 49.7 days
+
 
+def _getLastInputTick() -> int:
     l = LastInputInfo()
     l.cbSize = ctypes.sizeof(LastInputInfo)
-    assert 0 != c_GetLastInputInfo(l)
+    assert 0 != _GetLastInputInfo(l)
     return l.dwTime
 
 
 def _getTickCount() -> int:
-    prototype = WINFUNCTYPE(DWORD)
-    paramflags = ()
-    c_GetTickCount = prototype(("GetTickCount", ctypes.windll.kernel32), paramflags)  # type: ignore
-    return c_GetTickCount()
+    return _GetTickCount()
 
 
 def seconds_since_last_input():
-    seconds_since_input = (_getTickCount() - _getLastInputTick()) / 1000
+    # the difference modulo 2^32 stays right when the tick count wrapped in between
+    seconds_since_input = ((_getTickCount() - _getLastInputTick()) & TICK_MASK) / 1000
     return seconds_since_input
+
+
+_OpenInputDesktop = WINFUNCTYPE(HANDLE, DWORD, BOOL, DWORD)(("OpenInputDesktop", windll.user32))
+_SwitchDesktop = WINFUNCTYPE(BOOL, HANDLE)(("SwitchDesktop", windll.user32))
+_CloseDesktop = WINFUNCTYPE(BOOL, HANDLE)(("CloseDesktop", windll.user32))
+
+DESKTOP_SWITCHDESKTOP = 0x0100
+
+
+def is_workstation_locked() -> bool:
+    """The input desktop can't be switched to while the secure (lock) desktop is up."""
+    desktop = _OpenInputDesktop(0, False, DESKTOP_SWITCHDESKTOP)
+    if not desktop:
+        return True
+    try:
+        return not _SwitchDesktop(desktop)
+    finally:
+        _CloseDesktop(desktop)
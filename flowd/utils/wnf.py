@@ -1,67 +1,242 @@
+import abc
 import ctypes
+import logging
+import threading
+import time
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from flowd.utils.profiler import record_native_id
 
 
 g_WellKnownWnfNames = {
     "WNF_SHEL_QUIET_MOMENT_SHELL_MODE_CHANGED": 0xd83063ea3bf5075,
     "WNF_SHEL_QUIETHOURS_ACTIVE_PROFILE_CHANGED": 0xd83063ea3bf1c75
 }
-ZwUpdateWnfStateData = ctypes.windll.ntdll.ZwUpdateWnfStateData
-ZwQueryWnfStateData = ctypes.windll.ntdll.ZwQueryWnfStateData
 
 
-def format_state_name(wnf_name):
-    return "{:x}".format(g_WellKnownWnfNames[wnf_name.upper()])
+class WnfBackend(abc.ABC):
+    """Access to WNF state data, so that everything above it runs without Windows."""
 
+    @abc.abstractmethod
+    def read(self, state_name: int, last_stamp: Optional[int] = None) -> Tuple[int, Optional[bytes]]:
+        """Returns (change stamp, data). Data is None when the read failed or
+        the change stamp still equals last_stamp."""
 
-def do_read(state_name) -> int:
-    _, _, data_buffer, buffer_size = read_wnf_data(int(state_name, 16))
-    return int(data_buffer.raw[0])
+    @abc.abstractmethod
+    def write(self, state_name: int, data: bytes) -> bool:
+        pass
+
+
+class NativeWnfBackend(WnfBackend):
+    """ntdll based backend, reads into one preallocated buffer."""
 
+    def __init__(self) -> None:
+        ntdll = ctypes.windll.ntdll  # type: ignore
+        self._query = ntdll.ZwQueryWnfStateData
+        self._update = ntdll.ZwUpdateWnfStateData
+        self._lock = threading.Lock()
+        self._name = ctypes.c_longlong(0)
+        self._stamp = ctypes.c_ulong(0)
+        self._buffer = ctypes.create_string_buffer(4096)
+        self._size = ctypes.c_ulong(0)
 
-def read_wnf_data(state_name):
-    change_stamp = ctypes.c_ulong(0)
-    data_buffer = ctypes.create_string_buffer(4096)
-    buffer_size = ctypes.c_ulong(ctypes.sizeof(data_buffer))
-    state_name = ctypes.c_longlong(state_name)
-    res = ZwQueryWnfStateData(ctypes.byref(state_name),
+    def read(self, state_name, last_stamp=None):
+        with self._lock:
+            self._name.value = state_name
+            self._size.value = ctypes.sizeof(self._buffer)
+            res = self._query(ctypes.byref(self._name),
                               0, 0,
-                              ctypes.byref(change_stamp),
-                              ctypes.byref(data_buffer),
-                              ctypes.byref(buffer_size)
+                              ctypes.byref(self._stamp),
+                              ctypes.byref(self._buffer),
+                              ctypes.byref(self._size)
                               )
-    read_access = 0 if res != 0 else 1
-    buffer_size = ctypes.c_ulong(0) if res != 0 else buffer_size
-    return read_access, change_stamp.value, data_buffer, buffer_size.value
+            stamp = self._stamp.value
+            if res != 0 or stamp == last_stamp:
+                return stamp, None
+            return stamp, self._buffer[:self._size.value]
 
+    def write(self, state_name, data):
+        name = ctypes.c_longlong(state_name)
+        status = self._update(ctypes.byref(name), ctypes.c_char_p(data), len(data), 0, 0, 0, 0)
+        status = ctypes.c_ulong(status).value
 
-# Writes the given data into the given state name
-def do_write(state_name, data):
-    state_name = ctypes.c_longlong(int(state_name, 16))
-    data_buffer = ctypes.c_char_p(data)
-    buffer_size = len(data)
-    status = ZwUpdateWnfStateData(ctypes.byref(state_name), data_buffer, buffer_size, 0, 0, 0, 0)
-    status = ctypes.c_ulong(status).value
+        if status == 0:
+            return True
+        else:
+            logging.error('Could not write WNF state 0x{:x}: 0x{:x}'.format(state_name, status))
+            return False
+
+
+class FakeWnfBackend(WnfBackend):
+    """In-memory WNF state for tests, every write bumps the change stamp."""
+
+    def __init__(self) -> None:
+        self.states: Dict[int, Tuple[int, bytes]] = {}
+        self.reads = 0
+        self.writes: List[Tuple[int, bytes]] = []
+
+    def read(self, state_name: int, last_stamp: Optional[int] = None) -> Tuple[int, Optional[bytes]]:
+        self.reads += 1
+        stamp, data = self.states.get(state_name, (0, b''))
+        return stamp, None if stamp == last_stamp else data
 
-    if status == 0:
+    def write(self, state_name: int, data: bytes) -> bool:
+        stamp, _ = self.states.get(state_name, (0, b''))
+        self.states[state_name] = (stamp + 1, bytes(data))
+        self.writes.append((state_name, bytes(data)))
         return True
-    else:
-        print('[Error] Could not write for this statename: 0x{:x}'.format(status))
-        return False
 
 
-def set_focus_mode(mode_type) -> None:
+_backend = None
+
+
+def default_backend() -> WnfBackend:
+    global _backend
+    if _backend is None:
+        _backend = NativeWnfBackend()
+    return _backend
+
+
+def use_backend(backend: WnfBackend) -> None:
+    global _backend
+    _backend = backend
+
+
+def format_state_name(wnf_name):
+    return "{:x}".format(g_WellKnownWnfNames[wnf_name.upper()])
+
+
+def do_read(state_name) -> int:
+    _, data = default_backend().read(int(state_name, 16))
+    return data[0] if data else 0
+
+
+# Writes the given data into the given state name
+def do_write(state_name, data):
+    return default_backend().write(int(state_name, 16), data)
+
+
+def set_focus_mode(mode_type, backend=None) -> bool:
     """
     Turns on/off Windows Focus assist mode
     :param mode_type: turns on/off mode configured for an automatic rules:
      0 - Off,
      1 - when I am playing a game,
      2 - When I am using an app in full screen mode
-    :return: None
+    :param backend: WNF backend to write with, the default one if not set
+    :return: whether the state was written
     """
     modes = {
         0: [0, 0, 0, 0],
         1: [1, 0, 0, 0],
         2: [2, 0, 0, 0],
     }
-    do_write(format_state_name("WNF_SHEL_QUIET_MOMENT_SHELL_MODE_CHANGED"), bytes(modes[mode_type]))
+    backend = backend or default_backend()
+    return backend.write(g_WellKnownWnfNames["WNF_SHEL_QUIET_MOMENT_SHELL_MODE_CHANGED"], bytes(modes[mode_type]))
+
+
+class ModeChange(NamedTuple):
+    previous: int
+    mode: int
+    timestamp: float
+
+
+class FocusStateSampler(object):
+    """Watches the active quiet hours profile (0 - off, 1 - priority only,
+    2 - alarms only) for all interested collectors at once.
+
+    A read whose change stamp didn't move is skipped without looking at the
+    data. Subscribers are called with a ModeChange on every transition.
+    """
+
+    STATE_NAME = g_WellKnownWnfNames["WNF_SHEL_QUIETHOURS_ACTIVE_PROFILE_CHANGED"]
+
+    def __init__(self, backend=None, interval=1.0, clock=time.time) -> None:
+        self._backend = backend
+        self.interval = interval
+        self.clock = clock
+        self.mode = 0
+        self.since = clock()
+        self._stamp = None
+        self._subscribers: List[Callable[[ModeChange], None]] = []
+        self._lock = threading.Lock()
+        # start() and stop(), held while the sampling thread is joined
+        self._running = threading.Lock()
+        self._users = 0
+        self._quit = threading.Event()
+        self._thread = None
+
+    @property
+    def backend(self) -> WnfBackend:
+        return self._backend or default_backend()
+
+    def subscribe(self, callback: Callable[[ModeChange], None]) -> None:
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[ModeChange], None]) -> None:
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def sample(self) -> Optional[ModeChange]:
+        stamp, data = self.backend.read(self.STATE_NAME, self._stamp)
+        if data is None:
+            return None
+        self._stamp = stamp
+        mode = data[0] if data else 0
+        if mode == self.mode:
+            return None
+
+        change = ModeChange(self.mode, mode, self.clock())
+        self.mode, self.since = mode, change.timestamp
+        logging.debug(f'Focus mode changed: {change}')
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(change)
+        return change
+
+    def _run(self, quit: threading.Event) -> None:
+        record_native_id()
+        while not quit.wait(self.interval):
+            self.sample()
+
+    def start(self) -> None:
+        """Starts sampling, once for any number of users."""
+        with self._running:
+            self._users += 1
+            if self._thread is not None:
+                return
+            # every thread gets its own event, one that is stopping never sees it cleared
+            self._quit = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._quit,),
+                                            name='FocusStateSampler', daemon=True)
+            self.sample()
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stops sampling once the last user is gone and waits for the thread."""
+        with self._running:
+            self._users = max(self._users - 1, 0)
+            if self._users or self._thread is None:
+                return
+            self._quit.set()
+            if self._thread is not threading.current_thread():
+                self._thread.join()
+            self._thread = None
+
+
+_sampler = None
+
 
+def focus_state_sampler() -> FocusStateSampler:
+    global _sampler
+    if _sampler is None:
+        _sampler = FocusStateSampler()
+    return _sampler
@@ -0,0 +1,393 @@
+import argparse
+import glob
+import itertools
+import json
+import logging
+import math
+import os
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from typing import Tuple
+
+import numpy as np
+import yaml
+
+RATE = 16000
+FRAME_MS = 30
+FRAME_SAMPLES = RATE * FRAME_MS // 1000
+FRAME_SEC = FRAME_MS / 1000
+PADDING_MS = 300
+
+DEFAULT_DATABASE = Path(__file__).parent / "database.yml"
+DEFAULT_CACHE = os.path.expanduser("~/flowd/vad_cache")
+
+Regions = List[Tuple[float, float]]
+
+
+class CorpusFile(NamedTuple):
+    uri: str
+    audio: str
+    speech: Regions  # reference speech, seconds
+    annotated: Optional[Regions]  # None means the whole file
+
+
+class Params(NamedTuple):
+    vad_mode: int
+    voiced_frames_rate: float
+    unvoiced_frames_rate: float
+    max_voiced_frames: int
+    gate: bool
+
+
+class Score(NamedTuple):
+    speech: float = 0.0
+    false_alarm: float = 0.0
+    missed: float = 0.0
+    audio: float = 0.0
+
+    def __add__(self, other: Any) -> "Score":
+        return Score(*(a + b for a, b in zip(self, other)))
+
+    @property
+    def detection_error_rate(self) -> float:
+        return (self.false_alarm + self.missed) / self.speech if self.speech else 0.0
+
+
+def load_protocol(database: Path, protocol: str, subset: str) -> List[CorpusFile]:
+    """Reads a pyannote.database style protocol, e.g. AMI.SpeakerDiarization.MixHeadset
+    (subsets train/development/test, RTTM/UEM references) or MUSAN.Collection
+    (subsets Speech/Music/Noise/BackgroundNoise, the whole file is or isn't speech)."""
+    with open(database) as f:
+        config = yaml.safe_load(f)
+    root = database.parent
+
+    name = protocol.split(".")[0]
+    spec = config["Protocols"]
+    for part in protocol.split("."):
+        spec = spec[part]
+    spec = spec[subset]
+
+    with open(root / spec["uri"]) as f:
+        uris = [line.strip() for line in f if line.strip()]
+
+    speech: Dict[str, Regions] = {}
+    if "annotation" in spec:
+        speech = _read_rttm(root / spec["annotation"])
+    elif subset == "Speech":
+        speech = {uri: [(0.0, math.inf)] for uri in uris}
+    annotated = _read_uem(root / spec["annotated"]) if "annotated" in spec else {}
+
+    template = config["Databases"][name]
+    files = []
+    for uri in uris:
+        matches = sorted(glob.glob(str(root / template.format(uri=uri))))
+        if not matches:
+            raise FileNotFoundError(f"no audio for {uri} ({template})")
+        files.append(
+            CorpusFile(uri, matches[0], speech.get(uri, []), annotated.get(uri))
+        )
+    return files
+
+
+def _read_rttm(path: Path) -> Dict[str, Regions]:
+    regions: Dict[str, Regions] = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 5 or fields[0] != "SPEAKER":
+                continue
+            start, duration = float(fields[3]), float(fields[4])
+            regions.setdefault(fields[1], []).append((start, start + duration))
+    return regions
+
+
+def _read_uem(path: Path) -> Dict[str, Regions]:
+    regions: Dict[str, Regions] = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            regions.setdefault(fields[0], []).append((float(fields[2]), float(fields[3])))
+    return regions
+
+
+def decode(path: str) -> np.ndarray:
+    """Decodes a 16-bit .wav file into 16 kHz mono samples."""
+    with wave.open(path, "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{path}: only 16-bit PCM audio is supported")
+        channels, rate = wf.getnchannels(), wf.getframerate()
+        pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+
+    samples = pcm.reshape(-1, channels)[:, 0]
+    if rate != RATE:
+        from scipy.signal import resample_poly
+
+        resampled = resample_poly(samples.astype(np.float32), RATE, rate)
+        samples = np.clip(resampled, -32768, 32767).astype(np.int16)
+    return samples
+
+
+class FeatureCache:
+    """Decoded audio and per-frame features, stored as raw arrays that are
+    memory-mapped back, so every sweep after the first skips decoding."""
+
+    def __init__(self, root: str) -> None:
+        self.root = Path(root)
+
+    def _path(self, uri: str, name: str) -> Path:
+        return self.root / uri.replace("/", "__") / name
+
+    @staticmethod
+    def _load(path: Path, dtype: Any) -> np.ndarray:
+        if path.stat().st_size == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r")
+
+    @staticmethod
+    def _store(path: Path, array: np.ndarray) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        array.tofile(str(tmp))
+        os.replace(tmp, path)
+
+    def has(self, uri: str, name: str) -> bool:
+        return self._path(uri, name).exists()
+
+    def pcm(self, f: CorpusFile) -> np.ndarray:
+        path = self._path(f.uri, "pcm.i16")
+        if not path.exists():
+            self._store(path, decode(f.audio))
+        return self._load(path, np.int16)
+
+    def frames(self, f: CorpusFile) -> List[bytes]:
+        pcm = self.pcm(f)
+        n = len(pcm) // FRAME_SAMPLES
+        frames = pcm[: n * FRAME_SAMPLES].reshape(n, FRAME_SAMPLES)
+        return [frame.tobytes() for frame in frames]
+
+    def webrtcvad(self, f: CorpusFile, mode: int) -> np.ndarray:
+        """webrtcvad decisions for every frame."""
+        path = self._path(f.uri, f"webrtcvad.{mode}.u1")
+        if not path.exists():
+            import webrtcvad
+
+            vad = webrtcvad.Vad(mode)
+            decisions = [vad.is_speech(frame, RATE) for frame in self.frames(f)]
+            self._store(path, np.array(decisions, dtype=np.uint8))
+        return self._load(path, np.uint8)
+
+    def gate(self, f: CorpusFile) -> np.ndarray:
+        """Energy gate decisions for every frame."""
+        path = self._path(f.uri, "gate.u1")
+        if not path.exists():
+            from flowd.utils.audio import EnergyGate
+
+            gate = EnergyGate(FRAME_SAMPLES * 2)
+            decisions = [passed for _, passed in gate.filter(self.frames(f))]
+            self._store(path, np.array(decisions, dtype=np.uint8))
+        return self._load(path, np.uint8)
+
+
+def _mask(regions: Iterable[Tuple[float, float]], n_frames: int) -> np.ndarray:
+    """Frames whose centre falls into any of the regions."""
+    mask = np.zeros(n_frames, dtype=bool)
+    for start, end in regions:
+        first = max(int(math.ceil(start / FRAME_SEC - 0.5)), 0)
+        last = n_frames if math.isinf(end) else int(math.ceil(end / FRAME_SEC - 0.5))
+        last = min(last, n_frames)
+        mask[first:last] = True
+    return mask
+
+
+def extract(cache_root: str, f: CorpusFile, modes: Sequence[int]) -> Tuple[float, float]:
+    """Fills the feature cache for one file, returns (audio seconds, elapsed seconds)."""
+    started_at = time.perf_counter()
+    cache = FeatureCache(cache_root)
+    n_frames = len(cache.pcm(f)) // FRAME_SAMPLES
+    for mode in modes:
+        cache.webrtcvad(f, mode)
+    cache.gate(f)
+    return n_frames * FRAME_SEC, time.perf_counter() - started_at
+
+
+_collector = None
+
+
+def _segmenter() -> Any:
+    global _collector
+    if _collector is None:
+        from flowd.metrics.vad_collector import VoiceActivationDetectionCollector
+
+        _collector = VoiceActivationDetectionCollector()
+    return _collector
+
+
+def evaluate(
+    cache_root: str, f: CorpusFile, sweep: Sequence[Params]
+) -> Tuple[List[Score], Score]:
+    """Runs the collector's segmentation over cached decisions for every set of
+    parameters. Also scores the energy gate alone (a false alarm being a frame
+    it lets through, a miss a speech frame it blocks)."""
+    cache = FeatureCache(cache_root)
+    gate = cache.gate(f).astype(bool)
+    n_frames = len(gate)
+    annotated = _mask(f.annotated or [(0.0, math.inf)], n_frames)
+    reference = _mask(f.speech, n_frames) & annotated
+
+    def score(hypothesis: np.ndarray) -> Score:
+        return Score(
+            speech=np.count_nonzero(reference) * FRAME_SEC,
+            false_alarm=np.count_nonzero(hypothesis & annotated & ~reference) * FRAME_SEC,
+            missed=np.count_nonzero(reference & ~hypothesis) * FRAME_SEC,
+            audio=np.count_nonzero(annotated) * FRAME_SEC,
+        )
+
+    collector = _segmenter()
+    num_padding_frames = PADDING_MS // FRAME_MS
+    scores = []
+    for p in sweep:
+        decisions = cache.webrtcvad(f, p.vad_mode).astype(bool)
+        if p.gate:
+            decisions &= gate
+
+        collector.voiced_frames_rate = p.voiced_frames_rate
+        collector.unvoiced_frames_rate = p.unvoiced_frames_rate
+        collector.max_voiced_frames = p.max_voiced_frames
+        segments = collector.segment_decisions(
+            num_padding_frames, zip(itertools.repeat(b""), decisions.tolist())
+        )
+        hypothesis = _mask(((s.start, s.start + s.duration) for s in segments), n_frames)
+        scores.append(score(hypothesis))
+
+    return scores, score(gate)
+
+
+def run(
+    files: Sequence[CorpusFile], sweep: Sequence[Params], cache_root: str, workers: int
+) -> Tuple[Dict[Params, Score], Score]:
+    modes = sorted({p.vad_mode for p in sweep})
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        todo = [f for f in files if not _cached(cache_root, f, modes)]
+        if todo:
+            started_at = time.perf_counter()
+            audio = sum(
+                seconds
+                for seconds, _ in pool.map(
+                    extract, itertools.repeat(cache_root), todo, itertools.repeat(modes)
+                )
+            )
+            elapsed = time.perf_counter() - started_at
+            logging.info(
+                f"extracted features of {len(todo)} files, {audio / 3600:.2f}h of audio "
+                f"in {elapsed:.1f}s ({audio / elapsed:.0f}x real time)"
+            )
+        else:
+            logging.info("all features are cached, skipping decoding")
+
+        started_at = time.perf_counter()
+        totals = {p: Score() for p in sweep}
+        gate_total = Score()
+        for scores, gate in pool.map(
+            evaluate, itertools.repeat(cache_root), files, itertools.repeat(sweep)
+        ):
+            for p, s in zip(sweep, scores):
+                totals[p] += s
+            gate_total += gate
+        elapsed = time.perf_counter() - started_at
+
+    audio = gate_total.audio * len(sweep)
+    logging.info(
+        f"evaluated {len(sweep)} parameter sets over {len(files)} files "
+        f"in {elapsed:.1f}s ({audio / max(elapsed, 1e-9):.0f}x real time)"
+    )
+    return totals, gate_total
+
+
+def _cached(cache_root: str, f: CorpusFile, modes: Sequence[int]) -> bool:
+    cache = FeatureCache(cache_root)
+    names = ["pcm.i16", "gate.u1"] + [f"webrtcvad.{m}.u1" for m in modes]
+    return all(cache.has(f.uri, n) for n in names)
+
+
+def _values(kind: Any) -> Any:
+    return lambda s: [kind(v) for v in s.split(",")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Evaluates and tunes the voice activity detection collector "
+        "over the corpora declared in database.yml."
+    )
+    parser.add_argument("--database", type=Path, default=DEFAULT_DATABASE)
+    parser.add_argument("--protocol", default="AMI.SpeakerDiarization.MixHeadset")
+    parser.add_argument("--subset", default="development")
+    parser.add_argument("--cache", default=DEFAULT_CACHE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--vad-mode", type=_values(int), default=[3])
+    parser.add_argument("--voiced-frames-rate", type=_values(float), default=[0.9])
+    parser.add_argument("--unvoiced-frames-rate", type=_values(float), default=[0.9])
+    parser.add_argument("--max-voiced-frames", type=_values(int), default=[100])
+    parser.add_argument(
+        "--gate",
+        type=_values(lambda v: v.lower() in ("1", "true", "yes")),
+        default=[True],
+    )
+    parser.add_argument("--output", help="write the results to this .json file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)-8s %(message)s")
+    files = load_protocol(args.database.resolve(), args.protocol, args.subset)
+    sweep = [
+        Params(*p)
+        for p in itertools.product(
+            args.vad_mode,
+            args.voiced_frames_rate,
+            args.unvoiced_frames_rate,
+            args.max_voiced_frames,
+            args.gate,
+        )
+    ]
+    totals, gate = run(files, sweep, args.cache, args.workers)
+
+    passed = (gate.false_alarm + gate.speech - gate.missed) / max(gate.audio, 1e-9)
+    blocked = gate.missed / max(gate.speech, 1e-9)
+    logging.info(
+        f"energy gate: {passed:.1%} of audio passed, {blocked:.1%} of speech blocked"
+    )
+    ranked = sorted(totals.items(), key=lambda item: item[1].detection_error_rate)
+    for p, s in ranked:
+        logging.info(
+            f"{p}: detection error {s.detection_error_rate:.2%} "
+            f"(false alarm {s.false_alarm:.0f}s, missed {s.missed:.0f}s, "
+            f"speech {s.speech:.0f}s)"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                [
+                    {
+                        **p._asdict(),
+                        **s._asdict(),
+                        "detection_error_rate": s.detection_error_rate,
+                    }
+                    for p, s in ranked
+                ],
+                f,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -31,12 +31,20 @@ setup(
         'wheel',
         'scipy==1.4.1',
         'numba==0.48',
+        'numpy',
         # 'torch@https://download.pytorch.org/whl/cpu/torch-1.5.1%2Bcpu-cp36-cp36m-win_amd64.whl',
         'webrtcvad>=2.0.10',
         'psutil',
         'pyaudio',
+        'pyyaml',
         'pyannote.audio>=2.0a1'
     ],
     extras_require={},
-    entry_points={"console_scripts": ["flowd=flowd.__main__:main"]},
+    entry_points={
+        "console_scripts": [
+            "flowd=flowd.__main__:main",
+            "flowd-vad-eval=flowd.vad_evaluation:main",
+            "flowd-server=flowd.server:main",
+        ]
+    },
 )
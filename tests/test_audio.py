@@ -0,0 +1,108 @@
+import itertools
+import os
+import tempfile
+import unittest
+import wave
+
+import numpy as np
+
+from flowd.metrics.vad_collector import VoiceActivationDetectionCollector
+from flowd.model.sad_pipeline import SADPipelineLoader
+from flowd.utils.audio import FrameRingBuffer
+from flowd.utils.audio import WavFileSource
+
+RATE = 16000
+
+
+def voice(seconds: float) -> np.ndarray:
+    """A voiced-sounding harmonic series with a wobbling pitch and syllables."""
+    t = np.arange(int(RATE * seconds)) / RATE
+    phase = 2 * np.pi * np.cumsum(140 + 20 * np.sin(2 * np.pi * 3 * t)) / RATE
+    harmonics = sum(np.sin(k * phase) / k for k in range(1, 15))
+    syllables = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t) ** 2
+    return 2000 * harmonics * syllables
+
+
+def quiet(seconds: float, seed: int = 0) -> np.ndarray:
+    return np.random.RandomState(seed).normal(0, 30, int(RATE * seconds))
+
+
+def frame(ring: FrameRingBuffer) -> bytes:
+    data = ring.get(timeout=0)
+    assert data is not None
+    return bytes(data)
+
+
+class FrameRingBufferTest(unittest.TestCase):
+    def test_full_buffer_drops_new_frames(self) -> None:
+        ring = FrameRingBuffer(capacity=4, frame_size=2, reserve=1)
+        for i in range(5):
+            ring.put(bytes([i, i]))
+        self.assertEqual(len(ring), 3)
+        self.assertEqual(ring.overruns, 2)
+        self.assertEqual(frame(ring), b"\x00\x00")
+
+    def test_reserved_frames_are_not_overwritten(self) -> None:
+        ring = FrameRingBuffer(capacity=4, frame_size=2, reserve=2)
+        ring.put(b"aa")
+        ring.put(b"bb")
+        kept = list(itertools.islice(ring, 2))
+        for chunk in (b"cc", b"dd", b"ee"):
+            ring.put(chunk)
+        self.assertEqual([bytes(f) for f in kept], [b"aa", b"bb"])
+        self.assertEqual(ring.overruns, 1)
+        self.assertEqual([frame(ring), frame(ring)], [b"cc", b"dd"])
+
+    def test_closed_buffer_drains_then_ends(self) -> None:
+        ring = FrameRingBuffer(capacity=4, frame_size=2)
+        ring.put(b"aa")
+        ring.close()
+        self.assertEqual([bytes(f) for f in ring], [b"aa"])
+        self.assertIsNone(ring.get(timeout=0))
+        ring.reopen()
+        self.assertEqual(len(ring), 0)
+        ring.put(b"bb")
+        self.assertEqual(frame(ring), b"bb")
+
+
+class WavFileCollectorTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+        self.collector = VoiceActivationDetectionCollector()
+        # never download the pyannote pipeline, segments count as webrtcvad has them
+        self.collector.pipeline = SADPipelineLoader(self.tmp.name, offline=True)
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def play(self, *parts: np.ndarray) -> None:
+        path = os.path.join(self.tmp.name, "audio.wav")
+        with wave.open(path, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(RATE)
+            wf.writeframes(np.concatenate(parts).astype(np.int16).tobytes())
+        self.collector.source = WavFileSource(
+            path, self.collector.chunk_size, realtime=False
+        )
+        self.collector.start_collect()
+
+    def test_source_delivers_every_frame(self) -> None:
+        self.play(quiet(4.5))
+        self.assertEqual(self.collector.gate.frames, 150)
+        self.assertEqual(self.collector.ring_buffer.overruns, 0)
+        self.assertEqual(self.collector.get_current_state()[1], 0)
+
+    def test_voice_is_counted(self) -> None:
+        self.play(quiet(1), voice(2), quiet(1.5, seed=1))
+        name, seconds = self.collector.get_current_state()
+        self.assertEqual(name, "Voice Activity Detected (seconds)")
+        self.assertGreater(seconds, 1.5)
+        self.assertLess(seconds, 3.0)
+        self.assertEqual(self.collector.ring_buffer.overruns, 0)
+        self.collector.cleanup()
+        self.assertEqual(self.collector.get_current_state()[1], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import tempfile
+import unittest
+from typing import List
+from typing import Set
+
+from flowd.utils.connections import Connection
+from flowd.utils.connections import ConnectionTracker
+from flowd.utils.connections import read_proc_net_tcp
+
+HEADER = (
+    "  sl  local_address rem_address   st tx_queue rx_queue tr tm->when "
+    "retrnsmt   uid  timeout inode\n"
+)
+TCP = HEADER + (
+    # 10.0.2.15:54321 -> 10.0.0.5:22, established
+    "   0: 0F02000A:D431 0500000A:0016 01 00000000:00000000 00:00000000 "
+    "00000000  1000        0 1001 1 0000000000000000 20 4 30 10 -1\n"
+    # 127.0.0.1:22 listening
+    "   1: 0100007F:0016 00000000:0000 0A 00000000:00000000 00:00000000 "
+    "00000000     0        0 1002 1 0000000000000000 100 0 0 10 0\n"
+    # 10.0.2.15:54322 -> 10.0.0.6:21, closing
+    "   2: 0F02000A:D432 0600000A:0015 06 00000000:00000000 00:00000000 "
+    "00000000  1000        0 1003 1 0000000000000000 20 4 30 10 -1\n"
+)
+TCP6 = HEADER + (
+    # [::1]:40000 -> [2001:db8::1]:22, established
+    "   0: 00000000000000000000000001000000:9C40 B80D0120000000000000000001000000:0016 "
+    "01 00000000:00000000 00:00000000 00000000  1000        0 2001 1 "
+    "0000000000000000 20 4 30 10 -1\n"
+)
+
+
+def connection(host: str, local_port: int, port: int = 22) -> Connection:
+    return Connection(("10.0.2.15", local_port), (host, port))
+
+
+class ReadProcNetTcpTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.tmp.cleanup()
+
+    def write(self, name: str, text: str) -> str:
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_established_connections_of_both_families(self) -> None:
+        paths = (self.write("tcp", TCP), self.write("tcp6", TCP6))
+        self.assertEqual(
+            read_proc_net_tcp(paths),
+            {
+                Connection(("10.0.2.15", 54321), ("10.0.0.5", 22)),
+                Connection(("::1", 40000), ("2001:db8::1", 22)),
+            },
+        )
+
+    def test_missing_table_is_skipped(self) -> None:
+        paths = (self.write("tcp", TCP), os.path.join(self.tmp.name, "tcp6"))
+        self.assertEqual(len(read_proc_net_tcp(paths)), 1)
+
+
+class ConnectionTrackerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.connections: Set[Connection] = set()
+        self.tracker = ConnectionTracker(
+            [22], source=lambda: set(self.connections), clock=lambda: self.now
+        )
+
+    def poll(self, at: float, *connections: Connection) -> List[bool]:
+        self.now = at
+        self.connections = set(connections)
+        return [e.opened for e in self.tracker.poll()]
+
+    def test_events_and_durations(self) -> None:
+        a1, a2 = connection("10.0.0.5", 1), connection("10.0.0.5", 2)
+        b = connection("10.0.0.6", 3)
+        ftp = connection("10.0.0.6", 4, port=21)
+        self.assertEqual(self.poll(0, a1, ftp), [True])
+        self.assertEqual(self.poll(3, a1, a2), [True])
+        self.assertEqual(self.poll(4, a1, a2, b), [True])
+        self.assertEqual(self.poll(5, a2, b), [False])
+        self.assertEqual(self.poll(6, a2), [False])
+        self.assertTrue(self.tracker.active)
+        self.assertEqual(self.poll(10), [False])
+        self.assertFalse(self.tracker.active)
+        self.assertEqual(self.poll(20, b), [True])
+        self.now = 25
+        self.assertEqual(self.tracker.active_seconds(), 15)
+        self.assertEqual(
+            self.tracker.session_seconds(), {"10.0.0.5": 10, "10.0.0.6": 7}
+        )
+
+    def test_event_timestamps(self) -> None:
+        a = connection("10.0.0.5", 1)
+        self.now = 7
+        self.connections = {a}
+        (event,) = self.tracker.poll()
+        self.assertEqual((event.opened, event.connection, event.timestamp), (True, a, 7))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from typing import List
+
+from flowd.focus import FOCUS_OFF
+from flowd.focus import FOCUS_ON
+from flowd.focus import FocusController
+from flowd.utils.wnf import FakeWnfBackend
+
+
+class FailingWnfBackend(FakeWnfBackend):
+    def write(self, state_name: int, data: bytes) -> bool:
+        return False
+
+
+class FocusControllerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now = 0.0
+        self.backend = FakeWnfBackend()
+        self.controller = FocusController(
+            self.backend,
+            enter_threshold=75,
+            exit_threshold=65,
+            min_dwell=300,
+            clock=lambda: self.now,
+        )
+
+    def modes(self) -> List[int]:
+        return [data[0] for _, data in self.backend.writes]
+
+    def feed(self, *predictions: float, every: float = 60) -> List[bool]:
+        written = []
+        for p in predictions:
+            written.append(self.controller.update(p))
+            self.now += every
+        return written
+
+    def test_first_update_syncs_the_mode(self) -> None:
+        self.assertEqual(self.feed(70), [True])
+        self.assertEqual(self.controller.mode, FOCUS_OFF)
+        self.assertEqual(self.modes(), [FOCUS_OFF])
+
+    def test_hysteresis(self) -> None:
+        self.feed(50, 74, 75, 70, 66, 65, 70, 74, every=400)
+        self.assertEqual(self.modes(), [FOCUS_OFF, FOCUS_ON, FOCUS_OFF])
+        self.assertEqual(self.controller.mode, FOCUS_OFF)
+
+    def test_writes_only_on_change(self) -> None:
+        self.assertEqual(self.feed(90, 90, 80, 76), [True, False, False, False])
+        self.assertEqual(self.modes(), [FOCUS_ON])
+        self.assertEqual(self.controller.writes, 1)
+
+    def test_mode_is_kept_for_min_dwell(self) -> None:
+        self.feed(50, 80)  # turned on at 60s
+        self.assertEqual(self.feed(10, 10, 10, 10), [False] * 4)
+        self.assertEqual(self.controller.mode, FOCUS_ON)
+        self.assertEqual(self.now, 360)
+        self.assertEqual(self.feed(10), [True])
+        self.assertEqual(self.modes(), [FOCUS_OFF, FOCUS_ON, FOCUS_OFF])
+
+    def test_failed_write_keeps_the_mode(self) -> None:
+        controller = FocusController(FailingWnfBackend(), clock=lambda: self.now)
+        self.assertFalse(controller.update(90))
+        self.assertIsNone(controller.mode)
+        self.assertEqual(controller.writes, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+from typing import List
+
+from flowd.integrations.session import GraphSession
+from flowd.integrations.session import MicrosoftGraphError
+from flowd.integrations.standin import StandInServer
+
+EVENT = {"subject": "Focus time"}
+
+
+class GraphSessionTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.server = StandInServer().start()
+        self.sleeps: List[float] = []
+        self.token = "token"
+        self.refreshes = 0
+        self.session = GraphSession(
+            lambda: self.token,
+            on_unauthorized=self.refresh,
+            base_url=self.server.url,
+            pool_size=2,
+            sleep=self.sleeps.append,
+        )
+
+    def tearDown(self) -> None:
+        self.session.close()
+        self.server.stop()
+
+    def refresh(self) -> None:
+        self.refreshes += 1
+        self.token = f"token{self.refreshes}"
+
+    def test_pooled_session_reuses_connections(self) -> None:
+        for _ in range(10):
+            self.session.json("POST", "/me/events", json=EVENT)
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual(len(self.server.events), 10)
+
+    def test_async_calls_share_the_pool(self) -> None:
+        async def burst() -> None:
+            post = self.session.json_async
+            await asyncio.gather(
+                *(post("POST", "/me/events", json=EVENT) for _ in range(20))
+            )
+
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(burst())
+        finally:
+            loop.close()
+        self.assertEqual(len(self.server.events), 20)
+        self.assertLessEqual(self.server.connections, self.session.pool_size)
+
+    def test_throttled_request_is_retried_after_retry_after(self) -> None:
+        self.server.throttle(2, "3")
+        rv = self.session.json("POST", "/me/events", json=EVENT)
+        self.assertEqual(rv["subject"], "Focus time")
+        self.assertEqual(self.sleeps, [3.0, 3.0])
+        self.assertEqual(self.session.retries, 2)
+        self.assertEqual(len(self.server.events), 1)
+
+    def test_unauthorized_refreshes_the_token_once(self) -> None:
+        self.server.expired_tokens.add("token")
+        self.session.json("POST", "/me/events", json=EVENT)
+        self.assertEqual(self.refreshes, 1)
+        self.assertEqual(len(self.server.events), 1)
+
+    def test_unauthorized_after_refresh_fails(self) -> None:
+        self.server.expired_tokens.update(("token", "token1", "token2"))
+        with self.assertRaises(MicrosoftGraphError):
+            self.session.json("POST", "/me/events", json=EVENT)
+        self.assertEqual(self.refreshes, 1)
+
+    def test_failed_connection_is_retried_only_when_idempotent(self) -> None:
+        self.server.stop()
+        with self.assertRaises(MicrosoftGraphError):
+            self.session.json("POST", "/me/events", json=EVENT)
+        self.assertEqual(self.sleeps, [])
+        with self.assertRaises(MicrosoftGraphError):
+            self.session.json("POST", "/me/events", json=dict(EVENT, transactionId="t"))
+        self.assertEqual(len(self.sleeps), self.session.max_retries)
+
+
+if __name__ == "__main__":
+    unittest.main()
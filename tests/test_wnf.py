@@ -0,0 +1,88 @@
+import threading
+import unittest
+from typing import List
+
+from flowd.utils import wnf
+from flowd.utils.wnf import FakeWnfBackend
+from flowd.utils.wnf import FocusStateSampler
+from flowd.utils.wnf import ModeChange
+
+PROFILE = FocusStateSampler.STATE_NAME
+
+
+def samplers() -> int:
+    return sum(t.name == "FocusStateSampler" for t in threading.enumerate())
+
+
+class FocusStateSamplerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.backend = FakeWnfBackend()
+        self.now = 100.0
+        self.sampler = FocusStateSampler(
+            self.backend, interval=0.01, clock=lambda: self.now
+        )
+        self.changes: List[ModeChange] = []
+        self.sampler.subscribe(self.changes.append)
+
+    def test_unchanged_stamp_is_skipped(self) -> None:
+        self.assertIsNone(self.sampler.sample())
+        self.backend.write(PROFILE, b"\x01")
+        self.now = 105.0
+        self.assertEqual(self.sampler.sample(), ModeChange(0, 1, 105.0))
+        self.assertIsNone(self.sampler.sample())
+        self.assertEqual(self.backend.reads, 3)
+        self.assertEqual((self.sampler.mode, self.sampler.since), (1, 105.0))
+        self.assertEqual(self.changes, [ModeChange(0, 1, 105.0)])
+
+    def test_rewritten_mode_is_not_a_change(self) -> None:
+        self.backend.write(PROFILE, b"\x02")
+        self.sampler.sample()
+        self.backend.write(PROFILE, b"\x02")
+        self.assertIsNone(self.sampler.sample())
+        self.backend.write(PROFILE, b"\x00")
+        self.now = 110.0
+        self.sampler.sample()
+        self.assertEqual(
+            self.changes, [ModeChange(0, 2, 100.0), ModeChange(2, 0, 110.0)]
+        )
+
+    def test_unsubscribed_callbacks_are_not_called(self) -> None:
+        self.sampler.unsubscribe(self.changes.append)
+        self.backend.write(PROFILE, b"\x01")
+        self.assertIsNotNone(self.sampler.sample())
+        self.assertEqual(self.changes, [])
+
+    def test_thread_samples_until_the_last_user_stops(self) -> None:
+        self.sampler.start()
+        self.sampler.start()
+        self.backend.write(PROFILE, b"\x01")
+        for _ in range(100):
+            if self.changes:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(self.changes, [ModeChange(0, 1, 100.0)])
+        self.sampler.stop()
+        self.assertEqual(samplers(), 1)
+        self.sampler.stop()
+        self.assertEqual(samplers(), 0)
+
+    def test_restart_leaves_one_thread(self) -> None:
+        for _ in range(20):
+            self.sampler.start()
+            self.sampler.stop()
+        self.sampler.start()
+        self.assertEqual(samplers(), 1)
+        self.sampler.stop()
+        self.assertEqual(samplers(), 0)
+
+
+class SetFocusModeTest(unittest.TestCase):
+    def test_writes_the_shell_mode(self) -> None:
+        backend = FakeWnfBackend()
+        self.assertTrue(wnf.set_focus_mode(2, backend))
+        name = wnf.g_WellKnownWnfNames["WNF_SHEL_QUIET_MOMENT_SHELL_MODE_CHANGED"]
+        self.assertEqual(backend.writes, [(name, b"\x02\x00\x00\x00")])
+
+
+if __name__ == "__main__":
+    unittest.main()